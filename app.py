@@ -1,19 +1,30 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, render_template, request, jsonify, session
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 # import sys
 import bundle as buntool
 import shutil
-import logging
+import threading
+import time
 from datetime import datetime
 import uuid
 from waitress import serve
 import csv
+from jobs import JobQueue, JobQueueFull
+from uploads import StreamingUploadRequest, claim_uploaded_file
+from pdfcache import PdfCache
+from instrumentation import MetricsRegistry
+from logconfig import setup_logging
+from downloads import send_download, file_etag, zip_manifest_etag, materialize_streamed_zip
 #import boto3
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # file size limit in MB
-app.logger.setLevel(logging.DEBUG)
+# Uploads are streamed to disk and hashed as they arrive (see uploads.py).
+# MAX_FILE_SIZE caps any one file; MAX_CONTENT_LENGTH still caps the whole request.
+app.request_class = StreamingUploadRequest
+app.config['MAX_FILE_SIZE'] = int(os.environ.get('BUNTOOL_MAX_FILE_SIZE', app.config['MAX_CONTENT_LENGTH']))
 
 # s3 = boto3.client('s3')
 # bucket_name = os.environ.get('s3_bucket', 'your-default-bucket')
@@ -30,11 +41,19 @@ def is_running_in_lambda():
 
 if is_running_in_lambda():
     logs_dir = '/tmp/logs'
+    app.config['UPLOAD_SPOOL_DIR'] = os.path.join('/tmp', 'tempfiles')
 else:
     logs_dir = os.path.join('logs')
+    # same filesystem as the session temp dirs, so a finished upload is moved into one with a rename:
+    app.config['UPLOAD_SPOOL_DIR'] = 'tempfiles'
 if not os.path.exists(logs_dir):
     os.makedirs(logs_dir)
 
+# Both loggers go through one queue and one set of handlers, with each line tagged by session
+# (see logconfig.py). BUNTOOL_LOG_MODE=production logs INFO and up to logs/buntool.log instead
+# of DEBUG to a file per session.
+setup_logging(logs_dir, ('bundle_logger', app.logger.name))
+
 # Configure logging
 # # Configure upload folder and bundles output folder
 # UPLOAD_FOLDER = 'uploads'
@@ -45,18 +64,39 @@ BUNDLES_DIR = '/tmp/bundles'
 if not os.path.exists(BUNDLES_DIR):
     os.makedirs(BUNDLES_DIR)
 
+# Each bundle is written straight into its own BUNDLES_DIR/<session_id>/ and served from there.
+# Those, and the session temp dirs (which hold the inputs a streamed zip is made from), are
+# deleted once they're older than BUNTOOL_OUTPUT_TTL_HOURS; see remove_expired_sessions.
+OUTPUT_TTL_SECONDS = float(os.environ.get('BUNTOOL_OUTPUT_TTL_HOURS', '24')) * 3600
+CLEANUP_INTERVAL_SECONDS = 600
+last_cleanup = {"time": 0.0}
+cleanup_lock = threading.Lock()
+
+# Input PDFs seen before (by content) aren't parsed again; see pdfcache.py.
+# BUNTOOL_PDF_CACHE_MB=0 turns the cache off.
+PDF_CACHE_DIR = os.environ.get('BUNTOOL_PDF_CACHE_DIR', '/tmp/pdfcache')
+PDF_CACHE_MB = int(os.environ.get('BUNTOOL_PDF_CACHE_MB', '512'))
+pdf_cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MB * 1024 * 1024) if PDF_CACHE_MB > 0 else None
+
+# "stream" (the default) makes each bundle's zip as it's downloaded, from the files it lists,
+# instead of writing a copy of them all to disk up front. "file" writes the zip with the bundle.
+ZIP_MODE = os.environ.get('BUNTOOL_ZIP_MODE', 'stream')
+
 
-def save_uploaded_file(file, directory, filename=None):
+def save_uploaded_file(file, directory, filename=None, upload_hashes=None):
     # Takes in a file object, the tmpfiles directory path, and an optional filename.
     # passes the filename (supplied, or original) through secure_filename.
     # creates a filepath by joining the tmp directory and filename.
-    # saves the file to the filepath
+    # moves the already-streamed upload to the filepath (see uploads.py)
+    # and, if upload_hashes is given, records its sha256 there by filepath.
     # returns the filepath if successful, None if not.
     if file and file.filename:
         filename = secure_filename(filename) or secure_filename(file.filename)
         filepath = os.path.join(directory, filename)
-        file.save(filepath)
-        app.logger.debug(f"Saved file: {filepath}")
+        sha256 = claim_uploaded_file(file, filepath)
+        if upload_hashes is not None:
+            upload_hashes[filepath] = sha256
+        app.logger.debug(f"Saved file: {filepath} (sha256 {sha256})")
         return filepath
     return None
 
@@ -68,6 +108,17 @@ def strtobool(value: str) -> bool:
     return False
 
 
+# Job mode: build bundles on a background worker pool instead of inside the request (see jobs.py).
+# BUNTOOL_JOB_WORKERS is how many bundles are built at once, and BUNTOOL_JOB_QUEUE_DEPTH how many
+# more may wait before new requests are turned away. Each bundle carries its own BundleConfig,
+# so bundles can be built side by side; `python benchmark.py stress` checks that they don't mix.
+# The web page doesn't ask for either mode, so BUNTOOL_JOB_MODE decides for it (it handles both).
+JOB_MODE_DEFAULT = strtobool(os.environ.get('BUNTOOL_JOB_MODE', 'false'))
+JOB_WORKERS = int(os.environ.get('BUNTOOL_JOB_WORKERS', '2'))
+JOB_QUEUE_DEPTH = int(os.environ.get('BUNTOOL_JOB_QUEUE_DEPTH', '8'))
+job_queue = JobQueue(max_workers=JOB_WORKERS, max_queue_depth=JOB_QUEUE_DEPTH, logger=app.logger)
+
+
 def get_output_filename(bundle_title, case_name, timestamp, fallback="Bundle"):
     # Takes in the bundle title, case name, and a timestamp.
     # purpose is to guard against extra-long filenames.
@@ -111,7 +162,7 @@ def synchronise_csv_index(uploaded_csv_path, filename_mappings):
                 #     return
 
                 for row in reader:
-                    app.logger.debug(f"Processing row: {row}")
+                    app.logger.debug("Processing row: %s", row)
                     try:
                         if row[0] == 'Filename' and row[2] == 'Page':
                             app.logger.debug(f"..Found header row")
@@ -129,7 +180,7 @@ def synchronise_csv_index(uploaded_csv_path, filename_mappings):
 
                         row[0] = secure_name
                         writer.writerow(row)
-                        app.logger.debug(f"..Wrote processed file row: {row}")
+                        app.logger.debug("..Wrote processed file row: %s", row)
                     except Exception as e:
                         app.logger.error(f"..Error processing row {row}: {str(e)}")
                         raise
@@ -142,6 +193,166 @@ def synchronise_csv_index(uploaded_csv_path, filename_mappings):
     return sanitised_filenames_csv_path
 
 
+class BundleBuildError(Exception):
+    pass
+
+
+def build_bundle(input_files, output_file, coversheet, index_csv, bundle_config):
+    # Runs buntool.create_bundle, which writes the finished PDF and zip straight into
+    # bundle_config.output_dir (BUNDLES_DIR/<session_id>), so there's nothing to copy.
+    # In zip_mode "stream" there's no zip yet, just its manifest (see /download/zip).
+    # returns a dict of the bundle_path and zip_path for the frontend.
+    # raises BundleBuildError, with a message fit for the user, if either is missing.
+    session_id = bundle_config.session_id
+    received_output_file, zip_file_path = buntool.create_bundle(
+        input_files,
+        output_file,
+        coversheet,
+        index_csv,
+        bundle_config
+    )
+
+    if os.path.exists(received_output_file):
+        final_output_path = received_output_file
+        # hashed now, while it's in the page cache, rather than when it's first downloaded:
+        file_etag(final_output_path)
+        app.logger.debug(f"Final PDF at: {final_output_path}")
+    else:
+        app.logger.error(f"PDF file not found at: {received_output_file}")
+        raise BundleBuildError(f"Error preparing PDF file for download. Session code: {session_id}")
+
+    if zip_file_path and zip_file_path.endswith(buntool.ZIP_MANIFEST_SUFFIX) and os.path.exists(zip_file_path):
+        # the path the zip is downloaded from; it's streamed from the manifest beside it
+        final_zip_path = zip_file_path[:-len(buntool.ZIP_MANIFEST_SUFFIX)]
+        app.logger.debug(f"ZIP manifest at: {zip_file_path}")
+    elif zip_file_path and os.path.exists(zip_file_path):
+        final_zip_path = zip_file_path
+        app.logger.debug(f"Final ZIP at: {final_zip_path}")
+    else:
+        app.logger.error(f"ZIP file not found at: {zip_file_path}")
+        raise BundleBuildError(f"Error creating ZIP archive. Session code: {session_id}")
+
+    return {"bundle_path": final_output_path, "zip_path": final_zip_path}
+
+
+def remove_expired_sessions(parent_dirs, ttl_seconds, now=None):
+    # Deletes everything in parent_dirs last modified more than ttl_seconds ago: session directories,
+    # and any loose files (abandoned upload spool files, or outputs from before per-session directories).
+    # returns the number removed.
+    now = now if now is not None else time.time()
+    removed = 0
+    for parent_dir in parent_dirs:
+        if not os.path.isdir(parent_dir):
+            continue
+        for entry in os.scandir(parent_dir):
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < ttl_seconds:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+            removed += 1
+    return removed
+
+
+def maybe_remove_expired_sessions():
+    # Runs remove_expired_sessions at most every CLEANUP_INTERVAL_SECONDS. It's called as each bundle
+    # is requested rather than from a timer thread, which wouldn't run while a Lambda is frozen.
+    with cleanup_lock:
+        if time.time() - last_cleanup["time"] < CLEANUP_INTERVAL_SECONDS:
+            return
+        last_cleanup["time"] = time.time()
+    tempfiles_dir = os.path.join('/tmp', 'tempfiles') if is_running_in_lambda() else 'tempfiles'
+    try:
+        removed = remove_expired_sessions([BUNDLES_DIR, tempfiles_dir], OUTPUT_TTL_SECONDS)
+        if removed:
+            app.logger.info(f"Removed {removed} expired session directories")
+    except Exception as e:
+        app.logger.error(f"Error removing expired session directories: {str(e)}")
+
+
+def resolve_download_path(path):
+    # Only files in BUNDLES_DIR may be downloaded. returns the absolute path, or None for anything else.
+    bundles_dir = os.path.realpath(BUNDLES_DIR)
+    absolute_path = os.path.realpath(path)
+    if os.path.commonpath([absolute_path, bundles_dir]) != bundles_dir or absolute_path == bundles_dir:
+        return None
+    return absolute_path
+
+
+def run_bundle_job(job, input_files, output_file, coversheet, index_csv, bundle_config):
+    # The job queue's target: build_bundle on a worker thread, reporting each pipeline stage to the job.
+    # Unexpected errors are logged in full but only reported to the user with the session code.
+    bundle_config.progress_callback = job.update_stage
+    session_log = buntool.configure_logger(bundle_config.session_id, logs_dir)
+    try:
+        return build_bundle(input_files, output_file, coversheet, index_csv, bundle_config)
+    except BundleBuildError:
+        raise
+    except Exception as e:
+        app.logger.error(f"Fatal Error creating bundle in job {job.job_id}: {str(e)}")
+        raise BundleBuildError(f"Fatal error creating bundle. Session code: {bundle_config.session_id}")
+    finally:
+        buntool.end_session_logging(session_log)
+
+
+# Every bundle's stage timings are collected (see instrumentation.py); BUNTOOL_METRICS=true
+# publishes them at /metrics in the Prometheus text format.
+METRICS_ENABLED = strtobool(os.environ.get('BUNTOOL_METRICS', 'false'))
+metrics_registry = MetricsRegistry()
+
+# BUNTOOL_LINEARIZE=true saves bundles linearized ("fast web view"), for viewers which load them a page at a time.
+LINEARIZE_BUNDLES = strtobool(os.environ.get('BUNTOOL_LINEARIZE', 'false'))
+# BUNTOOL_OPTIMIZE_OUTPUT=true drops unused and duplicate resources from bundles before saving (see optimize.py).
+OPTIMIZE_BUNDLES = strtobool(os.environ.get('BUNTOOL_OPTIMIZE_OUTPUT', 'false'))
+# BUNTOOL_DOWNSAMPLE_IMAGES=true downsamples scanned images above BUNTOOL_IMAGE_DPI (default 150) before merging.
+# With BUNTOOL_BUNDLE_SIZE_BUDGET_MB (e.g. 100, CE-File's upload limit), only bundles whose inputs come to more
+# than that are downsampled, going below BUNTOOL_IMAGE_DPI if need be to fit (see downsample.py).
+DOWNSAMPLE_IMAGES = strtobool(os.environ.get('BUNTOOL_DOWNSAMPLE_IMAGES', 'false'))
+IMAGE_TARGET_DPI = int(os.environ.get('BUNTOOL_IMAGE_DPI', '150'))
+BUNDLE_SIZE_BUDGET_BYTES = (int(float(os.environ['BUNTOOL_BUNDLE_SIZE_BUDGET_MB']) * 1024 * 1024)
+                            if os.environ.get('BUNTOOL_BUNDLE_SIZE_BUDGET_MB') else None)
+# BUNTOOL_REUSE_PAGINATED_BODY=true also keeps each bundle's paginated body in the PDF cache, so a rebuild
+# with only titles or dates changed can skip merging and paginating. It costs a second save of every
+# other bundle's body, and puts a copy of it in the shared cache directory (and its disk space).
+REUSE_PAGINATED_BODY = strtobool(os.environ.get('BUNTOOL_REUSE_PAGINATED_BODY', 'false'))
+# BUNTOOL_MEMORY_BOUNDED_MERGE=true merges the input files a batch at a time through a file on disk, keeping the
+# process below BUNTOOL_MERGE_RSS_CEILING_MB (see bundle.merge_planned_sources_bounded), though each batch is at
+# least bundle.MIN_MERGE_BATCH_BYTES of input however near the ceiling it is. It costs extra disk I/O,
+# and /tmp needs room for twice the bundle. On Lambda it's on by default, with a ceiling of half the function's memory,
+# so a 2 GB function can take 1 GB of input files.
+MEMORY_BOUNDED_MERGE = strtobool(os.environ.get('BUNTOOL_MEMORY_BOUNDED_MERGE',
+                                                'true' if is_running_in_lambda() else 'false'))
+MERGE_RSS_CEILING_MB = int(os.environ.get('BUNTOOL_MERGE_RSS_CEILING_MB',
+                                          int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '0')) // 2)) or None
+
+# bundle.py imports its heavier libraries (the reportlab layout engine, python-docx, ...) only
+# when a bundle first needs them. BUNTOOL_PREWARM=true does that, registers the fonts and builds
+# the stylesheets now instead, so the first bundle doesn't wait for it. It's on by default for a
+# long-running server; on Lambda it's off, so cold starts stay short, unless asked for.
+PREWARM = strtobool(os.environ.get('BUNTOOL_PREWARM', 'false' if is_running_in_lambda() else 'true'))
+if PREWARM:
+    app.logger.info(f"Prewarmed bundle libraries in {buntool.prewarm():.2f}s")
+
+
+def job_mode_requested():
+    # Job mode can be switched on for the whole server (BUNTOOL_JOB_MODE)
+    # or asked for by an individual request (?job_mode=true or a job_mode form field).
+    requested = request.args.get('job_mode') or request.form.get('job_mode')
+    if requested is not None:
+        return strtobool(requested)
+    return JOB_MODE_DEFAULT
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    app.logger.error(f"Upload refused: {e.description}")
+    return jsonify({"status": "error", "message": e.description}), 413
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -157,6 +368,7 @@ def create_bundle():
     user_agent = request.headers.get('User-Agent')
     app.logger.debug(f"******************APP HEARS A CALL******************")
     app.logger.debug(f"New session ID: {session_id} {user_agent}")
+    maybe_remove_expired_sessions()
     # check if csv has been passed:
 
     # check whether input files are actually povided:
@@ -164,6 +376,7 @@ def create_bundle():
         app.logger.error(f"Cannot create bundle: No files found in form submission")
         return jsonify({"status": "error", "message": "No files found. Please add files and try again."})
 
+    session_log = None
     try:
         # Create temporary working directory in /tmp/tempfiles/{session_id}:
         if is_running_in_lambda():
@@ -177,13 +390,8 @@ def create_bundle():
         os.makedirs(temp_dir)
         app.logger.debug(f"Temporary directory created: {temp_dir}")
 
-        # Add FileHandler for session-specific logging
-        logs_path = os.path.join(logs_dir, f'buntool_{session_id}.log')
-        session_file_handler = logging.FileHandler(logs_path)
-        session_file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s-%(levelname)s-[APP]: %(message)s')
-        session_file_handler.setFormatter(formatter)
-        app.logger.addHandler(session_file_handler)
+        # Tag this thread's log lines with the session, and (in session mode) write them to its log file
+        session_log = buntool.configure_logger(session_id, logs_dir)
 
         # Get form data
         # Ingest csv index
@@ -209,6 +417,8 @@ def create_bundle():
         case_details = [bundle_title, claim_no, case_name]
         zip_bool = True  # option not implemented for GUI control.
         bookmark_setting = request.form.get('bookmark_setting')
+        # keep the TEMP0x intermediate PDFs on disk for inspection (server-side debugging only):
+        debug_intermediates = strtobool(os.environ.get('BUNTOOL_DEBUG_INTERMEDIATES', 'false'))
 
         output_file = get_output_filename(bundle_title, case_name, timestamp, footer_prefix)
         app.logger.debug(f"generated output filename: {output_file}")
@@ -216,15 +426,10 @@ def create_bundle():
         # Save uploaded files
         app.logger.debug(f"Gathering uploaded files...")
         files = request.files.getlist('files')
-        # check whether files exceed max allowed overall size of MAX_CONTENT_LENGTH:
-        total_size = sum([f.content_length for f in files])
-        if total_size > app.config['MAX_CONTENT_LENGTH']:
-            app.logger.error(
-                f"Total size of files exceeds maximum allowed size: {total_size} > {app.config['MAX_CONTENT_LENGTH']}")
-            return jsonify({"status": "error",
-                            "message": f"Total size of files exceeds maximum allowed size: {total_size} > {app.config['MAX_CONTENT_LENGTH']}"})
-        app.logger.debug(f"....{files}")
+        # size limits were already enforced while the upload streamed in (see uploads.py):
+        app.logger.debug(f"....{files} ({request.upload_bytes_received} bytes received)")
         input_files = []
+        upload_hashes = {}
         filename_mappings = {}
         for file in files:
             app.logger.debug(f"..Processing {file.filename}")
@@ -232,7 +437,7 @@ def create_bundle():
                 secure_name = secure_filename(file.filename)
                 filename_mappings[file.filename] = secure_name
                 # app.logger.debug(f"[{session_id}-{timestamp}-APP]--filename_mappings: {filename_mappings}")
-                filepath = save_uploaded_file(file, temp_dir, secure_name)
+                filepath = save_uploaded_file(file, temp_dir, secure_name, upload_hashes)
                 if filepath:
                     input_files.append(filepath)
             else:
@@ -288,6 +493,7 @@ def create_bundle():
             app.logger.info(f"........case_details: {case_details}")
             app.logger.info(f"........confidential_bool: {confidential_bool}")
             app.logger.info(f"........zip_bool: {zip_bool}")
+            app.logger.info(f"........zip_mode: {ZIP_MODE}")
             app.logger.info(f"........session_id: {session_id}")
             app.logger.info(f"........user_agent: {user_agent}")
             app.logger.info(f"........page_num_align: {page_num_align}")
@@ -300,6 +506,7 @@ def create_bundle():
             app.logger.info(f"........temp_dir: {temp_dir}")
             app.logger.info(f"........logs_dir: {logs_dir}")
             app.logger.info(f"........bookmark_setting: {bookmark_setting}")
+            app.logger.info(f"........debug_intermediates: {debug_intermediates}")
             # Create BundleConfig instance
             bundle_config = buntool.BundleConfig(
                 timestamp=timestamp,
@@ -318,47 +525,69 @@ def create_bundle():
                 roman_for_preface=roman_for_preface,
                 temp_dir=temp_dir,
                 logs_dir=logs_dir,
-                bookmark_setting=bookmark_setting
+                bookmark_setting=bookmark_setting,
+                debug_intermediates=debug_intermediates,
+                input_file_hashes=upload_hashes,
+                pdf_cache=pdf_cache,
+                reuse_paginated_body=REUSE_PAGINATED_BODY,
+                metrics_callback=metrics_registry.observe_bundle,
+                zip_mode=ZIP_MODE,
+                output_dir=os.path.join(BUNDLES_DIR, session_id),
+                linearize=LINEARIZE_BUNDLES,
+                optimize_output=OPTIMIZE_BUNDLES,
+                downsample_images=DOWNSAMPLE_IMAGES,
+                image_target_dpi=IMAGE_TARGET_DPI,
+                size_budget_bytes=BUNDLE_SIZE_BUDGET_BYTES,
+                memory_bounded_merge=MEMORY_BOUNDED_MERGE,
+                merge_rss_ceiling_mb=MERGE_RSS_CEILING_MB
             )
 
-            received_output_file, zip_file_path = buntool.create_bundle(
+            if job_mode_requested():
+                # Hand the bundle to the job queue and return straight away.
+                # The browser polls /jobs/<job_id> and fetches /jobs/<job_id>/result.
+                try:
+                    job = job_queue.submit(
+                        run_bundle_job,
+                        input_files,
+                        output_file,
+                        secure_coversheet_filename,
+                        sanitised_filenames_index_csv,
+                        bundle_config,
+                        session_id=session_id
+                    )
+                except JobQueueFull as e:
+                    app.logger.error(f"Cannot queue bundle: {e}")
+                    return jsonify({"status": "error",
+                                    "message": f"BunTool is busy right now. Please try again in a minute. Session code: {session_id}"}), 503, {"Retry-After": "30"}
+                app.logger.info(f"Queued bundle as job {job.job_id}")
+                return jsonify({
+                    "status": "queued",
+                    "message": "Bundle queued.",
+                    "job_id": job.job_id,
+                    "status_url": f"/jobs/{job.job_id}",
+                    "result_url": f"/jobs/{job.job_id}/result"
+                }), 202
+
+            bundle_paths = build_bundle(
                 input_files,
                 output_file,
                 secure_coversheet_filename,
                 sanitised_filenames_index_csv,
                 bundle_config
             )
-
-            # Copy both files to bundles folder
-            if os.path.exists(received_output_file):
-                final_output_path = os.path.join(BUNDLES_DIR, os.path.basename(received_output_file))
-                shutil.copy2(received_output_file, final_output_path)
-                app.logger.debug(f"Copied final PDF to: {final_output_path}")
-            else:
-                app.logger.error(f"PDF file not found at: {received_output_file}")
-                return jsonify({"status": "error",
-                                "message": f"Error preparing PDF file for download. Session code: {session_id}"}), 500
-
-            if os.path.exists(zip_file_path):
-                final_zip_path = os.path.join(BUNDLES_DIR, os.path.basename(zip_file_path))
-                shutil.copy2(zip_file_path, final_zip_path)
-                app.logger.debug(f"Copied final ZIP to: {final_zip_path}")
-            else:
-                app.logger.error(f"ZIP file not found at: {zip_file_path}")
-                return jsonify(
-                    {"status": "error", "message": f"Error creating ZIP archive. Session code: {session_id}"}), 500
-
             return jsonify({
                 "status": "success",
                 "message": "Bundle created successfully!",
-                "bundle_path": final_output_path,
-                "zip_path": final_zip_path
+                **bundle_paths
             })
 
+        except BundleBuildError as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+
         except Exception as e:
             app.logger.error(f"Fatal Error creating bundle: {str(e)}")
             return jsonify(
-                {"status": "error", "message": "Fatal error creating bundle. Session code: {session_id}"}), 500
+                {"status": "error", "message": f"Fatal error creating bundle. Session code: {session_id}"}), 500
 
     except Exception as e:
         app.logger.error(f"Fatal Error in processing bundle: {str(e)}")
@@ -366,9 +595,8 @@ def create_bundle():
             {"status": "error", "message": f"Fatal error in creating bundle. Session code: {session_id}"}), 500
 
     finally:
-        # Remove the session FileHandler to prevent duplicate logs
-        if session_file_handler and session_file_handler in app.logger.handlers:
-            app.logger.removeHandler(session_file_handler)
+        # Close the session log file and stop tagging this thread's lines with the session
+        buntool.end_session_logging(session_log)
 
         # try:
         #     # Upload logs to s3:
@@ -388,18 +616,25 @@ def create_bundle():
         #     pass
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"status": "error", "message": "Metrics are not enabled."}), 404
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/download/bundle', methods=['GET'])
 def download_bundle():
     bundle_path = request.args.get('path')
     if not bundle_path:
         return jsonify({"status": "error", "message": f"Download Error: Bundle download path could not be found."}), 400
 
-    absolute_path = os.path.abspath(bundle_path)
-    if not os.path.exists(absolute_path):
+    absolute_path = resolve_download_path(bundle_path)
+    if not absolute_path or not os.path.exists(absolute_path):
         return jsonify(
             {"status": "error", "message": f"Download Error: bundle does not exist in expected location."}), 404
 
-    return send_file(absolute_path, as_attachment=True)
+    return send_download(absolute_path)
 
 
 @app.route('/download/zip', methods=['GET'])
@@ -408,11 +643,60 @@ def download_zip():
     if not zip_path:
         return jsonify({"status": "error", "message": f"Download Error: Zip download path could not be found."}), 400
 
-    absolute_path = os.path.abspath(zip_path)
-    if not os.path.exists(absolute_path):
+    absolute_path = resolve_download_path(zip_path)
+    if not absolute_path:
         return jsonify({"status": "error", "message": f"Download Error: zip does not exist in expected location."}), 404
+    if os.path.exists(absolute_path):
+        return send_download(absolute_path)
 
-    return send_file(absolute_path, as_attachment=True)
+    # zip_mode "stream": make the zip from its manifest as it's sent
+    manifest_path = absolute_path + buntool.ZIP_MANIFEST_SUFFIX
+    if not os.path.exists(manifest_path):
+        return jsonify({"status": "error", "message": f"Download Error: zip does not exist in expected location."}), 404
+    zip_entries = buntool.read_zip_manifest(manifest_path)
+    missing_files = [path for path, arcname in zip_entries if not os.path.exists(path)]
+    if missing_files:
+        app.logger.error(f"Cannot stream zip {absolute_path}: missing {missing_files}")
+        return jsonify({"status": "error", "message": f"Download Error: the files for this zip have expired."}), 404
+    etag = zip_manifest_etag(zip_entries)
+    if request.range:
+        # resuming a download: write the zip out once, and serve the range from it (see downloads.py)
+        app.logger.debug(f"Range requested for streamed zip {absolute_path}: writing it out")
+        materialize_streamed_zip(zip_entries, absolute_path, etag)
+        return send_download(absolute_path)
+    response = app.response_class(
+        buntool.stream_zip(zip_entries),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="{os.path.basename(absolute_path)}"',
+                 "Accept-Ranges": "bytes"}
+    )
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": f"No such job: it may have expired."}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": f"No such job: it may have expired."}), 404
+    if job.status == "done":
+        return jsonify({
+            "status": "success",
+            "message": "Bundle created successfully!",
+            **job.result
+        })
+    if job.status == "failed":
+        return jsonify({"status": "error", "message": job.error}), 500
+    # still queued or running:
+    return jsonify(job.to_dict()), 202
 
 
 if __name__ == '__main__':
@@ -0,0 +1,758 @@
+'''
+Benchmarks for the slow parts of bundle creation.
+Each measurement runs in a fresh process so that peak memory (RSS)
+belongs to that measurement alone. Results are printed as JSON.
+
+Usage:
+    python benchmark.py stages --corpus small medium large
+    python benchmark.py pagination --pages 100 1000 5000
+    python benchmark.py stress --bundles 16 --threads 4
+    python benchmark.py rebuild --pages 2000
+    python benchmark.py save --corpus medium --mbps 5 --letterhead
+    python benchmark.py imports
+    python benchmark.py engines --pages 1000 5000
+    python benchmark.py merge --mb 1024 --ceiling 1024
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from reportlab.lib.pagesizes import A3, A4, landscape, letter
+from reportlab.pdfgen import canvas
+
+import bundle
+from instrumentation import current_rss_mb, peak_rss_mb
+from pdfcache import PdfCache
+
+PAGINATION_ENGINES = ["overlay_pypdf", "overlay_pikepdf", "stamp"]
+
+# Synthetic input sets for the stages benchmark. Page counts per file run from 1 to
+# max_pages, mostly short with a long tail, as real exhibits are.
+CORPORA = {
+    "small": {"files": 10, "max_pages": 500},
+    "medium": {"files": 200, "max_pages": 500},
+    "large": {"files": 2000, "max_pages": 500},
+}
+CORPUS_PAGE_SIZES = (A4, letter, landscape(A4), A3)
+TITLE_WORDS = ("witness statement of the claimant exhibit correspondence between solicitors regarding "
+               "disclosure schedule of loss expert report supplemental appendix minutes meeting").split()
+
+
+def make_letterhead_image(path, width=1200, height=300, seed=0):
+    '''
+    Write a noisy (so poorly compressible) PNG for make_synthetic_pdf's letterhead,
+    standing in for the logo or scanner artefacts many exhibits share.
+    '''
+    from PIL import Image
+
+    rng = random.Random(seed)
+    Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3)).save(path)
+    return path
+
+
+def make_synthetic_pdf(path, number_of_pages, page_sizes=(A4, letter), letterhead=None):
+    '''
+    Write a PDF of number_of_pages pages with a line of text on each,
+    cycling through page_sizes, and the image at letterhead (if given) at the top of each.
+    '''
+    pdf_canvas = canvas.Canvas(path)
+    for idx in range(number_of_pages):
+        pdf_canvas.setPageSize(page_sizes[idx % len(page_sizes)])
+        if letterhead:
+            pdf_canvas.drawImage(letterhead, 72, 740, width=300, height=75)
+        pdf_canvas.setFont("Helvetica", 11)
+        pdf_canvas.drawString(72, 720, f"Synthetic page {idx + 1} of {os.path.basename(path)}")
+        pdf_canvas.showPage()
+    pdf_canvas.save()
+    return path
+
+
+def benchmark_config(work_dir, **overrides):
+    '''
+    A BundleConfig with the frontend defaults, for benchmarks.
+    '''
+    settings = dict(
+        timestamp=None,
+        case_details=["Benchmark Bundle", "BM-0001", "Benchmark v Synthetic"],
+        csv_string=None,
+        confidential_bool=False,
+        zip_bool=True,
+        session_id="benchmark",
+        user_agent="benchmark.py",
+        page_num_align="right",
+        index_font="sans",
+        footer_font="sans",
+        page_num_style="page_x_of_y",
+        footer_prefix="A",
+        date_setting="uk_abbreviated_date",
+        roman_for_preface=False,
+        temp_dir=work_dir,
+        logs_dir=os.path.join(work_dir, "logs"),
+        bookmark_setting="tab-title",
+    )
+    settings.update(overrides)
+    return bundle.BundleConfig(**settings)
+
+
+def _paginate_once(engine, input_file, work_dir, results):
+    from pikepdf import Pdf
+
+    config = benchmark_config(work_dir)
+    footer_settings = (config.page_num_align, config.footer_font, config.page_num_style, config.footer_prefix)
+    output_file = os.path.join(work_dir, f"paginated_{engine}.pdf")
+    start = time.perf_counter()
+    if engine == "overlay_pypdf":
+        page_count = bundle.pdf_paginator_reportlab(input_file, output_file, 2, *footer_settings, pdf_engine="pypdf")
+    else:
+        open_pdfs = []
+        with Pdf.open(input_file) as pdf:
+            total_number_of_pages = len(pdf.pages) + 2
+            if engine == "overlay_pikepdf":
+                page_count = bundle.paginate_pdf_in_memory(pdf, open_pdfs, 2, total_number_of_pages, *footer_settings)
+            else:
+                page_count = bundle.stamp_page_numbers_in_memory(pdf, 2, total_number_of_pages, *footer_settings)
+            pdf.save(output_file)
+        bundle.close_open_pdfs(open_pdfs)
+    elapsed = time.perf_counter() - start
+    results.put({
+        "benchmark": "pagination",
+        "engine": engine,
+        "pages": page_count,
+        "seconds": round(elapsed, 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "output_bytes": os.path.getsize(output_file),
+    })
+
+
+def run_in_child(target, *args):
+    '''
+    Run target(*args, results_queue) in a fresh process and return what it put on the queue.
+    '''
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    child = context.Process(target=target, args=(*args, results))
+    child.start()
+    result = results.get()
+    child.join()
+    return result
+
+
+def benchmark_pagination(page_counts, engines=PAGINATION_ENGINES):
+    '''
+    Time each pagination engine on a synthetic bundle of each size.
+    overlay_pypdf is the reportlab footer PDF + pypdf merge_scaled_page path,
+    overlay_pikepdf overlays the same footer PDF with pikepdf,
+    and stamp writes the footers into each page's content stream.
+    '''
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="buntool_bench_")
+    try:
+        for number_of_pages in page_counts:
+            input_file = make_synthetic_pdf(os.path.join(work_dir, f"input_{number_of_pages}.pdf"), number_of_pages)
+            for engine in engines:
+                results.append(run_in_child(_paginate_once, engine, input_file, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _stress_bundle(bundle_number, work_dir, page_number_engine):
+    '''
+    Make one bundle for the stress test, in its own directory (create_bundle
+    deletes its inputs when it's done). Each bundle gets a different number of
+    files, pages, and footer prefix, and every other one a coversheet, so that
+    any settings leaking between concurrent bundles show up in the page numbers.
+    '''
+    bundle_dir = os.path.join(work_dir, f"bundle_{bundle_number}")
+    os.makedirs(bundle_dir)
+    input_files = []
+    index_rows = ["Filename,Title,Date,Section"]
+    for file_number in range(2 + bundle_number % 3):
+        filename = f"doc_{bundle_number}_{file_number}.pdf"
+        input_files.append(make_synthetic_pdf(os.path.join(bundle_dir, filename), 3 + (bundle_number * 7 + file_number) % 11))
+        index_rows.append(f"{filename},Document {file_number} of bundle {bundle_number},2024-01-{file_number + 1:02d},0")
+    index_file = os.path.join(bundle_dir, "index.csv")
+    with open(index_file, "w") as f:
+        f.write("\n".join(index_rows) + "\n")
+    coversheet = None
+    if bundle_number % 2:
+        coversheet = "coversheet.pdf"
+        make_synthetic_pdf(os.path.join(bundle_dir, coversheet), 1 + bundle_number % 3)
+    footer_prefix = f"S{bundle_number}"
+    config = benchmark_config(bundle_dir, session_id=f"stress{bundle_number}", footer_prefix=footer_prefix,
+                              page_number_engine=page_number_engine)
+    output_file, _ = bundle.create_bundle(input_files, f"stress_{bundle_number}.pdf", coversheet, index_file, config)
+    return check_stress_bundle(output_file, footer_prefix, coversheet_length=(1 + bundle_number % 3) if coversheet else 0)
+
+
+def check_stress_bundle(output_file, footer_prefix, coversheet_length):
+    '''
+    Read back the footer of every page after the coversheet and check it
+    says "<prefix> Page n of total" for that page.
+    '''
+    import pdfplumber
+
+    failures = []
+    with pdfplumber.open(output_file) as pdf:
+        total_number_of_pages = len(pdf.pages)
+        for page_idx in range(coversheet_length, total_number_of_pages):
+            page = pdf.pages[page_idx]
+            footer_text = page.within_bbox((0, page.height - 60, page.width, page.height)).extract_text().strip()
+            expected = f"{footer_prefix} Page {page_idx + 1} of {total_number_of_pages}"
+            if footer_text != expected:
+                failures.append({"file": os.path.basename(output_file), "page": page_idx + 1,
+                                 "expected": expected, "found": footer_text})
+    return total_number_of_pages, failures
+
+
+def benchmark_stress(number_of_bundles, threads, page_number_engine="stamp"):
+    '''
+    Build number_of_bundles bundles at once on a pool of threads in this one
+    process, as the web server does, and check every page number in every bundle.
+    '''
+    work_dir = tempfile.mkdtemp(prefix="buntool_stress_")
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(
+                lambda bundle_number: _stress_bundle(bundle_number, work_dir, page_number_engine),
+                range(number_of_bundles)
+            ))
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    failures = [failure for _, bundle_failures in results for failure in bundle_failures]
+    return [{
+        "benchmark": "stress",
+        "engine": page_number_engine,
+        "bundles": number_of_bundles,
+        "threads": threads,
+        "pages_checked": sum(page_count for page_count, _ in results),
+        "seconds": round(elapsed, 4),
+        "failures": failures,
+    }]
+
+
+def _build_for_rebuild(source_dir, work_dir, run_name, titles, pdf_cache):
+    '''
+    Build a bundle from the PDFs in source_dir, titled from titles, in a fresh
+    copy of them (create_bundle deletes its inputs). Returns (seconds, output file).
+    '''
+    run_dir = os.path.join(work_dir, run_name)
+    shutil.copytree(source_dir, run_dir)
+    filenames = sorted(os.listdir(source_dir))
+    index_file = os.path.join(run_dir, "index.csv")
+    with open(index_file, "w") as f:
+        f.write("Filename,Title,Date,Section\n")
+        for filename, title in zip(filenames, titles):
+            f.write(f"{filename},{title},2024-01-01,0\n")
+    input_files = [os.path.join(run_dir, filename) for filename in filenames]
+    config = benchmark_config(run_dir, session_id=run_name, zip_bool=False, pdf_cache=pdf_cache,
+                              reuse_paginated_body=True)
+    start = time.perf_counter()
+    output_file, _ = bundle.create_bundle(input_files, f"{run_name}.pdf", None, index_file, config)
+    return time.perf_counter() - start, output_file
+
+
+def benchmark_rebuild(number_of_pages, pages_per_file=20):
+    '''
+    Build a bundle of number_of_pages pages, then rebuild it with one title changed,
+    as a user fixing the index would. The rebuild should reuse the paginated body
+    from the PDF cache. Both bundles' page numbers are checked.
+    '''
+    work_dir = tempfile.mkdtemp(prefix="buntool_rebuild_")
+    try:
+        source_dir = os.path.join(work_dir, "source")
+        os.makedirs(source_dir)
+        number_of_files = max(1, number_of_pages // pages_per_file)
+        for file_number in range(number_of_files):
+            make_synthetic_pdf(os.path.join(source_dir, f"exhibit_{file_number:04}.pdf"), pages_per_file)
+        titles = [f"Exhibit {file_number}" for file_number in range(number_of_files)]
+        pdf_cache = PdfCache(os.path.join(work_dir, "pdfcache"), 10 * 1024 * 1024 * 1024)
+        first_seconds, first_output = _build_for_rebuild(source_dir, work_dir, "first", titles, pdf_cache)
+        titles[0] = "Exhibit 0 (corrected)"
+        rebuild_seconds, rebuild_output = _build_for_rebuild(source_dir, work_dir, "rebuild", titles, pdf_cache)
+        failures = []
+        for output_file in (first_output, rebuild_output):
+            _, output_failures = check_stress_bundle(output_file, "A", coversheet_length=0)
+            failures.extend(output_failures)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return [{
+        "benchmark": "rebuild",
+        "pages": number_of_files * pages_per_file,
+        "first_build_seconds": round(first_seconds, 4),
+        "rebuild_seconds": round(rebuild_seconds, 4),
+        "failures": failures,
+    }]
+
+
+def make_corpus(corpus_dir, number_of_files, max_pages, seed=0, letterhead=None):
+    '''
+    Write a synthetic input set to corpus_dir: number_of_files PDFs of 1 to max_pages
+    pages (always including one of each), on mixed page sizes, and an index.csv with
+    titles from a few words to several lines long and a section break every few files.
+    With letterhead (an image path), every PDF carries its own copy of that image.
+    Returns the total number of pages.
+    '''
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir)
+    page_counts = [min(max_pages, max(1, int(rng.lognormvariate(2.0, 1.2)))) for _ in range(number_of_files)]
+    page_counts[0] = 1
+    page_counts[-1] = max_pages
+    index_rows = ["filename,title,date,section"]
+    section_count = 0
+    for file_number, number_of_pages in enumerate(page_counts):
+        if file_number == 0 or rng.random() < 0.1:
+            section_count += 1
+            index_rows.append(f"SECTION_BREAK_{section_count},Part {section_count}: {' '.join(rng.choices(TITLE_WORDS, k=rng.randint(1, 8)))},,1")
+        filename = f"exhibit_{file_number:04}.pdf"
+        page_sizes = rng.sample(CORPUS_PAGE_SIZES, rng.randint(1, len(CORPUS_PAGE_SIZES)))
+        make_synthetic_pdf(os.path.join(corpus_dir, filename), number_of_pages, page_sizes, letterhead)
+        title = f"Exhibit {file_number + 1} {' '.join(rng.choices(TITLE_WORDS, k=rng.choice([3, 8, 20, 60])))}"
+        index_rows.append(f"{filename},{title},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},0")
+    with open(os.path.join(corpus_dir, "index.csv"), "w") as f:
+        f.write("\n".join(index_rows) + "\n")
+    return sum(page_counts)
+
+
+def _stages_once(corpus_dir, work_dir, options, results):
+    run_dir = os.path.join(work_dir, "run")
+    # create_bundle deletes its inputs, so give it links to the corpus rather than the corpus:
+    shutil.copytree(corpus_dir, run_dir, copy_function=os.link)
+    input_files = sorted(os.path.join(run_dir, f) for f in os.listdir(run_dir) if f.endswith(".pdf"))
+    records = []
+    config = benchmark_config(run_dir, metrics_callback=records.append, **options)
+    bundle.create_bundle(input_files, "stages.pdf", None, os.path.join(run_dir, "index.csv"), config)
+    # create_bundle's own metrics record (see instrumentation.py) has the per-stage numbers:
+    results.put(records[0])
+
+
+def benchmark_stages(corpus_names, options=None):
+    '''
+    Build a bundle from each synthetic corpus (see CORPORA) in a fresh process,
+    and report create_bundle's metrics record for it: wall time, CPU time and
+    memory for every stage (see bundle.BUNDLE_STAGES and instrumentation.py).
+    A stage's rss_mb is the process's resident memory at the end of that stage, and
+    rss_growth_mb how much it grew during it (see instrumentation.current_rss_mb);
+    peak_rss_mb is its peak during the stage (see instrumentation.reset_stage_peak).
+    options are BundleConfig overrides, e.g. roman_for_preface=True to time the
+    roman labels, or predict_toc_length=False to time the dummy TOC pass ("dummy_toc").
+    '''
+    options = options if options else {}
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="buntool_stages_")
+    try:
+        for corpus_name in corpus_names:
+            corpus = CORPORA[corpus_name]
+            corpus_dir = os.path.join(work_dir, corpus_name)
+            generate_start = time.perf_counter()
+            number_of_pages = make_corpus(corpus_dir, corpus["files"], corpus["max_pages"])
+            generate_seconds = time.perf_counter() - generate_start
+            run_dir = os.path.join(work_dir, f"{corpus_name}_work")
+            os.makedirs(run_dir)
+            result = run_in_child(_stages_once, corpus_dir, run_dir, options)
+            results.append({
+                "benchmark": "stages",
+                "corpus": corpus_name,
+                "files": corpus["files"],
+                "pages": number_of_pages,
+                "options": options,
+                "generate_seconds": round(generate_seconds, 4),
+                **result,
+            })
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+            shutil.rmtree(run_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def first_page_bytes(path):
+    '''
+    How much of the PDF at path a viewer must fetch before it can show the first page:
+    the end of the first page section (/E in the linearization dictionary) if it's
+    linearized, or else the whole file, whose cross-reference table is at the end.
+    '''
+    with open(path, "rb") as f:
+        head = f.read(1024)
+    if b"/Linearized" in head:
+        match = re.search(rb"/E\s+(\d+)", head)
+        if match:
+            return int(match.group(1))
+    return os.path.getsize(path)
+
+
+def _save_once(corpus_dir, work_dir, options, results):
+    run_dir = os.path.join(work_dir, "run")
+    shutil.copytree(corpus_dir, run_dir, copy_function=os.link)
+    input_files = sorted(os.path.join(run_dir, f) for f in os.listdir(run_dir) if f.endswith(".pdf"))
+    records = []
+    config = benchmark_config(run_dir, zip_bool=False, metrics_callback=records.append, **options)
+    output_file, _ = bundle.create_bundle(input_files, "save.pdf", None, os.path.join(run_dir, "index.csv"), config)
+    stages = records[0]["stages"]
+    results.put({
+        "save_seconds": stages["save"]["wall_seconds"],
+        "optimize_seconds": stages["optimize"]["wall_seconds"] if "optimize" in stages else None,
+        "deduplicated_bytes": records[0].get("deduplicated_bytes"),
+        "resources_removed": records[0].get("resources_removed"),
+        "bundle_seconds": records[0]["wall_seconds"],
+        "output_bytes": os.path.getsize(output_file),
+        "first_page_bytes": first_page_bytes(output_file),
+    })
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+
+# the ways of saving a bundle `benchmark.py save` compares, as BundleConfig overrides:
+SAVE_VARIANTS = {
+    "plain": {},
+    "linearize": {"linearize": True},
+    "optimize": {"optimize_output": True},
+}
+
+
+def benchmark_save(corpus_names, mbps, letterhead=False):
+    '''
+    Build each corpus's bundle plain, linearized (BundleConfig.linearize) and
+    optimized (BundleConfig.optimize_output). Compare the cost of saving it with
+    its size and how soon a viewer downloading it at mbps megabits per second
+    could show the first page. With letterhead, every input file carries its own
+    copy of the same image, which optimize_output should store just once.
+    '''
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="buntool_save_")
+    try:
+        letterhead_path = make_letterhead_image(os.path.join(work_dir, "letterhead.png")) if letterhead else None
+        for corpus_name in corpus_names:
+            corpus = CORPORA[corpus_name]
+            corpus_dir = os.path.join(work_dir, corpus_name)
+            number_of_pages = make_corpus(corpus_dir, corpus["files"], corpus["max_pages"], letterhead=letterhead_path)
+            for variant, options in SAVE_VARIANTS.items():
+                run_dir = os.path.join(work_dir, f"{corpus_name}_work")
+                os.makedirs(run_dir)
+                result = run_in_child(_save_once, corpus_dir, run_dir, options)
+                shutil.rmtree(run_dir, ignore_errors=True)
+                results.append({
+                    "benchmark": "save",
+                    "corpus": corpus_name,
+                    "pages": number_of_pages,
+                    "letterhead": letterhead,
+                    "variant": variant,
+                    **result,
+                    "first_page_seconds": round(result["first_page_bytes"] * 8 / (mbps * 1000 * 1000), 4),
+                    "download_seconds": round(result["output_bytes"] * 8 / (mbps * 1000 * 1000), 4),
+                })
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+LINKS_PER_TOC_PAGE = 40
+
+
+def _pdf_engine_once(pdf_engine, input_file, footer_file, work_dir, results):
+    # open the bundle (and read its pages), overlay the footers, then add TOC links, each through a file,
+    # as the file-based helpers do
+    if pdf_engine == "pypdf":
+        from pypdf import PdfReader
+
+        def parse(path):
+            return len(PdfReader(path).pages)
+    else:
+        from pikepdf import Pdf
+
+        def parse(path):
+            with Pdf.open(path) as pdf:
+                return len(pdf.pages)
+    start = time.perf_counter()
+    number_of_pages = parse(input_file)
+    parse_seconds = time.perf_counter() - start
+    footered_file = os.path.join(work_dir, f"footered_{pdf_engine}.pdf")
+    start = time.perf_counter()
+    bundle.add_footer_to_bundle(input_file, footer_file, footered_file, pdf_engine)
+    overlay_seconds = time.perf_counter() - start
+    annotations = [{"toc_page": idx // LINKS_PER_TOC_PAGE, "destination_page": idx,
+                    "coords": (40, 40 + (idx % LINKS_PER_TOC_PAGE) * 18, 550, 55 + (idx % LINKS_PER_TOC_PAGE) * 18)}
+                   for idx in range(0, number_of_pages, 10)]
+    linked_file = os.path.join(work_dir, f"linked_{pdf_engine}.pdf")
+    start = time.perf_counter()
+    bundle.add_annotations_with_transform(footered_file, annotations, linked_file, pdf_engine)
+    links_seconds = time.perf_counter() - start
+    results.put({
+        "benchmark": "engines",
+        "engine": pdf_engine,
+        "pages": number_of_pages,
+        "links": len(annotations),
+        "parse_seconds": round(parse_seconds, 4),
+        "overlay_seconds": round(overlay_seconds, 4),
+        "links_seconds": round(links_seconds, 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "output_bytes": os.path.getsize(linked_file),
+    })
+
+
+def benchmark_pdf_engines(page_counts, pdf_engines=bundle.PDF_ENGINES):
+    '''
+    Compare the PDF libraries the file-based helpers can use (bundle.PDF_ENGINES):
+    the time each takes to parse a synthetic bundle, overlay its footers
+    (add_footer_to_bundle) and add a TOC link for every tenth page
+    (add_annotations_with_transform).
+    '''
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="buntool_engines_")
+    try:
+        for number_of_pages in page_counts:
+            input_file = make_synthetic_pdf(os.path.join(work_dir, f"input_{number_of_pages}.pdf"), number_of_pages)
+            footer_file = os.path.join(work_dir, f"footers_{number_of_pages}.pdf")
+            config = benchmark_config(work_dir)
+            bundle.generate_footer_pages_reportlab(footer_file, number_of_pages, bundle.bind_footer_config(
+                2, number_of_pages + 2, config.page_num_align, config.footer_font, config.page_num_style,
+                config.footer_prefix))
+            for pdf_engine in pdf_engines:
+                results.append(run_in_child(_pdf_engine_once, pdf_engine, input_file, footer_file, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+SCANNED_PAGE_KB = 400  # about what a 150 dpi colour scan of an A4 page comes to
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def make_scanned_corpus(corpus_dir, total_mb, pages_per_file=25, seed=0):
+    '''
+    Write about total_mb MB of "scanned" PDFs to corpus_dir, with an index.csv: each page is
+    a full-page image of random (so incompressible) pixels, stored as it is, and no two pages
+    share one. Returns the total number of pages.
+    '''
+    from pikepdf import Dictionary, Name, Pdf, Stream
+
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir)
+    side = int((SCANNED_PAGE_KB * 1024 / 3) ** 0.5)
+    number_of_pages = max(1, total_mb * 1024 // SCANNED_PAGE_KB)
+    index_rows = ["filename,title,date,section"]
+    for file_number, first_page in enumerate(range(0, number_of_pages, pages_per_file)):
+        filename = f"scan_{file_number:04}.pdf"
+        with Pdf.new() as pdf:
+            for _ in range(min(pages_per_file, number_of_pages - first_page)):
+                page = pdf.add_blank_page(page_size=A4)
+                image = Stream(pdf, rng.randbytes(side * side * 3), Type=Name.XObject, Subtype=Name.Image,
+                               Width=side, Height=side, ColorSpace=Name.DeviceRGB, BitsPerComponent=8)
+                page.Resources = Dictionary(XObject=Dictionary(Im0=image))
+                page.Contents = pdf.make_stream(f"q {A4[0]} 0 0 {A4[1]} 0 0 cm /Im0 Do Q".encode())
+            pdf.save(os.path.join(corpus_dir, filename))
+        index_rows.append(f"{filename},Scanned exhibit {file_number + 1},2024-01-{file_number % 28 + 1:02d},0")
+    with open(os.path.join(corpus_dir, "index.csv"), "w") as f:
+        f.write("\n".join(index_rows) + "\n")
+    return number_of_pages
+
+
+def _merge_once(corpus_dir, work_dir, options, results):
+    run_dir = os.path.join(work_dir, "run")
+    shutil.copytree(corpus_dir, run_dir, copy_function=os.link)
+    input_files = sorted(os.path.join(run_dir, f) for f in os.listdir(run_dir) if f.endswith(".pdf"))
+    # ru_maxrss counts the pages of files opened with mmap, which the kernel can drop, so
+    # sample the memory that can't be dropped (current_rss_mb) while the bundle is made:
+    peak = {"rss_mb": current_rss_mb()}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak["rss_mb"] = max(peak["rss_mb"], current_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    records = []
+    config = benchmark_config(run_dir, zip_bool=False, metrics_callback=records.append, **options)
+    try:
+        output_file, _ = bundle.create_bundle(input_files, "merge.pdf", None, os.path.join(run_dir, "index.csv"), config)
+    finally:
+        done.set()
+        sampler.join()
+    stages = records[0]["stages"]
+    results.put({
+        "merge_seconds": stages["merge"]["wall_seconds"],
+        "paginate_seconds": stages["paginate"]["wall_seconds"],
+        "save_seconds": stages["save"]["wall_seconds"],
+        "bundle_seconds": records[0]["wall_seconds"],
+        "peak_anon_rss_mb": round(peak["rss_mb"], 1),
+        "process_peak_rss_mb": records[0]["process_peak_rss_mb"],
+        "total_pages": records[0]["total_pages"],
+        "output_bytes": os.path.getsize(output_file),
+    })
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def benchmark_merge(total_mb, rss_ceiling_mb=None):
+    '''
+    Build a bundle from about total_mb MB of scanned exhibits (see make_scanned_corpus)
+    with the ordinary merge and with memory_bounded_merge (under rss_ceiling_mb, if given),
+    and compare their time and peak memory. The bounded merge fails the check if it
+    goes over the ceiling, or if its bundle has a different number of pages.
+    '''
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="buntool_merge_")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        number_of_pages = make_scanned_corpus(corpus_dir, total_mb)
+        input_bytes = sum(os.path.getsize(os.path.join(corpus_dir, f)) for f in os.listdir(corpus_dir))
+        variants = {"in_memory": {},
+                    "bounded": {"memory_bounded_merge": True, "merge_rss_ceiling_mb": rss_ceiling_mb}}
+        for variant, options in variants.items():
+            run_dir = os.path.join(work_dir, f"{variant}_work")
+            os.makedirs(run_dir)
+            result = run_in_child(_merge_once, corpus_dir, run_dir, options)
+            shutil.rmtree(run_dir, ignore_errors=True)
+            results.append({
+                "benchmark": "merge",
+                "variant": variant,
+                "input_pages": number_of_pages,
+                "input_mb": round(input_bytes / 1024 / 1024, 1),
+                "rss_ceiling_mb": options.get("merge_rss_ceiling_mb"),
+                **result,
+            })
+        in_memory, bounded = results
+        bounded["failures"] = sum([
+            bool(rss_ceiling_mb) and bounded["peak_anon_rss_mb"] > rss_ceiling_mb,
+            bounded["total_pages"] != in_memory["total_pages"],
+        ])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# the modules `benchmark.py imports` times a cold import of; app is what a Lambda imports first:
+IMPORT_TIMED_MODULES = ("bundle", "app")
+IMPORTS_REPORTED = 10
+
+
+def _cold_import(module_name, work_dir):
+    # import module_name in a fresh interpreter with -X importtime, from an empty working
+    # directory (app.py makes its logs and tempfiles dirs there), and with prewarming off
+    code = (f"import json, sys, time\n"
+            f"import {module_name}\n"
+            f"import bundle\n"
+            f"lazy_loaded = [m for m in bundle.LAZY_IMPORTED_MODULES if m in sys.modules]\n"
+            f"print(json.dumps({{'lazy_loaded': lazy_loaded, 'prewarm_seconds': bundle.prewarm()}}))\n")
+    env = dict(os.environ, BUNTOOL_PREWARM="false",
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                        os.environ.get("PYTHONPATH")])))
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=work_dir, env=env,
+                               capture_output=True, text=True, check=True)
+    # importtime lists each module after everything it imported, indented two spaces a level,
+    # so module_name's direct imports are the two-space lines just before its own:
+    direct_imports = {}  # module -> cumulative microseconds
+    import_microseconds = 0
+    for line in completed.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if not match:
+            continue
+        microseconds, depth, name = int(match.group(1)), len(match.group(2)), match.group(3)
+        if depth == 0 and name == module_name:
+            import_microseconds = microseconds
+            break
+        if depth == 0:
+            direct_imports = {}  # something imported before module_name
+        elif depth == 2:
+            direct_imports[name] = microseconds
+    child_result = json.loads(completed.stdout.strip().splitlines()[-1])
+    heaviest = sorted(direct_imports.items(), key=lambda item: -item[1])[:IMPORTS_REPORTED]
+    return {
+        "import_seconds": round(import_microseconds / 1e6, 4),
+        "prewarm_seconds": round(child_result["prewarm_seconds"], 4),
+        "lazy_modules_imported": child_result["lazy_loaded"],
+        "heaviest_imports": {name: round(microseconds / 1e6, 4) for name, microseconds in heaviest},
+    }
+
+
+def benchmark_imports(module_names=IMPORT_TIMED_MODULES):
+    '''
+    Time a cold import of each module, as a Lambda cold start would do it, and
+    then bundle.prewarm() (the work the first bundle would otherwise do on the way).
+    Lists the modules it imports that cost the most, and checks that none of
+    bundle.LAZY_IMPORTED_MODULES was imported before it was needed.
+    '''
+    results = []
+    for module_name in module_names:
+        work_dir = tempfile.mkdtemp(prefix="buntool_imports_")
+        try:
+            result = _cold_import(module_name, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append({
+            "benchmark": "imports",
+            "module": module_name,
+            **result,
+            "failures": len(result["lazy_modules_imported"]),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark buntool bundle stages.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    stages_parser = subparsers.add_parser("stages", help="Time each stage of create_bundle on synthetic corpora")
+    stages_parser.add_argument("--corpus", nargs="+", choices=list(CORPORA), default=["small", "medium"])
+    stages_parser.add_argument("--roman", action="store_true", help="Roman numbered preface (times the labels stage)")
+    stages_parser.add_argument("--dummy-toc", action="store_true", help="Measure the TOC with a dummy render, not a prediction")
+    stages_parser.add_argument("--engine", choices=["stamp", "reportlab"], default="stamp")
+    pagination_parser = subparsers.add_parser("pagination", help="Compare page number engines")
+    pagination_parser.add_argument("--pages", nargs="+", type=int, default=[100, 1000])
+    pagination_parser.add_argument("--engines", nargs="+", choices=PAGINATION_ENGINES, default=PAGINATION_ENGINES)
+    stress_parser = subparsers.add_parser("stress", help="Build bundles concurrently and check their page numbers")
+    stress_parser.add_argument("--bundles", type=int, default=16)
+    stress_parser.add_argument("--threads", type=int, default=4)
+    stress_parser.add_argument("--engine", choices=["stamp", "reportlab"], default="stamp")
+    rebuild_parser = subparsers.add_parser("rebuild", help="Time a rebuild after an index-only change")
+    rebuild_parser.add_argument("--pages", type=int, default=2000)
+    save_parser = subparsers.add_parser("save", help="Compare plain, linearized and optimized saves")
+    save_parser.add_argument("--corpus", nargs="+", choices=list(CORPORA), default=["small", "medium"])
+    save_parser.add_argument("--mbps", type=float, default=5.0, help="Download speed for the time to first page")
+    save_parser.add_argument("--letterhead", action="store_true", help="Give every input file a copy of the same image")
+    imports_parser = subparsers.add_parser("imports", help="Time cold imports (as a Lambda cold start) and prewarm")
+    imports_parser.add_argument("--modules", nargs="+", choices=IMPORT_TIMED_MODULES, default=list(IMPORT_TIMED_MODULES))
+    engines_parser = subparsers.add_parser("engines", help="Compare the PDF libraries for overlays and links")
+    engines_parser.add_argument("--pages", nargs="+", type=int, default=[1000])
+    engines_parser.add_argument("--engines", nargs="+", choices=bundle.PDF_ENGINES, default=list(bundle.PDF_ENGINES))
+    merge_parser = subparsers.add_parser("merge", help="Compare the in-memory and memory-bounded merges")
+    merge_parser.add_argument("--mb", type=int, default=256, help="Size of the scanned input files, in MB")
+    merge_parser.add_argument("--ceiling", type=int, default=None, help="RSS ceiling for the bounded merge, in MB")
+    args = parser.parse_args()
+
+    if args.benchmark == "stages":
+        options = {"roman_for_preface": args.roman, "predict_toc_length": not args.dummy_toc,
+                   "page_number_engine": args.engine}
+        results = benchmark_stages(args.corpus, options)
+    elif args.benchmark == "pagination":
+        results = benchmark_pagination(args.pages, args.engines)
+    elif args.benchmark == "stress":
+        results = benchmark_stress(args.bundles, args.threads, args.engine)
+    elif args.benchmark == "rebuild":
+        results = benchmark_rebuild(args.pages)
+    elif args.benchmark == "save":
+        results = benchmark_save(args.corpus, args.mbps, args.letterhead)
+    elif args.benchmark == "imports":
+        results = benchmark_imports(args.modules)
+    elif args.benchmark == "engines":
+        results = benchmark_pdf_engines(args.pages, args.engines)
+    elif args.benchmark == "merge":
+        results = benchmark_merge(args.mb, args.ceiling)
+    print(json.dumps(results, indent=2))
+    if any(result.get("failures") for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,87 +30,94 @@
 #       - [ ] the data structure point above will help with this, because then it just becomes a matter of setting variables from the lines of the file.
 
 # PDF manipulation
-from pypdf import PdfReader, PdfWriter
-from pypdf.annotations import Link
-from pypdf.generic import Fit
-from pikepdf import Pdf, OutlineItem, Dictionary, Name, PdfError
-import pdfplumber
-# reportlab stuff
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph, Frame, PageBreak
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
+from pikepdf import Pdf, OutlineItem, Dictionary, Name, Array, PdfError, parse_content_stream, ObjectStreamMode, \
+    StreamDecodeLevel, AccessMode
+# reportlab stuff. Only the light modules are imported here: the rest of reportlab, and pypdf,
+# pdfplumber and python-docx, are imported by the functions that use them, so importing this module
+# (e.g. as a Lambda cold-starts) stays quick. See LAZY_IMPORTED_MODULES and prewarm.
+from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_RIGHT
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
-# from reportlab.rl_config import defaultPageSize
-import reportlab.rl_config
-from reportlab.rl_config import defaultPageSize
 # custom
-from makedocxindex import create_toc_docx
+from preflight import preflight_input_files, parse_pdf_creation_date
+from instrumentation import BundleMetrics, current_rss_mb
+from optimize import optimize_bundle, compress_uncompressed_streams
+from downsample import downsample_input_files
+from logconfig import setup_logging, set_log_session, reset_log_session, open_session_log, close_session_log
 # General
+import hashlib
+import importlib
+import io
+import json
 import os
 import re
 import argparse
-import shutil
 import csv
 import logging
+import threading
+import time
 import zipfile
+from functools import lru_cache, partial
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
 # Set globals
 bundle_logger = logging.getLogger('bundle_logger')
-session_file_handler = None
-PAGE_HEIGHT = defaultPageSize[1];
-PAGE_WIDTH = defaultPageSize[0]  # reportlab page sizes used in more than one function
-bundle_config = None
-
-
-def configure_logger(session_id=None):
+PAGE_WIDTH, PAGE_HEIGHT = A4  # reportlab page sizes used in more than one function
+# The PDF libraries the file-based helpers (add_footer_to_bundle, add_annotations_with_transform and
+# the functions which call them) can do their work with. create_bundle keeps the bundle in one pikepdf
+# Pdf from merge to save, and "pikepdf" does the same here, with the same in-memory functions.
+# "pypdf" is the original implementation, kept as a fallback. Outlines and page labels were only
+# ever done with pikepdf. Text is scraped from the TOC (scrape_toc_text) with pdfplumber, which is
+# only needed when the TOC's layout anchors can't be used.
+PDF_ENGINES = ("pikepdf", "pypdf")
+DEFAULT_PDF_ENGINE = "pikepdf"
+# the modules the default pipeline imports as it goes, which prewarm imports up front
+# (the pypdf and pdfplumber paths are fallbacks, and aren't included):
+LAZY_IMPORTED_MODULES = ("reportlab.platypus", "reportlab.lib.colors", "reportlab.lib.styles",
+                         "reportlab.pdfbase.ttfonts", "reportlab.pdfgen.canvas", "makedocxindex")
+# memory_bounded_merge (see merge_planned_sources_bounded) merges this much input per pass
+# when there's no RSS ceiling to work it out from:
+MERGE_BATCH_BYTES = 256 * 1024 * 1024
+# and at least this much, however close to the ceiling the process already is, since every pass
+# rewrites the whole body merged so far:
+MIN_MERGE_BATCH_BYTES = MERGE_BATCH_BYTES // 4
+# merging holds about this much memory per byte of the input merged in one pass:
+MERGE_MEMORY_PER_INPUT_BYTE = 1.25
+# zip_mode "stream" writes <bundle>_files.zip + this instead of the zip (see create_zip_manifest):
+ZIP_MANIFEST_SUFFIX = ".manifest.json"
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def configure_logger(session_id=None, logs_dir=None):
     '''
     Temp files are saved in /tmp/tempfiles/[session_id] (hardcoded in app.py)
     where session_id is an 8-digit hex number.
     Since the temp files are deleted in production,
     logs are to be stored in a seprate file /tmp/logs.
+    Everything this thread logs from now on is tagged with session_id and,
+    in session logging mode, written to that session's log file (see logconfig.py).
+    Returns a handle for end_session_logging, to call once the bundle is done.
     '''
-    logs_dir = bundle_config.logs_dir
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
-    # Configure logging
-    global session_file_handler
-    global bundle_logger
-    bundle_logger = logging.getLogger('bundle_logger')
-    bundle_logger.setLevel(logging.DEBUG)
-    bundle_logger.propagate = False
-    formatter = logging.Formatter('%(asctime)s-%(levelname)s-[BUN]: %(message)s')
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    bundle_logger.addHandler(console_handler)
-
+    if not logs_dir:
+        logs_dir = os.path.join('/tmp', 'logs')
+    setup_logging(logs_dir)
     if not session_id:
         session_id = datetime.now().strftime("%Y%m%d%H%M%S")  # fallback
-    # logs path = buntool_timestamp.log:
-    logs_path = os.path.join(logs_dir, f"buntool_{session_id}.log")
-    session_file_handler = logging.FileHandler(logs_path)
-    session_file_handler.setLevel(logging.DEBUG)
-    session_file_handler.setFormatter(formatter)
-    bundle_logger.addHandler(session_file_handler)
-    return bundle_logger
+    token = set_log_session(session_id)
+    open_session_log(session_id, logs_dir)  # logs path = buntool_{session_id}.log
+    return session_id, token
 
 
-def remove_session_file_handler():
+def end_session_logging(session_log):
     '''
-    This is meant to prevent duplicate logs, but
-    it's imperfect for several bundles created during the same user session.
-    Not a priority to fix right now.
+    Close this session's log file (once everything it logged has been written)
+    and stop tagging this thread's log lines with its session id.
     '''
-    global session_file_handler
-    if session_file_handler:
-        bundle_logger.removeHandler(session_file_handler)
-        session_file_handler = None
+    if session_log:
+        session_id, token = session_log
+        close_session_log(session_id)
+        reset_log_session(token)
 
 
 def remove_temporary_files(list_of_temp_files):
@@ -197,11 +204,7 @@ def sanitise_latex(text):
     return text
 
 
-def load_bundle_config(bundle_config_data):
-    global bundle_config
-    bundle_config = bundle_config_data
-
-def parse_the_date(date):
+def parse_the_date(date, date_setting):
     '''
     This function takes a date input in YYYY-MM-DD format and
     formats it according to user preferences from the following
@@ -215,7 +218,7 @@ def parse_the_date(date):
     - us_abbreviated_date
     or if setting is hide_date, don't do anything
     '''
-    if bundle_config.date_setting == "hide_date":
+    if date_setting == "hide_date":
         return date
     # check if date matches the expected format
     if not re.match(r'\d{4}-\d{2}-\d{2}', date):
@@ -234,13 +237,13 @@ def parse_the_date(date):
             "us_abbreviated_date": "%b %d, %Y"
         }
 
-        return parsed_date.strftime(formats[bundle_config.date_setting])
+        return parsed_date.strftime(formats[date_setting])
     except KeyError:
-        bundle_logger.error(f"[PTD] Error: Unknown date setting: {bundle_config.date_setting}")
+        bundle_logger.error(f"[PTD] Error: Unknown date setting: {date_setting}")
         return date
 
 
-def load_index_data(csv_index):
+def load_index_data(csv_index, date_setting):
     '''
     This ingests a CSV of table-of-contents entries, and returns
     a dictionary of the data (in the create bundle function, saved as 
@@ -268,20 +271,21 @@ def load_index_data(csv_index):
         for row in reader:
             if len(row) >= 4:
                 filename, userdefined_title, raw_date, section = row
-                formatted_date = parse_the_date(raw_date)
+                formatted_date = parse_the_date(raw_date, date_setting)
                 # Store filename as provided by frontend
                 index_data[filename] = (userdefined_title, formatted_date, section)
             elif len(row) == 3:
                 filename, userdefined_title, raw_date = row
-                formatted_date = parse_the_date(raw_date)
+                formatted_date = parse_the_date(raw_date, date_setting)
                 index_data[filename] = (userdefined_title, formatted_date, '')
             else:
                 filename, userdefined_title = row
                 bundle_logger.debug(f"Reading file entry: |{filename}|")
                 index_data[filename] = (userdefined_title, '', '')
     bundle_logger.debug(f"[LID]..Loaded index data with {len(index_data)} entries:")
-    for k, v in index_data.items():
-        bundle_logger.debug(f"[LID]....Key: |{k}| -> Value: {v}")
+    if bundle_logger.isEnabledFor(logging.DEBUG):
+        for k, v in index_data.items():
+            bundle_logger.debug(f"[LID]....Key: |{k}| -> Value: {v}")
     return index_data
 
 
@@ -293,37 +297,99 @@ def get_pdf_creation_date(file):
     '''
     try:
         with Pdf.open(file) as pdf:
-            creation_date = pdf.docinfo.get('/CreationDate', None)
-            if creation_date:
-                # Convert to string if it's a pikepdf.String object
-                creation_date_str = str(creation_date)
-                # Extract date in the format D:YYYYMMDDHHmmSS
-                date_str = creation_date_str[2:10]
-                date_obj = datetime.strptime(date_str, '%Y%m%d')
-                return date_obj.strftime('%d.%m.%Y')
+            return parse_pdf_creation_date(pdf.docinfo.get('/CreationDate', None))
     except Exception as e:
         bundle_logger.error(f"[GPCD]Error extracting creation date from {file}: {e}")
-        creation_date = None
         return None
 
 
-def merge_pdfs_create_toc_entries(input_files, output_file, index_data):
+def merge_pdfs_create_toc_entries(input_files, output_file, index_data, skipped_files=None, preflight_records=None,
+                                  memory_bounded=False, rss_ceiling_mb=None):
     '''
-    Two jobs at once.
+    File-based wrapper around merge_pdfs_in_memory, kept for callers
+    which want TEMP01_mainpages.pdf on disk.
+    With memory_bounded, the files are merged with merge_planned_sources_bounded
+    instead, a batch at a time, keeping below rss_ceiling_mb if it's given.
+    Returns the toc_entries (see merge_pdfs_in_memory).
+    '''
+    if memory_bounded:
+        toc_entries, merge_sources = plan_merge(input_files, index_data, skipped_files, preflight_records)
+        spill_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)), "merge")
+        pdf, body_path = merge_planned_sources_bounded(merge_sources, spill_dir, rss_ceiling_mb)
+        if body_path:
+            pdf.close()
+            os.replace(body_path, output_file)
+        else:
+            pdf.save(output_file)
+        return toc_entries
+    pdf = Pdf.new()
+    open_pdfs = []
+    try:
+        toc_entries = merge_pdfs_in_memory(pdf, input_files, index_data, open_pdfs, skipped_files, preflight_records)
+        pdf.save(output_file)
+    finally:
+        close_open_pdfs(open_pdfs)
+    return toc_entries
+
+
+def build_input_file_lookup(input_files):
+    '''
+    The index refers to files by their base name, but input_files has
+    the full paths. Map each base name to the full path(s) which have it,
+    so each index row is a single exact lookup.
+    '''
+    input_file_lookup = {}
+    for input_file_path in input_files:
+        paths_for_name = input_file_lookup.setdefault(os.path.basename(input_file_path), [])
+        if input_file_path not in paths_for_name:
+            paths_for_name.append(input_file_path)
+    return input_file_lookup
+
+
+def resolve_input_file(filename, input_file_lookup):
+    '''
+    Find the full path for an index filename. Returns None if no input file
+    has that name, and raises ValueError if more than one does, since
+    there is no way of telling which one the index means.
+    '''
+    paths_for_name = input_file_lookup.get(os.path.basename(filename))
+    if not paths_for_name:
+        return None
+    if len(paths_for_name) > 1:
+        raise ValueError(f"Index entry {filename} is ambiguous: it matches {len(paths_for_name)} input files ({', '.join(paths_for_name)})")
+    return paths_for_name[0]
+
+
+def plan_merge(input_files, index_data, skipped_files=None, preflight_records=None):
+    '''
+    Work out what merge_pdfs_in_memory will do, without doing it.
     index_data is the roadmap for the bundle creation.
-    1. Merge the PDFs in input_files into a single PDF at output_file.
-    2. Create a table of contents from the index_data, and return it.
-    The table of contents is based on the index_data and the structural
-    results of merging the files together.
-     It outputs a list of tuples, toc_entries each containing:
+    Returns (toc_entries, merge_sources):
+    - toc_entries is a list of tuples, each containing:
         - tab number
         - title
         - date
         - page number
+      (or a section break: (SECTION_BREAK_n, title));
+    - merge_sources lists what to merge, in order, as tuples of
+      (path to take the pages from, number of pages, sha256 or None,
+      the original file if the pages are taken from a copy of it, else None).
+    Index entries which can't be merged (no matching input file, missing
+    from disk, or unreadable) are left out of the bundle; their filenames
+    are appended to skipped_files, if it's given.
+    preflight_records (see preflight.py) are used, where there is one for a file,
+    for its page count, to skip files known to be unreadable and for the fallback
+    creation date, so those don't need the file opened at all. If the record has a
+    normalized copy of the file (see pdfcache.py), the pages are taken from that instead.
     '''
-    pdf = Pdf.new()
+    if preflight_records is None:
+        preflight_records = {}
+    if skipped_files is None:
+        skipped_files = []
+    input_file_lookup = build_input_file_lookup(input_files)
     page_count = 0
     toc_entries = []
+    merge_sources = []
     tab_count = 1
     section_count = 1
     # Iterate through the lines of index data
@@ -341,25 +407,41 @@ def merge_pdfs_create_toc_entries(input_files, output_file, index_data):
                 try:
                     # - Count pages:
                     # Filename just has the base name, but input_files has the full path. Use the full path:
-                    this_file_path = None
-                    for input_file_path in input_files:
-                        if os.path.basename(filename) in input_file_path:
-                            if not os.path.exists(input_file_path):
-                                bundle_logger.debug(f"[MPCTE]..Error: File {filename} not found at {input_file_path}")
-                                break
-                            else:
-                                bundle_logger.debug(f"[MPCTE]..File {filename} found at {input_file_path}")
-                                this_file_path = input_file_path
-                            break
+                    this_file_path = resolve_input_file(filename, input_file_lookup)
                     if not this_file_path:
-                        bundle_logger.debug(f"[MPCTE]File {filename} not found in input_files.")
+                        bundle_logger.error(f"[MPCTE]File {filename} is in the index but not in input_files. Skipping it.")
+                        skipped_files.append(filename)
+                        continue
+                    if not os.path.exists(this_file_path):
+                        bundle_logger.error(f"[MPCTE]..Error: File {filename} not found at {this_file_path}. Skipping it.")
+                        skipped_files.append(filename)
                         continue
-                    src = Pdf.open(this_file_path)
-                    page_count += len(src.pages)
-                    pdf.pages.extend(src.pages)
-                    bundle_logger.debug(f"[MPCTE]....added to merged PDF")
+                    bundle_logger.debug(f"[MPCTE]..File {filename} found at {this_file_path}")
+                    preflight_record = preflight_records.get(this_file_path)
+                    if preflight_record and not preflight_record.usable:
+                        bundle_logger.error(f"[MPCTE]..File {filename} failed preflight ({preflight_record.error}). Skipping it.")
+                        skipped_files.append(filename)
+                        continue
+                    if preflight_record:
+                        source_path = this_file_path
+                        if preflight_record.normalized_path and os.path.exists(preflight_record.normalized_path):
+                            bundle_logger.debug(f"[MPCTE]..using normalized copy {preflight_record.normalized_path}")
+                            source_path = preflight_record.normalized_path
+                        number_of_pages = preflight_record.page_count
+                        sha256 = preflight_record.sha256
+                    else:
+                        with Pdf.open(this_file_path) as src:
+                            number_of_pages = len(src.pages)
+                        source_path = this_file_path
+                        sha256 = None
+                    page_count += number_of_pages
+                    original_path = this_file_path if source_path != this_file_path else None
+                    merge_sources.append((source_path, number_of_pages, sha256, original_path))
+                except ValueError:
+                    raise
                 except Exception as e:
-                    bundle_logger.debug(f"Error counting pages in {os.path.basename(this_file_path)}: {e}")
+                    bundle_logger.error(f"[MPCTE]Error counting pages in {os.path.basename(this_file_path)}: {e}. Skipping it.")
+                    skipped_files.append(filename)
                     continue
                 # - Add to outline:
                 if index_data and os.path.basename(filename) in index_data:
@@ -367,21 +449,190 @@ def merge_pdfs_create_toc_entries(input_files, output_file, index_data):
                     title, date, section = index_data[os.path.basename(filename)]
                 else:
                     title = os.path.splitext(os.path.basename(filename))[0]
-                    date = get_pdf_creation_date(filename)
+                    if preflight_record:
+                        date = preflight_record.creation_date
+                    else:
+                        date = get_pdf_creation_date(this_file_path)
                     section = None
                     date = date or "Unknown"
                     bundle_logger.debug(f"[MPCTE]..Not in index. Using alternative data: Title: {title}, Date: {date}")
-                bundle_logger.debug(f"[MPCTE]..Adding toc entry: {tab_number}, {title}, {page_count - len(src.pages)}")
-                toc_entries.append((tab_number, title, date, page_count - len(src.pages)))
+                bundle_logger.debug(f"[MPCTE]..Adding toc entry: {tab_number}, {title}, {page_count - number_of_pages}")
+                toc_entries.append((tab_number, title, date, page_count - number_of_pages))
             except Exception as e:
                 bundle_logger.debug(f"[MPCTE] Error merging and creating toc entries for {filename}: {e}")
                 raise e
                 continue
-    pdf.save(output_file)
+    if skipped_files:
+        bundle_logger.warning(f"[MPCTE]Skipped {len(skipped_files)} file(s) from the index: {', '.join(skipped_files)}")
+    return toc_entries, merge_sources
+
+
+def open_merge_source(source_path, original_path=None, access_mode=AccessMode.default):
+    '''
+    Open one of plan_merge's merge_sources. source_path may be a copy of the file
+    in the PDF cache, which another bundle can have evicted since the merge was
+    planned: if it can't be opened, the original file is opened instead.
+    '''
+    try:
+        return Pdf.open(source_path, access_mode=access_mode)
+    except (OSError, PdfError) as e:
+        if not original_path:
+            raise
+        bundle_logger.warning(f"[MPCTE]..Could not open {source_path} ({e}). Using the original, {original_path}")
+        return Pdf.open(original_path, access_mode=access_mode)
+
+
+def merge_planned_sources(pdf, merge_sources, open_pdfs):
+    '''
+    Append the pages of each of merge_sources (see plan_merge) to the pikepdf Pdf `pdf`.
+    pikepdf copies pages from the source files lazily, so each source
+    has to stay open until `pdf` is saved. They are appended to open_pdfs
+    for the caller to close (see close_open_pdfs).
+    '''
+    for source_path, number_of_pages, _, original_path in merge_sources:
+        src = open_merge_source(source_path, original_path)
+        open_pdfs.append(src)
+        if len(src.pages) != number_of_pages:
+            raise ValueError(f"{os.path.basename(source_path)} has {len(src.pages)} pages, but {number_of_pages} were planned for")
+        pdf.pages.extend(src.pages)
+        bundle_logger.debug(f"[MPCTE]....added {os.path.basename(source_path)} to merged PDF")
+
+
+def merge_planned_sources_bounded(merge_sources, spill_dir, rss_ceiling_mb=None):
+    '''
+    The memory-bounded way to do merge_planned_sources, for very large bundles
+    (BundleConfig.memory_bounded_merge).
+    pikepdf copies each source's streams into memory as its pages are appended,
+    so merging everything into one new Pdf takes about as much memory as the
+    input files come to. Instead, the sources are merged a batch at a time:
+    each batch is appended to the body merged so far, which is a file in
+    spill_dir opened with mmap access (so its streams stay on disk until
+    they're written), and the result is saved as the next body file. Each
+    source is opened with mmap access too, and closed as soon as the body
+    with its pages has been saved.
+    Each batch is as much input as fits below rss_ceiling_mb (see
+    current_rss_mb and MERGE_MEMORY_PER_INPUT_BYTE), or MERGE_BATCH_BYTES if
+    there's no ceiling, and at least one source. Every pass rewrites the body
+    so far, so there's more disk I/O the smaller the batches, and spill_dir
+    needs room for two copies of the body. So that a process already at (or
+    over) the ceiling doesn't go one source at a time, rewriting the whole
+    body for each, no batch is smaller than MIN_MERGE_BATCH_BYTES: the ceiling
+    may then be overshot by about that much.
+    Returns (the merged Pdf, opened from its body file, and that file's path).
+    The path is None if there was nothing to merge, in which case the Pdf is new.
+    '''
+    if not merge_sources:
+        return Pdf.new(), None
+    os.makedirs(spill_dir, exist_ok=True)
+    body = None
+    body_path = None
+    next_body_path = None
+    position = 0
+    merge_pass = 0
+    try:
+        while position < len(merge_sources):
+            if rss_ceiling_mb:
+                batch_budget = (rss_ceiling_mb - current_rss_mb()) * 1024 * 1024 / MERGE_MEMORY_PER_INPUT_BYTE
+                if batch_budget < MIN_MERGE_BATCH_BYTES:
+                    bundle_logger.debug(f"[MPCTE]....RSS {current_rss_mb():.0f} MB leaves little room below the ceiling "
+                                        f"of {rss_ceiling_mb} MB: merging {MIN_MERGE_BATCH_BYTES} bytes this pass")
+                    batch_budget = MIN_MERGE_BATCH_BYTES
+            else:
+                batch_budget = MERGE_BATCH_BYTES
+            merged = body if body is not None else Pdf.new()
+            batch = []
+            batch_bytes = 0
+            try:
+                while position < len(merge_sources):
+                    source_path, number_of_pages, _, original_path = merge_sources[position]
+                    source_bytes = os.path.getsize(source_path)
+                    if batch and batch_bytes + source_bytes > batch_budget:
+                        break
+                    src = open_merge_source(source_path, original_path, AccessMode.mmap)
+                    batch.append(src)
+                    if len(src.pages) != number_of_pages:
+                        raise ValueError(f"{os.path.basename(source_path)} has {len(src.pages)} pages, but {number_of_pages} were planned for")
+                    merged.pages.extend(src.pages)
+                    batch_bytes += source_bytes
+                    position += 1
+                merge_pass += 1
+                next_body_path = os.path.join(spill_dir, f"merged_body_{merge_pass:04}.pdf")
+                merged.save(next_body_path)
+            finally:
+                merged.close()
+                close_open_pdfs(batch)
+            if body_path:
+                os.remove(body_path)
+            body_path = next_body_path
+            body = Pdf.open(body_path, access_mode=AccessMode.mmap)
+            bundle_logger.debug(f"[MPCTE]....merge pass {merge_pass}: {position} of {len(merge_sources)} file(s) merged, "
+                                f"{batch_bytes} bytes this pass, RSS {current_rss_mb():.0f} MB")
+    except Exception:
+        # don't leave half a bundle's worth of body files behind:
+        for path in (body_path, next_body_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+    if rss_ceiling_mb and current_rss_mb() > rss_ceiling_mb:
+        bundle_logger.warning(f"[MPCTE]..RSS is {current_rss_mb():.0f} MB after merging, over the ceiling of {rss_ceiling_mb} MB")
+    bundle_logger.info(f"[MPCTE]Merged {len(merge_sources)} file(s) in {merge_pass} pass(es) into {os.path.basename(body_path)}")
+    return body, body_path
+
+
+def merge_pdfs_in_memory(pdf, input_files, index_data, open_pdfs, skipped_files=None, preflight_records=None):
+    '''
+    Two jobs at once.
+    1. Merge the PDFs in input_files into the pikepdf Pdf object `pdf`.
+    2. Create a table of contents from the index_data, and return it.
+    The table of contents is based on the index_data and the structural
+    results of merging the files together. See plan_merge, which does the
+    planning, for the shape of toc_entries and the other arguments, and
+    merge_planned_sources for open_pdfs.
+    '''
+    toc_entries, merge_sources = plan_merge(input_files, index_data, skipped_files, preflight_records)
+    merge_planned_sources(pdf, merge_sources, open_pdfs)
     return toc_entries
 
 
-def add_bookmarks_to_pdf(pdf_file, output_file, toc_entries, length_of_frontmatter):
+def close_open_pdfs(open_pdfs):
+    '''
+    Close the source PDFs that were kept open for an in-memory bundle.
+    Only call this once the bundle that borrows their pages has been saved.
+    '''
+    for src in open_pdfs:
+        try:
+            src.close()
+        except Exception as e:
+            bundle_logger.debug(f"[COP]Could not close source PDF: {e}")
+    open_pdfs.clear()
+
+
+def save_debug_snapshot(pdf, temp_dir, filename, debug_intermediates=False):
+    '''
+    The in-memory pipeline only saves the bundle once, at the end.
+    When debug_intermediates is switched on in BundleConfig, this writes
+    the state of the bundle after each stage to the old TEMP0x filenames so
+    they can be inspected. These files are deliberately left in place
+    by the cleanup step.
+    '''
+    if not debug_intermediates:
+        return None
+    snapshot_path = os.path.join(temp_dir, filename)
+    pdf.save(snapshot_path)
+    bundle_logger.debug(f"[SDS]Debug snapshot written to {snapshot_path}")
+    return snapshot_path
+
+
+def add_bookmarks_to_pdf(pdf_file, output_file, toc_entries, length_of_frontmatter, bookmark_setting="tab-title"):
+    '''
+    File-based wrapper around add_bookmarks_in_memory.
+    '''
+    with Pdf.open(pdf_file) as pdf:
+        add_bookmarks_in_memory(pdf, toc_entries, length_of_frontmatter, bookmark_setting)
+        pdf.save(output_file)
+
+
+def add_bookmarks_in_memory(pdf, toc_entries, length_of_frontmatter, bookmark_setting="tab-title"):
     '''
     This is about adding outline entries ('bookmarks') to a PDF for
     navigation.
@@ -395,28 +646,26 @@ def add_bookmarks_to_pdf(pdf_file, output_file, toc_entries, length_of_frontmatt
         "tab-title-page"
         "tab-title-date-page
     '''
-    with Pdf.open(pdf_file) as pdf:
-        with pdf.open_outline() as outline:
-            for entry in toc_entries:
-                if "SECTION_BREAK" in entry[0]:  # ignore section entries
-                    continue
-                if "tab" in entry[0].lower() and "title" in entry[1].lower() and "page" in entry[3].lower():
-                    continue
+    with pdf.open_outline() as outline:
+        for entry in toc_entries:
+            if "SECTION_BREAK" in entry[0]:  # ignore section entries
+                continue
+            if "tab" in entry[0].lower() and "title" in entry[1].lower() and "page" in entry[3].lower():
+                continue
+            else:
+                tab_number, title, date, page = entry
+                if bookmark_setting == "tab-title":
+                    item = OutlineItem(f"{tab_number} {title}", page + length_of_frontmatter)
+                elif bookmark_setting == "tab-title-date":
+                    item = OutlineItem(f"{tab_number} {title} ({date})", page + length_of_frontmatter)
+                elif bookmark_setting == "tab-title-page":
+                    item = OutlineItem(f"{tab_number} {title} [pg.{1+ page + length_of_frontmatter}]", page + length_of_frontmatter)
+                elif bookmark_setting == "tab-title-date-page":
+                    item = OutlineItem(f"{tab_number} {title} ({date}) [pg.{1 + page + length_of_frontmatter}]", page + length_of_frontmatter)
                 else:
-                    tab_number, title, date, page = entry
-                    if bundle_config.bookmark_setting == "tab-title":
-                        item = OutlineItem(f"{tab_number} {title}", page + length_of_frontmatter)
-                    elif bundle_config.bookmark_setting == "tab-title-date":
-                        item = OutlineItem(f"{tab_number} {title} ({date})", page + length_of_frontmatter)
-                    elif bundle_config.bookmark_setting == "tab-title-page":
-                        item = OutlineItem(f"{tab_number} {title} [pg.{1+ page + length_of_frontmatter}]", page + length_of_frontmatter)
-                    elif bundle_config.bookmark_setting == "tab-title-date-page":
-                        item = OutlineItem(f"{tab_number} {title} ({date}) [pg.{1 + page + length_of_frontmatter}]", page + length_of_frontmatter)
-                    else:
-                        bundle_logger.error(f"[ABTP]Error: Unknown bookmark_setting: {bundle_config.bookmark_setting}")
-                        item = OutlineItem(f"{tab_number} {title}", page + length_of_frontmatter)
-                    outline.root.append(item)
-        pdf.save(output_file)
+                    bundle_logger.error(f"[ABTP]Error: Unknown bookmark_setting: {bookmark_setting}")
+                    item = OutlineItem(f"{tab_number} {title}", page + length_of_frontmatter)
+                outline.root.append(item)
 
 
 def merge_frontmatter(input_files, output_file):
@@ -441,24 +690,144 @@ def bookmark_the_index(pdf_file, output_file, coversheet=None):
     This function comes back for a second pass and adds an outline item for the
     index.
     '''
+    if coversheet:
+        # test length of coversheet and set coversheet_length to the number of pages:
+        with Pdf.open(coversheet) as coversheet_pdf:
+            coversheet_length = len(coversheet_pdf.pages)
+    else:
+        coversheet_length = 0
     with Pdf.open(pdf_file) as pdf:
-        with pdf.open_outline() as outline:
-            if coversheet:
-                # test length of coversheet and set coversheet_length to the number of pages:
-                with Pdf.open(coversheet) as coversheet_pdf:
-                    coversheet_length = len(coversheet_pdf.pages)
-                # Add an outline item for "Index" linking to the first page after the coversheet (it's 0-indexed):
-                index_item = OutlineItem("Index", coversheet_length)
-                outline.root.insert(0, index_item)
-                bundle_logger.debug("[BTI]coversheet is specified, outline item added for index")
-            else:
-                # Add an outline item for "Index" linking to the first page:
-                index_item = OutlineItem("Index", 0)
-                outline.root.insert(0, index_item)
-                bundle_logger.debug("[BTI]no coversheet specified, outline item added for index")
+        bookmark_the_index_in_memory(pdf, coversheet_length)
         pdf.save(output_file)
 
 
+def bookmark_the_index_in_memory(pdf, length_of_coversheet=0):
+    '''
+    In-memory version of bookmark_the_index. The index starts on the first
+    page after the coversheet (it's 0-indexed), or on the first page
+    if there is no coversheet.
+    '''
+    with pdf.open_outline() as outline:
+        index_item = OutlineItem("Index", length_of_coversheet)
+        outline.root.insert(0, index_item)
+        if length_of_coversheet:
+            bundle_logger.debug("[BTI]coversheet is specified, outline item added for index")
+        else:
+            bundle_logger.debug("[BTI]no coversheet specified, outline item added for index")
+
+
+def register_fonts():
+    '''
+    Register the non-standard (Charter) fonts with reportlab.
+    Both the index and the footers can use them.
+    Registration is process-wide, and parsing the TTFs is slow, so it's only done
+    the first time; later calls return straight away.
+    '''
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    with _font_registration_lock:
+        if _fonts_registered:
+            return
+        import reportlab.rl_config
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont('Charter_regular', 'Charter_Regular.ttf'))
+        pdfmetrics.registerFont(TTFont('Charter_bold', 'Charter_Bold.ttf'))
+        pdfmetrics.registerFont(TTFont('Charter_italic', 'Charter_Italic.ttf'))
+        reportlab.rl_config.warnOnMissingFontGlyphs = 0
+        _fonts_registered = True
+
+
+_fonts_registered = False
+_font_registration_lock = threading.Lock()
+
+
+def index_font_settings(index_font_setting):
+    '''
+    Maps the index font option from the frontend onto reportlab
+    (main font, bold font, base font size).
+    '''
+    if index_font_setting == 'serif':
+        return 'Times-Roman', 'Times-Bold', 12
+    elif index_font_setting == 'sans':
+        return 'Helvetica', 'Helvetica-Bold', 12
+    elif index_font_setting == 'mono':
+        return 'Courier', 'Courier-Bold', 10
+    elif index_font_setting == 'traditional':
+        return 'Charter_regular', 'Charter_bold', 12
+    else:  # defailt to Helvetica
+        return 'Helvetica', 'Helvetica-Bold', 12
+
+
+@lru_cache(maxsize=None)
+def toc_paragraph_styles(index_font_setting):
+    '''
+    The stylesheet the index is drawn with, for one index font setting.
+    Built once per setting and shared by every TOC the process makes (see warm_reportlab_caches):
+    reportlab only reads styles, never changes them, so sharing them between threads is safe.
+    '''
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    main_font, bold_font, base_font_size = index_font_settings(index_font_setting)
+    styleSheet = getSampleStyleSheet()
+
+    main_style = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=main_font,
+        fontSize=base_font_size,
+        leading=14
+    )
+    main_style_right = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=main_font,
+        fontSize=base_font_size,
+        leading=14,
+        alignment=TA_RIGHT
+    )
+
+    bold_style = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=bold_font,
+        fontSize=base_font_size,
+        leading=14
+    )
+    claimno_style = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=bold_font,
+        fontSize=base_font_size,
+        leading=14,
+        alignment=TA_RIGHT
+    )
+    bundle_title_style = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=bold_font,
+        fontSize=base_font_size + 6,
+        leading=14,
+        alignment=TA_CENTER
+    )
+    case_name_style = ParagraphStyle(
+        'BodyText',
+        parent=styleSheet['Normal'],
+        fontName=bold_font,
+        fontSize=base_font_size + 2,
+        leading=14,
+        alignment=TA_CENTER
+    )
+
+    styleSheet.add(ParagraphStyle(name='main_style', parent=main_style))
+    styleSheet.add(ParagraphStyle(name='main_style_right', parent=main_style_right))
+    styleSheet.add(ParagraphStyle(name='bold_style', parent=bold_style))
+    styleSheet.add(ParagraphStyle(name='claimno_style', parent=claimno_style))
+    styleSheet.add(ParagraphStyle(name='bundle_title_style', parent=bundle_title_style))
+    styleSheet.add(ParagraphStyle(name='case_name_style', parent=case_name_style))
+    return styleSheet
+
+
 def create_toc_pdf_reportlab(
         toc_entries,
         casedetails,
@@ -474,7 +843,8 @@ def create_toc_pdf_reportlab(
         page_numbering_style=None,
         footer_prefix=None,
         main_page_count=0,
-        roman_numbering=False
+        roman_numbering=False,
+        predict_only=False
 ):
     '''
     The first version of buntool generated the index file and
@@ -498,31 +868,19 @@ def create_toc_pdf_reportlab(
     - generate a long table for the main table of contents, which can
       flow across pages,
     - build the PDF
+
+    Returns the TOC row anchors recorded while the table was drawn
+    (see TocAnchorRecorder), which the hyperlinking uses.
+
+    With predict_only, nothing is built: the layout is worked out from the
+    flowables (see predict_story_page_count) and the number of pages the
+    index would take is returned, or None if it can't be predicted.
     '''
 
-    # First, parse out the arguments.
-    # index font setting.
-    if index_font_setting == 'serif':
-        main_font = 'Times-Roman'
-        bold_font = 'Times-Bold'
-        base_font_size = 12
-    elif index_font_setting == 'sans':
-        main_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-        base_font_size = 12
-    elif index_font_setting == 'mono':
-        main_font = 'Courier'
-        bold_font = 'Courier-Bold'
-        base_font_size = 10
-    elif index_font_setting == 'traditional':
-        main_font = 'Charter_regular'
-        bold_font = 'Charter_bold'
-        base_font_size = 12
-    else:  # defailt to Helvetica
-        main_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-        base_font_size = 12
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph
 
+    # First, parse out the arguments.
     if date_setting == "hide_date":  # if date disabled: keep the column, just make it small and blank out the header
         date_col_hdr = ""
         date_col_width = 0
@@ -552,70 +910,13 @@ def create_toc_pdf_reportlab(
     # Now on to reportlab formatting. First, font and stylesheet wrangling
     reportlab_pdf = SimpleDocTemplate(output_file, pagesize=A4, rightMargin=1.5 * cm, leftMargin=1.5 * cm,
                                       topMargin=1 * cm, bottomMargin=1.5 * cm)
-    # Register non-standard fonts.
-    pdfmetrics.registerFont(TTFont('Charter_regular', 'Charter_Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('Charter_bold', 'Charter_Bold.ttf'))
-    pdfmetrics.registerFont(TTFont('Charter_italic', 'Charter_Italic.ttf'))
-    reportlab.rl_config.warnOnMissingFontGlyphs = 0
-
-    # Set up stylesheet for the various styles used.
-    styleSheet = getSampleStyleSheet()
-
-    main_style = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=main_font,
-        fontSize=base_font_size,
-        leading=14
-    )
-    main_style_right = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=main_font,
-        fontSize=base_font_size,
-        leading=14,
-        alignment=TA_RIGHT
-    )
-
-    bold_style = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=bold_font,
-        fontSize=base_font_size,
-        leading=14
-    )
-    claimno_style = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=bold_font,
-        fontSize=base_font_size,
-        leading=14,
-        alignment=TA_RIGHT
-    )
-    bundle_title_style = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=bold_font,
-        fontSize=base_font_size + 6,
-        leading=14,
-        alignment=TA_CENTER
-    )
-    case_name_style = ParagraphStyle(
-        'BodyText',
-        parent=styleSheet['Normal'],
-        fontName=bold_font,
-        fontSize=base_font_size + 2,
-        leading=14,
-        alignment=TA_CENTER
-    )
+    register_fonts()
 
-    styleSheet.add(ParagraphStyle(name='main_style', parent=main_style))
-    styleSheet.add(ParagraphStyle(name='main_style_right', parent=main_style_right))
-    styleSheet.add(ParagraphStyle(name='bold_style', parent=bold_style))
-    styleSheet.add(ParagraphStyle(name='claimno_style', parent=claimno_style))
-    styleSheet.add(ParagraphStyle(name='bundle_title_style', parent=bundle_title_style))
-    styleSheet.add(ParagraphStyle(name='case_name_style', parent=case_name_style))
-    # styleSheet.add(ParagraphStyle(name='footer_style', parent=footer_style))
+    # The stylesheet for the various styles used (built once per index font, and cached):
+    styleSheet = toc_paragraph_styles(index_font_setting)
+    claimno_style = styleSheet['claimno_style']
+    bundle_title_style = styleSheet['bundle_title_style']
+    case_name_style = styleSheet['case_name_style']
 
     # Now, position each element within a table.
     # There are three tables: Claim no, [Case title, bundle title], and [toc_entries]
@@ -701,13 +1002,16 @@ def create_toc_pdf_reportlab(
                 else:  # page numbers are ints, so stringfy them:
                     string_cell = str(cell)
                     new_row.append(Paragraph(string_cell, styleSheet['main_style_right']))
+            # tag the row so that TocAnchorRecorder can tell which toc entry it is when it's drawn:
+            new_row[0].toc_index = rowidx
         rowidx += 1
 
         reportlab_table_data.append(new_row)
 
+    anchor_recorder = TocAnchorRecorder()
     toc_table = Table(reportlab_table_data,
                       colWidths=[1.3 * cm, title_col_width * cm, date_col_width * cm, page_col_width * cm],
-                      repeatRows=1, cornerRadii=(5, 5, 0, 0))
+                      repeatRows=1, cornerRadii=(5, 5, 0, 0), renderCB=anchor_recorder)
     style = TableStyle([
         # Style for header row:
         ('BACKGROUND', (0, 0), (-1, 0), colors.darkgray),
@@ -744,23 +1048,105 @@ def create_toc_pdf_reportlab(
 
     # Now, build the pdf:
     elements = [claimno_table, header_table, Spacer(1, 1 * cm), toc_table]
-    if not bundle_config.roman_for_preface:
-        reportlab_pdf.build(elements, onFirstPage=reportlab_footer_config, onLaterPages=reportlab_footer_config)
+    if predict_only:
+        # SimpleDocTemplate lays out its single frame with 6pt of padding on every side.
+        return predict_story_page_count(elements, reportlab_pdf.width - 12, reportlab_pdf.height - 12)
+    if not roman_numbering:
+        # The TOC's own footers count from the end of the coversheet, out of the whole bundle:
+        toc_footer_config = bind_footer_config(
+            length_of_coversheet,
+            main_page_count + frontmatter_offset,
+            page_num_alignment,
+            page_num_font,
+            page_numbering_style,
+            footer_prefix
+        )
+        reportlab_pdf.build(elements, onFirstPage=toc_footer_config, onLaterPages=toc_footer_config)
     else:
         reportlab_pdf.build(elements)
+    return anchor_recorder.anchors
+
+
+class TocAnchorRecorder:
+    '''
+    Passed to the TOC table as its renderCB, so reportlab calls it as it draws
+    each cell (including in the parts of the table after it's split across pages).
+    For every row tagged with a toc_index, it notes which page of the TOC the row
+    landed on and the row's rectangle in PDF coordinates (origin bottom-left).
+    These anchors are what the hyperlinks are placed from, so the TOC
+    doesn't need to be scraped for text afterwards.
+    '''
+
+    def __init__(self):
+        self.anchors = []
+
+    def __call__(self, table, event, *args):
+        if event != 'startCell':
+            return
+        row_number, col_number, cell_value, cell_style, (x, y), (width, height) = args
+        if isinstance(cell_value, (list, tuple)):  # reportlab holds flowable cells as a tuple of flowables
+            cell_value = cell_value[0] if cell_value else None
+        toc_index = getattr(cell_value, 'toc_index', None)
+        if col_number != 0 or toc_index is None:
+            return
+        # positions are relative to the table, so convert them to page coordinates:
+        x0, y0 = table.canv.absolutePosition(table._colpositions[0], y)
+        x1, y1 = table.canv.absolutePosition(table._colpositions[-1], y + height)
+        self.anchors.append({
+            'toc_index': toc_index,  # index into toc_entries
+            'toc_page': table.canv.getPageNumber() - 1,  # 0-based page of the TOC
+            'rect': (x0, y0, x1, y1)
+        })
+
+
+def predict_story_page_count(elements, frame_width, frame_height):
+    '''
+    Work out how many pages a list of flowables will fill, without
+    drawing anything. This follows what reportlab's doc template does
+    with a single frame per page: each flowable is wrapped to find its
+    height, and anything that won't fit in the space left is split
+    (Table.split keeps the repeated header row) and carried over to a new page.
+    Returns None where reportlab itself would give up with a LayoutError,
+    so the caller can fall back to rendering.
+    '''
+    fuzz = 1e-6  # same tolerance as reportlab's Frame
+    page_count = 1
+    remaining_height = frame_height
+    story = list(elements)
+    while story:
+        flowable = story.pop(0)
+        _, height = flowable.wrap(frame_width, remaining_height)
+        if height <= remaining_height + fuzz:
+            remaining_height -= height
+            continue
+        parts = flowable.split(frame_width, remaining_height)
+        if parts:
+            _, first_part_height = parts[0].wrap(frame_width, remaining_height)
+            if first_part_height > remaining_height + fuzz:
+                return None
+            remaining_height -= first_part_height
+            story[0:0] = parts[1:]
+        elif remaining_height >= frame_height:
+            return None  # too big even for an empty page
+        else:
+            page_count += 1
+            remaining_height = frame_height
+            story.insert(0, flowable)
+    return page_count
 
 
-def generate_footer_pages_reportlab(filename, num_pages):
+def generate_footer_pages_reportlab(filename, num_pages, footer_config):
     """
     Generate a PDF with N blank pages, using onFirstPage and onLaterPages callbacks.
 
     Args:
         filename (str): The name of the output PDF file.
         num_pages (int): Number of blank pages to create.
-        onFirstPage (callable): Callback for the first page.
-        onLaterPages (callable): Callback for subsequent pages.
+        footer_config (callable): Callback for every page: reportlab_footer_config,
+            with this bundle's footer settings bound to it (see bind_footer_config).
         page_size (tuple): Page size, defaults to A4.
     """
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
     bundle_logger.debug(f"[GFP]Generating {num_pages} blank pages in {filename}")
     # Create the document
     doc = SimpleDocTemplate(
@@ -782,28 +1168,95 @@ def generate_footer_pages_reportlab(filename, num_pages):
         story.append(PageBreak())  # Add page breaks between blank pages
 
     # Build the document with the footer config:
-    doc.build(story, onFirstPage=reportlab_footer_config, onLaterPages=reportlab_footer_config)
+    doc.build(story, onFirstPage=footer_config, onLaterPages=footer_config)
+
+
+def bind_footer_config(length_of_frontmatter_offset, total_number_of_pages, page_num_alignment=None, page_num_font=None,
+                       page_numbering_style=None, footer_prefix=None):
+    '''
+    reportlab calls its page callbacks with just (canvas, doc), so the
+    settings for this particular bundle are bound to reportlab_footer_config here.
+    '''
+    return partial(
+        reportlab_footer_config,
+        length_of_frontmatter_offset=length_of_frontmatter_offset,
+        total_number_of_pages=total_number_of_pages,
+        page_num_alignment=page_num_alignment,
+        page_num_font=page_num_font,
+        page_numbering_style=page_numbering_style,
+        footer_prefix=footer_prefix
+    )
 
 
-def reportlab_footer_config(canvas, doc):
+def reportlab_footer_config(canvas, doc, length_of_frontmatter_offset=0, total_number_of_pages=0, page_num_alignment=None,
+                            page_num_font=None, page_numbering_style=None, footer_prefix=None):
     '''
     This is a page configuration function, and is called by
     the other reportlab functions during their build process.
-    It's not used directly, and since it's internal to reportlab
-    it's easier to operate on global variables here.
+    It's not used directly: reportlab only passes it the canvas and doc,
+    so the rest of the arguments are bound beforehand (see bind_footer_config).
     '''
-    length_of_frontmatter_offset = bundle_config.expected_length_of_frontmatter if bundle_config.expected_length_of_frontmatter else 0
-    total_number_of_pages = bundle_config.total_number_of_pages if bundle_config.total_number_of_pages else 0
-    page_num_alignment = bundle_config.page_num_align if bundle_config.page_num_align else None
-    page_num_font = bundle_config.footer_font if bundle_config.footer_font else None
-    page_numbering_style = bundle_config.page_num_style if bundle_config.page_num_style else None
-    footer_prefix = bundle_config.footer_prefix if bundle_config.footer_prefix else ""
+    length_of_frontmatter_offset = length_of_frontmatter_offset if length_of_frontmatter_offset else 0
+    total_number_of_pages = total_number_of_pages if total_number_of_pages else 0
+    footer_prefix = footer_prefix if footer_prefix else ""
+
+    # NOTE: the same function is used to make the footer for the TOC as for
+    # the main bundle. When generating the TOC, the page numbers are only offset
+    # by the coversheet; when generating the main bundle, by the whole frontmatter.
+    # The offset is bound to this function (with partial) by whichever is calling it.
+    footer_data = footer_label(
+        canvas.getPageNumber(),
+        length_of_frontmatter_offset,
+        total_number_of_pages,
+        page_numbering_style,
+        footer_prefix
+    )
 
-    if page_num_font == 'serif':
-        footer_font = 'Times-Roman'
-        footer_base_font_size = 15
-    elif page_num_font == 'Helvetica':
-        footer_font = 'sans'
+    # The footer is one line of plain text, so rather than lay out a Paragraph in a Frame
+    # on every page, it's placed from the font metrics (footer_text_origin, which gives
+    # the same position the Paragraph had) and drawn directly.
+    footer_font, footer_base_font_size = footer_font_settings(page_num_font)
+    x, y = footer_text_origin(footer_data, footer_font, footer_base_font_size, page_num_alignment)
+    canvas.saveState()
+    canvas.setFont(footer_font, footer_base_font_size)
+    canvas.drawString(x, y, footer_data)
+    canvas.restoreState()
+
+
+def warm_reportlab_caches(index_fonts=(None, 'serif', 'sans', 'mono', 'traditional')):
+    '''
+    Register the fonts and build every index stylesheet up front (e.g. as the
+    web app starts), so the first bundle doesn't pay for it.
+    '''
+    register_fonts()
+    for index_font in index_fonts:
+        toc_paragraph_styles(index_font)
+
+
+def prewarm():
+    '''
+    Do up front what the first bundle would otherwise do as it went: import the
+    modules the stages import lazily (LAZY_IMPORTED_MODULES), register the fonts and
+    build the stylesheets. For a long-running server, or a Lambda's init phase
+    (see BUNTOOL_PREWARM in app.py). Returns how long it took, in seconds.
+    '''
+    started = time.perf_counter()
+    for module_name in LAZY_IMPORTED_MODULES:
+        importlib.import_module(module_name)
+    warm_reportlab_caches()
+    return time.perf_counter() - started
+
+
+def footer_font_settings(page_num_font):
+    '''
+    Maps the footer font option from the frontend onto a
+    reportlab font name and size. Shared by every footer renderer.
+    '''
+    if page_num_font == 'serif':
+        footer_font = 'Times-Roman'
+        footer_base_font_size = 15
+    elif page_num_font == 'Helvetica':
+        footer_font = 'sans'
         footer_base_font_size = 14
     elif page_num_font == 'mono':
         footer_font = 'Courier'
@@ -814,88 +1267,165 @@ def reportlab_footer_config(canvas, doc):
     else:  # defalt to Helvetica
         footer_font = 'Helvetica'
         footer_base_font_size = 14
+    return footer_font, footer_base_font_size
 
-    canvas.saveState()
-    canvas.setFont('Times-Bold', 16)
-    if page_num_alignment == "left":
-        footer_style = ParagraphStyle(
-            'BodyText',
-            fontSize=footer_base_font_size,
-            fontName=footer_font,
-            # leading=14,
-            alignment=TA_LEFT
-        )
-    elif page_num_alignment == "right":
-        footer_style = ParagraphStyle(
-            'BodyText',
-            fontSize=footer_base_font_size,
-            fontName=footer_font,
-            # leading=14,
-            alignment=TA_RIGHT
-        )
-    elif page_num_alignment == "centre":
-        footer_style = ParagraphStyle(
-            'BodyText',
-            fontSize=footer_base_font_size,
-            fontName=footer_font,
-            # leading=14,
-            alignment=TA_CENTER
-        )
-    else:
-        footer_style = ParagraphStyle(
-            'BodyText',
-            fontSize=footer_base_font_size,
-            fontName=footer_font,
-            # leading=14,
-            alignment=TA_RIGHT
-        )
 
+def footer_label(page_number, length_of_frontmatter_offset, total_number_of_pages, page_numbering_style, footer_prefix):
+    '''
+    The text of the footer for one page, e.g. "Bundle A Page 12 of 300".
+    page_number is the 1-based page number within the document being
+    paginated; length_of_frontmatter_offset is added to it for the styles
+    which count from the start of the whole bundle.
+    '''
     if footer_prefix:
         footer_data = footer_prefix.strip() + " "
     else:
         footer_data = ""
 
     # parse page numbering style and APPEND to the existing text above.
-    # NOTE: This feels a bit janky, but the same function is being used to
-    # make the footer for the TOC as is used for the main bundle.
-    # When generating the TOC, there is no need to offset page numbers.
-    # But when generating the main bundle, there is.
-    # There's not much control of the arguments to pass to this function, because
-    # it's called in the inner workings of ReportLab. The janky solution is that the
-    # offset parameter length_of_frontmatter_offset is a global parameter, initially
-    # set to 0 (at the time this is first called) and later set to the frontmatter length.
-
     if page_numbering_style == "x":
-        footer_data += f"{canvas.getPageNumber() + length_of_frontmatter_offset}"
-    #    bundle_logger.debug("[rplb]..Page numbering style: x")
+        footer_data += f"{page_number + length_of_frontmatter_offset}"
     elif page_numbering_style == "x_of_y":
-        footer_data += f"{canvas.getPageNumber()} of {str(total_number_of_pages)}"
-    #    bundle_logger.debug("[rplb]..Page numbering style: x of y")
+        footer_data += f"{page_number} of {str(total_number_of_pages)}"
     elif page_numbering_style == "page_x":
-        footer_data += f"Page {canvas.getPageNumber() + length_of_frontmatter_offset}"
-    #    bundle_logger.debug("[rplb]..Page numbering style: Page x")
+        footer_data += f"Page {page_number + length_of_frontmatter_offset}"
     elif page_numbering_style == "page_x_of_y":
-        footer_data += f"Page {canvas.getPageNumber() + length_of_frontmatter_offset} of {str(total_number_of_pages)}"
-    #    bundle_logger.debug("[rplb]..Page numbering style: Page x of y")
+        footer_data += f"Page {page_number + length_of_frontmatter_offset} of {str(total_number_of_pages)}"
     elif page_numbering_style == "x_slash_y":
-        footer_data += f"{canvas.getPageNumber() + length_of_frontmatter_offset} / {str(total_number_of_pages)}"
-    #    bundle_logger.debug("[rplb]..Page numbering style: x / y")
+        footer_data += f"{page_number + length_of_frontmatter_offset} / {str(total_number_of_pages)}"
     else:
-        footer_data += f"Page {canvas.getPageNumber() + length_of_frontmatter_offset}"
-    #    bundle_logger.debug("[rplb]..Defaulting to page numbering style: Page x")
-
-    footer_frame = Frame(
-        0, 0 * cm,  # x, y lower left
-        PAGE_WIDTH, 1.5 * cm,  # box width and height
-        leftPadding=50,
-        bottomPadding=0,
-        rightPadding=50,
-        topPadding=0,
-        id="footerframe",
-        showBoundary=1
-    )
-    footer_frame.hAlign = "RIGHT"
-    footer_frame.add(Paragraph(footer_data, footer_style), canvas)
+        footer_data += f"Page {page_number + length_of_frontmatter_offset}"
+    return footer_data
+
+
+def footer_text_origin(text, font_name, font_size, page_num_alignment):
+    '''
+    Where the start of the footer text baseline goes on an A4 page, for both
+    reportlab_footer_config and stamp_page_numbers_in_memory. This is where
+    the footers have always been: as if drawn as a paragraph in a frame 1.5cm
+    high along the bottom edge, with 50pt padding left and right.
+    Returns (x, y) in points.
+    '''
+    from reportlab.pdfbase import pdfmetrics
+    available_width = PAGE_WIDTH - 100
+    text_width = pdfmetrics.stringWidth(text, font_name, font_size)
+    if page_num_alignment == "left":
+        x = 50
+    elif page_num_alignment == "centre":
+        x = 50 + (available_width - text_width) / 2
+    else:  # right, and the default
+        x = 50 + available_width - text_width
+    # A paragraph with the default leading of 12 sits at the top of the frame,
+    # and reportlab puts the first baseline one font size below the paragraph's top.
+    y = 1.5 * cm - font_size
+    return x, y
+
+
+def build_footer_font_resource(pdf, font_name, characters):
+    '''
+    Returns (font_object, encode) for stamping footers with font_name.
+    The font dictionary is made by reportlab, from a scrap page on which all
+    the characters the footers need are drawn once, so the standard fonts and
+    the embedded (subset) TrueType fonts like Charter come out exactly as
+    reportlab would write them. It is copied into `pdf` once and shared by
+    every page. encode(text) turns a footer string into the bytes which
+    select the right glyphs from that font.
+    '''
+    from reportlab.lib.rl_accel import unicode2T1
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfgen import canvas
+    buffer = io.BytesIO()
+    scrap = canvas.Canvas(buffer, pagesize=A4)
+    scrap.setFont(font_name, 10)
+    scrap.drawString(0, 0, characters)
+    scrap.save()
+    buffer.seek(0)
+    with Pdf.open(buffer) as scrap_pdf:
+        scrap_page = scrap_pdf.pages[0]
+        font_resource_name = None
+        for operands, operator in parse_content_stream(scrap_page):
+            if str(operator) == "Tf":
+                font_resource_name = operands[0]
+        font_object = pdf.copy_foreign(scrap_page.Resources.Font[font_resource_name])
+
+    font = pdfmetrics.getFont(font_name)
+    if font._dynamicFont:
+        # TrueType: reportlab has already assigned a code to each character
+        # in this subset, so re-use its assignments.
+        def encode(text):
+            return b''.join(t for subset, t in font.splitString(text, scrap._doc))
+    else:
+        def encode(text):
+            return b''.join(t if f is font else b'?' * len(t) for f, t in unicode2T1(text, [font]))
+    return font_object, encode
+
+
+def footer_font_resource_name(page, font_object, font_names):
+    '''
+    The name page can use font_object by in its /Resources, adding it if need be.
+    Pages merged from the same document often share one /Resources (or /Font)
+    dictionary, so the name given to each shared dictionary is kept in font_names
+    (by objgen) and reused, instead of adding the font again under a new name for every page.
+    '''
+    resources = page.obj.get("/Resources")
+    fonts = resources.get("/Font") if isinstance(resources, Dictionary) else None
+    shared = fonts if isinstance(fonts, Dictionary) and fonts.is_indirect else resources
+    key = shared.objgen if isinstance(shared, Dictionary) and shared.is_indirect else None
+    if key is not None and key in font_names:
+        return font_names[key]
+    resource_name = page.add_resource(font_object, Name.Font, prefix="FBun")
+    if key is not None:
+        font_names[key] = resource_name
+    return resource_name
+
+
+def stamp_page_numbers_in_memory(
+        pdf,
+        frontmatter_offset=0,
+        total_number_of_pages=0,
+        page_num_alignment=None,
+        page_num_font=None,
+        page_numbering_style=None,
+        footer_prefix=None
+):
+    '''
+    A faster Bates machine.
+    Instead of drawing N blank footer pages with reportlab and overlaying them
+    (pdf_paginator_reportlab / paginate_pdf_in_memory), this writes a tiny
+    content stream onto each page of `pdf` in place: the same text as
+    reportlab_footer_config, in the same place, with one font resource
+    shared by all pages.
+    As with add_footer_to_bundle, the footer is laid out for A4 and scaled to
+    the width of each page. The existing page content is wrapped in q/Q so
+    whatever graphics state it leaves behind can't move or recolour the footer.
+    Returns the number of pages stamped.
+    '''
+    bundle_logger.debug("[SPN]Stamping page numbers in place")
+    register_fonts()
+    main_page_count = len(pdf.pages)
+    font_name, font_size = footer_font_settings(page_num_font)
+    labels = [
+        footer_label(idx + 1, frontmatter_offset, total_number_of_pages, page_numbering_style, footer_prefix)
+        for idx in range(main_page_count)
+    ]
+    characters = ''.join(sorted(set(''.join(labels))))
+    font_object, encode = build_footer_font_resource(pdf, font_name, characters)
+    save_state = pdf.make_stream(b"q\n")
+    font_names = {}  # objgen of a shared /Resources or /Font dictionary -> the footer font's name in it
+
+    for page, label in zip(pdf.pages, labels):
+        x, y = footer_text_origin(label, font_name, font_size, page_num_alignment)
+        mediabox = [float(v) for v in page.mediabox]
+        scale = (mediabox[2] - mediabox[0]) / PAGE_WIDTH
+        resource_name = footer_font_resource_name(page, font_object, font_names)
+        footer_stream = (
+            f"Q\nq {scale:.6f} 0 0 {scale:.6f} {mediabox[0]:.4f} {mediabox[1]:.4f} cm "
+            f"BT 0 g {resource_name} {font_size} Tf {x:.4f} {y:.4f} Td <{encode(label).hex()}> Tj ET Q\n"
+        ).encode("latin-1")
+        page.contents_add(save_state, prepend=True)
+        page.contents_add(pdf.make_stream(footer_stream))
+    bundle_logger.debug(f"[SPN]Stamped page numbers on {main_page_count} pages")
+    return main_page_count
 
 
 def create_toc_pdf_tex(toc_entries, casedetails, output_file, confidential=False, date_setting=True,
@@ -1266,12 +1796,29 @@ def generate_footer_pages_tex(
     return page_numbers_pdf_path
 
 
-def add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file):
+def add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file, pdf_engine=DEFAULT_PDF_ENGINE):
     '''
     A pythonic Bates machine.
     Given an input file (a series of pdfs merged together) and
     a pdf of equal length containing only the page number footers,
     this combines the two by overlaying footers on top of the input file.
+    With pdf_engine "pikepdf" (see PDF_ENGINES) this is overlay_pages_in_memory;
+    "pypdf" is the original version, add_footer_to_bundle_pypdf.
+    '''
+    if pdf_engine == "pypdf":
+        return add_footer_to_bundle_pypdf(input_file, page_numbers_pdf_path, output_file)
+    try:
+        with Pdf.open(input_file) as input_pdf, Pdf.open(page_numbers_pdf_path) as page_numbers_pdf:
+            overlay_pages_in_memory(input_pdf, page_numbers_pdf)
+            input_pdf.save(output_file)
+    except Exception as e:
+        bundle_logger.error(f"[OPN]Error overlaying page numbers: {e}")
+        raise e
+
+
+def add_footer_to_bundle_pypdf(input_file, page_numbers_pdf_path, output_file):
+    '''
+    add_footer_to_bundle, done with pypdf.
     It scales the footer according to horizontal scaling factor (an imperfect
     solution to a difficult problem)
     '''
@@ -1280,6 +1827,7 @@ def add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file):
     # a4 paper (which I've chosen for the reference page numbering) is 210mm x 297mm = 595 x 842 points
     # height isn't such an issue, but width is or we'll overflow.
     a4_width = 595
+    from pypdf import PdfReader, PdfWriter
     try:
         # Load the input PDF and the page numbers PDF
         input_pdf = PdfReader(input_file)
@@ -1297,6 +1845,7 @@ def add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file):
         for input_page, overlay_page in zip(input_pdf.pages, page_numbers_pdf.pages):
             # get page of input page
             input_page_size = input_page.mediabox
+            overlay_page_size = overlay_page.mediabox
             scaling_factor = overlay_page_size[2] / input_page_size[2]
             overlay_page.merge_scaled_page(input_page, scaling_factor)
             writer.add_page(overlay_page)
@@ -1316,31 +1865,46 @@ def pdf_paginator_reportlab(
         page_num_alignment=None,
         page_num_font=None,
         page_numbering_style=None,
-        footer_prefix=None
+        footer_prefix=None,
+        total_number_of_pages=None,
+        pdf_engine=DEFAULT_PDF_ENGINE
 ):
     '''
     Drop in replacement for tex alternative.
     Calls sub-functions to create page numbers and add them to the bundle.
+    total_number_of_pages (for the "x of y" styles) defaults to the
+    pages of input_file plus the frontmatter.
+    pdf_engine is passed on to add_footer_to_bundle.
     '''
 
     bundle_logger.debug("[PPRL]Paginate PDF function beginning (ReporLab version)")
     main_page_count = 0
     try:
-        tocsrc = Pdf.open(input_file)
-        main_page_count += len(tocsrc.pages)
+        with Pdf.open(input_file) as tocsrc:
+            main_page_count += len(tocsrc.pages)
         bundle_logger.debug(f"[PPRL]..Main PDF opened with {main_page_count} pages")
     except Exception as e:
         bundle_logger.error(f"[PPRL]..Error counting pages in TOC: {e}")
         raise e
         return
     page_numbers_pdf_path = os.path.join(os.path.dirname(output_file), "pageNumbers.pdf")
+    if total_number_of_pages is None:
+        total_number_of_pages = main_page_count + frontmatter_offset
     generate_footer_pages_reportlab(
         page_numbers_pdf_path,
         main_page_count,
+        bind_footer_config(
+            frontmatter_offset,
+            total_number_of_pages,
+            page_num_alignment,
+            page_num_font,
+            page_numbering_style,
+            footer_prefix
+        )
     )
     if os.path.exists(page_numbers_pdf_path):
         try:
-            add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file)
+            add_footer_to_bundle(input_file, page_numbers_pdf_path, output_file, pdf_engine)
             bundle_logger.debug(f"[PPRL]Page numbers overlaid on main PDF")
         except Exception as e:
             bundle_logger.error(f"[PPRL]Error overlaying page numbers: {e}")
@@ -1350,6 +1914,63 @@ def pdf_paginator_reportlab(
     return main_page_count
 
 
+def paginate_pdf_in_memory(
+        pdf,
+        open_pdfs,
+        frontmatter_offset,
+        total_number_of_pages,
+        page_num_alignment=None,
+        page_num_font=None,
+        page_numbering_style=None,
+        footer_prefix=None
+):
+    '''
+    In-memory counterpart to pdf_paginator_reportlab.
+    The footer pages are still drawn by reportlab (via
+    generate_footer_pages_reportlab), but into a buffer rather than
+    pageNumbers.pdf, and they are overlaid onto the pages of `pdf` with
+    pikepdf instead of round-tripping the whole bundle through pypdf.
+    pikepdf fits each footer page to the page it lands on, which does the
+    same job as the horizontal scaling in add_footer_to_bundle.
+    The footer PDF is appended to open_pdfs because the overlays borrow
+    its content until `pdf` is saved.
+    '''
+    bundle_logger.debug("[PPIM]Paginate PDF function beginning (in-memory version)")
+    main_page_count = len(pdf.pages)
+    footer_buffer = io.BytesIO()
+    generate_footer_pages_reportlab(
+        footer_buffer,
+        main_page_count,
+        bind_footer_config(
+            frontmatter_offset,
+            total_number_of_pages,
+            page_num_alignment,
+            page_num_font,
+            page_numbering_style,
+            footer_prefix
+        )
+    )
+    footer_buffer.seek(0)
+    footer_pdf = Pdf.open(footer_buffer)
+    open_pdfs.append(footer_pdf)
+    overlay_pages_in_memory(pdf, footer_pdf)
+    bundle_logger.debug(f"[PPIM]Page numbers overlaid on {main_page_count} pages")
+    return main_page_count
+
+
+def overlay_pages_in_memory(pdf, overlay_pdf):
+    '''
+    Draw each page of overlay_pdf over the matching page of pdf, fitted to it
+    (which does the same job as the horizontal scaling in add_footer_to_bundle_pypdf).
+    overlay_pdf has to stay open until pdf is saved.
+    '''
+    if len(overlay_pdf.pages) != len(pdf.pages):
+        raise ValueError(
+            f"Page counts of bundle and page numbers do not match: bundle = {len(pdf.pages)} vs page numbers: {len(overlay_pdf.pages)}")
+    for page, overlay_page in zip(pdf.pages, overlay_pdf.pages):
+        page.add_overlay(overlay_page)
+
+
 def pdf_paginator_tex(input_file, output_file, frontmatter_offset, page_num_alignment=None, page_num_font=None,
                       page_numbering_style=None, footer_prefix=None):
     '''
@@ -1391,6 +2012,16 @@ def pdf_paginator_tex(input_file, output_file, frontmatter_offset, page_num_alig
 
 
 def add_roman_labels(pdf_file, length_of_frontmatter, output_file):
+    '''
+    File-based wrapper around add_roman_labels_in_memory.
+    '''
+    bundle_logger.debug(f"[APL]Adding page labels to PDF {pdf_file}")
+    with Pdf.open(pdf_file) as pdf:
+        add_roman_labels_in_memory(pdf, length_of_frontmatter)
+        pdf.save(output_file)
+
+
+def add_roman_labels_in_memory(pdf, length_of_frontmatter):
     '''
     Optionally adjust page numbering to begin with Roman numerals for
     the frontmatter, beginning with page 1 on the first page of the main
@@ -1398,15 +2029,11 @@ def add_roman_labels(pdf_file, length_of_frontmatter, output_file):
     The elegant solution which is so often messed up that nobody wants to
     go near it any more.
     '''
-    bundle_logger.debug(f"[APL]Adding page labels to PDF {pdf_file}")
-    with Pdf.open(pdf_file) as pdf:
-        nums = [
-            0, Dictionary(S=Name.r),  # lowercase Roman starting at first page of bundle
-            length_of_frontmatter, Dictionary(S=Name.D)  # Decimal starting at page 1 after frontmatter
-        ]
-
-        pdf.Root.PageLabels = Dictionary(Nums=nums)
-        pdf.save(output_file)
+    nums = [
+        0, Dictionary(S=Name.r),  # lowercase Roman starting at first page of bundle
+        length_of_frontmatter, Dictionary(S=Name.D)  # Decimal starting at page 1 after frontmatter
+    ]
+    pdf.Root.PageLabels = Dictionary(Nums=nums)
 
 
 def process_csv_index(csv_index):
@@ -1439,12 +2066,28 @@ def transform_coordinates(coords, page_height):
     return (x1, new_y1, x2, new_y2)
 
 
-def add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_file):
+def add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_file, pdf_engine=DEFAULT_PDF_ENGINE):
     '''
     This is responsible for the nuts and bolts of writing
     hyperlinks into the output bundle PDF.
     It's only called as a subprocess of add_hyperlinks.
+    With pdf_engine "pikepdf" (see PDF_ENGINES) the links are written by
+    add_annotations_in_memory; "pypdf" is the original version, add_annotations_pypdf.
+    '''
+    if pdf_engine == "pypdf":
+        return add_annotations_pypdf(pdf_file, list_of_annotation_coords, output_file)
+    with Pdf.open(pdf_file) as pdf:
+        add_annotations_in_memory(pdf, list_of_annotation_coords)
+        pdf.save(output_file)
+
+
+def add_annotations_pypdf(pdf_file, list_of_annotation_coords, output_file):
+    '''
+    add_annotations_with_transform, done with pypdf.
     '''
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.annotations import Link
+    from pypdf.generic import Fit
     reader = PdfReader(pdf_file)
     writer = PdfWriter()
 
@@ -1481,8 +2124,8 @@ def add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_f
             #     transformed_coords[0], transformed_coords[1],  # x1, y2 (bottom left)
             #     transformed_coords[2], transformed_coords[1]   # x2, y2 (bottom right)
             # ]
-            bundle_logger.debug(
-                f"[AAWT]Added annotations on TOC page {toc_page} to destination pg index {destination_page}")
+            bundle_logger.debug("[AAWT]Added annotations on TOC page %s to destination pg index %s", toc_page,
+                                destination_page)
 
         except Exception as e:
             bundle_logger.error(f"[AAWT]Failed to add annotations on TOC page {toc_page}: {e}")
@@ -1493,6 +2136,40 @@ def add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_f
         writer.write(output)
 
 
+def add_annotations_in_memory(pdf, list_of_annotation_coords):
+    '''
+    In-memory counterpart to add_annotations_pypdf: writes the
+    same /Link annotations (jumping to the destination page, /FitH) using
+    pikepdf directly on the bundle.
+    '''
+    for annotation in list_of_annotation_coords:
+        toc_page = annotation['toc_page']
+        coords = annotation['coords']
+        destination_page = annotation['destination_page']
+
+        page = pdf.pages[toc_page]
+        page_height = float(page.mediabox[3])
+        transformed_coords = transform_coordinates(coords, page_height)
+
+        try:
+            link = pdf.make_indirect(Dictionary(
+                Type=Name.Annot,
+                Subtype=Name.Link,
+                Rect=Array([float(c) for c in transformed_coords]),
+                Border=Array([0, 0, 0]),
+                Dest=Array([pdf.pages[destination_page].obj, Name.FitH, None])
+            ))
+            if Name.Annots in page.obj:
+                page.obj.Annots.append(link)
+            else:
+                page.obj.Annots = Array([link])
+            bundle_logger.debug("[AAIM]Added annotations on TOC page %s to destination pg index %s", toc_page,
+                                destination_page)
+        except Exception as e:
+            bundle_logger.error(f"[AAIM]Failed to add annotations on TOC page {toc_page}: {e}")
+            raise e
+
+
 def add_hyperlinks(
         pdf_file,
         output_file,
@@ -1500,7 +2177,8 @@ def add_hyperlinks(
         length_of_frontmatter,
         toc_entries,
         date_setting="show_date",
-        roman_page_labels=False
+        roman_page_labels=False,
+        pdf_engine=DEFAULT_PDF_ENGINE
 ):
     '''
     Add Hyperlinks to the table of contents pages. The PDF standard defines these as
@@ -1517,13 +2195,117 @@ def add_hyperlinks(
     - pass off to the annotation writer for actual writing.
     '''
     bundle_logger.debug(f"[HYP]Starting hyperlink addition")
-    scraped_pages_text = []
-    list_of_annotation_coords = []
-    longtitle = 0
-
     # Step 1: Extract text and coordinates from TOC
+    scraped_pages_text = scrape_toc_text(pdf_file, length_of_coversheet, length_of_frontmatter)
+    # Step 2: Match TOC entries to text and get coordinates
+    list_of_annotation_coords = find_hyperlink_coords(
+        scraped_pages_text,
+        length_of_coversheet,
+        length_of_frontmatter,
+        toc_entries,
+        date_setting,
+        roman_page_labels
+    )
+    # Step 3: Add annotations to the PDF
+    add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_file, pdf_engine)
+
+
+def add_hyperlinks_in_memory(
+        pdf,
+        toc_pdf_file,
+        length_of_coversheet,
+        length_of_frontmatter,
+        toc_entries,
+        date_setting="show_date",
+        roman_page_labels=False,
+        toc_anchors=None
+):
+    '''
+    In-memory counterpart to add_hyperlinks.
+    Where the TOC was generated here, toc_anchors (from create_toc_pdf_reportlab)
+    already say where every row was drawn, so the links are placed from those.
+    Otherwise, the text is scraped from the standalone index PDF (toc_pdf_file)
+    rather than from the merged bundle, since the index pages are the only ones
+    that get searched. Its pages sit straight after the coversheet in `pdf`.
+    The link annotations are then written straight onto `pdf`.
+    '''
+    bundle_logger.debug(f"[HYP]Starting hyperlink addition (in-memory)")
+    number_of_linkable_entries = len([
+        entry for entry in toc_entries
+        if not is_toc_header_row(entry) and "SECTION_BREAK" not in entry[0]
+    ])
+    if toc_anchors and len(toc_anchors) == number_of_linkable_entries:
+        bundle_logger.debug(f"[HYP]..Placing {len(toc_anchors)} hyperlinks from TOC layout anchors")
+        toc_page_height = float(pdf.pages[length_of_coversheet].mediabox[3])
+        list_of_annotation_coords = find_hyperlink_coords_from_anchors(
+            toc_anchors,
+            toc_entries,
+            length_of_coversheet,
+            length_of_frontmatter,
+            toc_page_height
+        )
+    else:
+        if toc_anchors:
+            bundle_logger.warning(
+                f"[HYP]..Have {len(toc_anchors)} TOC anchors for {number_of_linkable_entries} entries, scraping the TOC instead")
+        with Pdf.open(toc_pdf_file) as toc_pdf:
+            length_of_toc = len(toc_pdf.pages)
+        scraped_pages_text = scrape_toc_text(toc_pdf_file, 0, length_of_toc)
+        list_of_annotation_coords = find_hyperlink_coords(
+            scraped_pages_text,
+            length_of_coversheet,
+            length_of_frontmatter,
+            toc_entries,
+            date_setting,
+            roman_page_labels
+        )
+    add_annotations_in_memory(pdf, list_of_annotation_coords)
+
+
+def is_toc_header_row(entry):
+    '''
+    True for the ["Tab", "Title", "Date", "Page"] header row which
+    create_toc_pdf_reportlab puts at the top of toc_entries.
+    '''
+    return "tab" in entry[0].lower() and "title" in entry[1].lower() and "page" in str(entry[3]).lower()
+
+
+def find_hyperlink_coords_from_anchors(
+        toc_anchors,
+        toc_entries,
+        length_of_coversheet,
+        length_of_frontmatter,
+        toc_page_height
+):
+    '''
+    Turn the row anchors recorded while the TOC was drawn into the same
+    annotation dicts find_hyperlink_coords produces. Each link covers the
+    whole row, so a title that wraps over several lines is clickable throughout.
+    The rects are in PDF coordinates, so they're flipped into the top-left
+    system which add_annotations_in_memory expects.
+    '''
+    list_of_annotation_coords = []
+    for anchor in toc_anchors:
+        entry = toc_entries[anchor['toc_index']]
+        list_of_annotation_coords.append({
+            'title': entry[1],
+            'toc_page': anchor['toc_page'] + length_of_coversheet,
+            'coords': transform_coordinates(anchor['rect'], toc_page_height),
+            'destination_page': int(entry[3]) + length_of_frontmatter
+        })
+    return list_of_annotation_coords
+
+
+def scrape_toc_text(pdf_file, first_page_idx, end_page_idx):
+    '''
+    Extract the lines of text (with coordinates) from pages
+    first_page_idx up to, but not including, end_page_idx of pdf_file.
+    Returns one list of pdfplumber text lines per page.
+    '''
+    import pdfplumber
+    scraped_pages_text = []
     with pdfplumber.open(pdf_file) as pdf:
-        for idx in range(length_of_coversheet, length_of_frontmatter):
+        for idx in range(first_page_idx, end_page_idx):
             current_page = pdf.pages[idx]
             bundle_logger.debug(f"[HYP]..Processing page {idx} for TOC text extraction")
             # scraped_toc_text = current_page.extract_words(keep_blank_chars=True, use_text_flow=True)
@@ -1536,12 +2318,29 @@ def add_hyperlinks(
     #         for line in page:
     #             f.write(f"{line['text']}\n")
     #         f.write("\n")
-    # Step 2: Match TOC entries to text and get coordinates
+    return scraped_pages_text
+
+
+def find_hyperlink_coords(
+        scraped_pages_text,
+        length_of_coversheet,
+        length_of_frontmatter,
+        toc_entries,
+        date_setting="show_date",
+        roman_page_labels=False
+):
+    '''
+    Match each toc entry against the scraped TOC text (see scrape_toc_text),
+    whose first page is page length_of_coversheet of the bundle.
+    Returns a list of annotation dicts for the annotation writer.
+    '''
+    list_of_annotation_coords = []
+    longtitle = 0
     for entry in toc_entries:  # toc_entries format: [tab_number, title, date, page_count]
         matched_this_entry_flag = False
         bundle_logger.debug(f"[HYP]..Processing TOC entry: {entry}")
         # if it's a section break, skip this part
-        if "tab" in entry[0].lower() and "title" in entry[1].lower() and "page" in entry[3].lower():
+        if is_toc_header_row(entry):
             continue
         if "SECTION_BREAK" in entry[0]:
             continue
@@ -1624,15 +2423,43 @@ def add_hyperlinks(
                         list_of_annotation_coords.append(annotation)
                         break
 
-    # Step 3: Add annotations to the PDF
-    # for annotation in list_of_annotation_coords:
-    add_annotations_with_transform(pdf_file, list_of_annotation_coords, output_file)
+    return list_of_annotation_coords
+
+
+# The stages of create_bundle, in order, as reported to BundleConfig.progress_callback:
+# "downsample" is only reached if downsample_images is set, "labels" (roman page labels) if roman_for_preface is,
+# and "optimize" if optimize_output is. "merge" includes loading a reused paginated body, in which case
+# "paginate" isn't reached. "dummy_toc" is only reached if the TOC's length can't be predicted, and is
+# entered from "toc" (which then carries on) if the prediction turns out wrong.
+BUNDLE_STAGES = ["preflight", "downsample", "plan", "toc_length", "dummy_toc", "toc", "merge", "paginate", "docx", "frontmatter", "hyperlinks", "bookmarks",
+                 "labels", "optimize", "save", "zip"]
+
+
+def report_progress(bundle_config, stage, bundle_metrics=None):
+    '''
+    Tell whoever is waiting on this bundle (e.g. a job in jobs.py) which stage it's reached,
+    and start timing the stage in bundle_metrics (see instrumentation.py), if given.
+    A broken callback is logged but never allowed to stop the bundle.
+    '''
+    bundle_logger.debug(f"[CB]Stage: {stage}")
+    if bundle_metrics:
+        bundle_metrics.start_stage(stage)
+    if bundle_config.progress_callback:
+        try:
+            bundle_config.progress_callback(stage)
+        except Exception as e:
+            bundle_logger.error(f"[CB]..Progress callback failed at stage {stage}: {e}")
 
 
 class BundleConfig:
     def __init__(self, timestamp, case_details, csv_string, confidential_bool, zip_bool, session_id, user_agent,
                  page_num_align, index_font, footer_font, page_num_style, footer_prefix, date_setting,
-                 roman_for_preface, expected_length_of_frontmatter=0, main_page_count=0, temp_dir=None, logs_dir=None, bookmark_setting="uk_abbreviated"):
+                 roman_for_preface, temp_dir=None, logs_dir=None, bookmark_setting="uk_abbreviated",
+                 debug_intermediates=False, page_number_engine="stamp", predict_toc_length=True, preflight_workers=None,
+                 progress_callback=None, input_file_hashes=None, pdf_cache=None, reuse_paginated_body=False,
+                 metrics_callback=None, zip_mode="file", output_dir=None, linearize=False, optimize_output=False,
+                 downsample_images=False, image_target_dpi=150, image_jpeg_quality=75, image_greyscale=False,
+                 size_budget_bytes=None, memory_bounded_merge=False, merge_rss_ceiling_mb=None):
         self.timestamp = timestamp if timestamp else datetime.now().strftime("%Y-%m-%d-%H%M%S")
         self.case_details = case_details
         self.csv_string = csv_string if csv_string else None
@@ -1647,46 +2474,274 @@ class BundleConfig:
         self.footer_prefix = footer_prefix if footer_prefix else ""
         self.date_setting = date_setting if date_setting else "DD_MM_YYYY"
         self.roman_for_preface = roman_for_preface if roman_for_preface else False
-        self.expected_length_of_frontmatter = expected_length_of_frontmatter if expected_length_of_frontmatter else 0
-        self.main_page_count = main_page_count if main_page_count else 0
-        self.total_number_of_pages = self.main_page_count + self.expected_length_of_frontmatter
         self.temp_dir = temp_dir if temp_dir else os.path.join('/tmp', 'tempfiles', self.session_id)
         self.logs_dir = logs_dir if logs_dir else os.path.join('/tmp', 'logs', self.session_id)
         self.bookmark_setting = bookmark_setting if bookmark_setting else "uk_abbreviated"
+        # write (and keep) the TEMP0x snapshots between stages, for debugging:
+        self.debug_intermediates = debug_intermediates if debug_intermediates else False
+        # "stamp" writes the footers straight into each page; "reportlab" overlays reportlab-drawn footer pages:
+        self.page_number_engine = page_number_engine if page_number_engine else "stamp"
+        # work out the TOC length from its layout instead of rendering a dummy TOC first:
+        self.predict_toc_length = predict_toc_length
+        # processes used to preflight the input files (None: one per CPU):
+        self.preflight_workers = preflight_workers
+        # called with each stage name (see BUNDLE_STAGES) as create_bundle reaches it:
+        self.progress_callback = progress_callback
+        # sha256 of each input file by path, if already known (preflight then needn't hash them):
+        self.input_file_hashes = input_file_hashes
+        # a pdfcache.PdfCache shared between bundles, or None not to cache input PDFs:
+        self.pdf_cache = pdf_cache
+        # keep paginated bodies in pdf_cache, and reuse them in rebuilds (see paginated_body_fingerprint):
+        self.reuse_paginated_body = reuse_paginated_body if reuse_paginated_body else False
+        # called with this bundle's metrics record (see instrumentation.py) when it's finished:
+        self.metrics_callback = metrics_callback
+        # "file" writes the zip with the bundle; "stream" makes it as it's downloaded (see stream_zip):
+        self.zip_mode = zip_mode if zip_mode else "file"
+        # where the finished bundle and zip are written (None: temp_dir):
+        self.output_dir = output_dir
+        # save the bundle linearized ("fast web view"): see bundle_save_options:
+        self.linearize = linearize if linearize else False
+        # drop unused and duplicate resources, and save with object streams (see optimize.py):
+        self.optimize_output = optimize_output if optimize_output else False
+        # downsample input images above image_target_dpi to JPEG (see downsample.py):
+        self.downsample_images = downsample_images if downsample_images else False
+        self.image_target_dpi = image_target_dpi if image_target_dpi else 150
+        self.image_jpeg_quality = image_jpeg_quality if image_jpeg_quality else 75
+        self.image_greyscale = image_greyscale if image_greyscale else False
+        # with downsample_images, the bytes the input files must fit in (None: always downsample, to the target):
+        self.size_budget_bytes = size_budget_bytes
+        # merge a batch of input files at a time through a file on disk, within merge_rss_ceiling_mb
+        # (None: MERGE_BATCH_BYTES of input per batch): see merge_planned_sources_bounded:
+        self.memory_bounded_merge = memory_bounded_merge if memory_bounded_merge else False
+        self.merge_rss_ceiling_mb = merge_rss_ceiling_mb
+
+
+def bundle_save_options(bundle_config):
+    '''
+    pikepdf save() options for the finished bundle.
+    Linearizing puts the first page's objects, and a hint table for the rest, at the
+    start of the file. It's paired with object streams, which pack the bundle's many
+    small objects (annotations, outlines, page dictionaries) into compressed streams,
+    and costs an extra pass over the file when saving: see `benchmark.py save`.
+    Object streams are also used for optimize_output (see optimize.py).
+    Either way, call compress_uncompressed_streams first: these options turn off
+    pikepdf's own compress_streams, which makes linearizing very slow.
+    '''
+    save_options = {}
+    if bundle_config.linearize or bundle_config.optimize_output:
+        save_options.update(object_stream_mode=ObjectStreamMode.generate, compress_streams=False,
+                            stream_decode_level=StreamDecodeLevel.none)
+    if bundle_config.linearize:
+        save_options["linearize"] = True
+    return save_options
 
-def create_bundle(input_files, output_file, coversheet, index_file, bundle_config_data):
+
+def paginate_main_pages(bundle_pdf, open_pdfs, expected_length_of_frontmatter, total_number_of_pages, main_page_count,
+                        temp_dir, bundle_config):
+    '''
+    Put page numbers on the merged main pages of the bundle, with whichever
+    engine bundle_config.page_number_engine asks for.
+    '''
+    bundle_logger.debug(f"[CB]Paginating main pages with arguments:")
+    bundle_logger.debug(f"[CB]....page_num_alignment: {bundle_config.page_num_align}")
+    bundle_logger.debug(f"[CB]....page_num_font: {bundle_config.footer_font}")
+    bundle_logger.debug(f"[CB]....page_numbering_style: {bundle_config.page_num_style}")
+    bundle_logger.debug(f"[CB]....footer_prefix: {bundle_config.footer_prefix}")
+    bundle_logger.debug(f"[CB]....page_number_engine: {bundle_config.page_number_engine}")
+    try:
+        if bundle_config.page_number_engine == "reportlab":
+            paginated_page_count = paginate_pdf_in_memory(
+                bundle_pdf,
+                open_pdfs,
+                expected_length_of_frontmatter,
+                total_number_of_pages,
+                bundle_config.page_num_align,
+                bundle_config.footer_font,
+                bundle_config.page_num_style,
+                bundle_config.footer_prefix
+            )
+        else:
+            paginated_page_count = stamp_page_numbers_in_memory(
+                bundle_pdf,
+                expected_length_of_frontmatter,
+                total_number_of_pages,
+                bundle_config.page_num_align,
+                bundle_config.footer_font,
+                bundle_config.page_num_style,
+                bundle_config.footer_prefix
+            )
+    except Exception as e:
+        bundle_logger.error(f"[CB]..Error during pagination: {e}")
+        raise e
+    bundle_logger.info(f"[CB]..Merged PDF paginated")
+    save_debug_snapshot(bundle_pdf, temp_dir, "TEMP03_paginated_mainpages.pdf", bundle_config.debug_intermediates)
+
+    assert paginated_page_count == main_page_count
+
+
+def paginated_body_fingerprint(merge_sources, length_of_frontmatter, total_number_of_pages, bundle_config):
+    '''
+    A fingerprint of everything that goes into the paginated body (the merged main
+    pages with their page numbers): which files, in what order, and the footer settings.
+    Titles, dates and sections only change the frontmatter, so they aren't part of it,
+    except in so far as they change the length of the TOC (length_of_frontmatter).
+    Returns None if a source has no hash, in which case the body can't be reused.
+    '''
+    if any(sha256 is None for _, _, sha256, _ in merge_sources):
+        return None
+    fingerprint = {
+        "sources": [sha256 for _, _, sha256, _ in merge_sources],
+        "length_of_frontmatter": length_of_frontmatter,
+        "total_number_of_pages": total_number_of_pages,
+        "page_num_align": bundle_config.page_num_align,
+        "footer_font": bundle_config.footer_font,
+        "page_num_style": bundle_config.page_num_style,
+        "footer_prefix": bundle_config.footer_prefix,
+        "page_number_engine": bundle_config.page_number_engine,
+        # the sources' hashes are of the originals, so what was done to their images counts too:
+        "downsample_images": bundle_config.downsample_images and [
+            bundle_config.image_target_dpi, bundle_config.image_jpeg_quality, bundle_config.image_greyscale,
+            bundle_config.size_budget_bytes],
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def emit_bundle_metrics(bundle_metrics, bundle_config):
+    '''
+    Log the bundle's metrics record (see instrumentation.py) as one JSON line,
+    and hand it to bundle_config.metrics_callback if there is one.
+    '''
+    record = bundle_metrics.to_dict()
+    bundle_logger.info(f"[METRICS]{json.dumps(record)}")
+    if bundle_config.metrics_callback:
+        try:
+            bundle_config.metrics_callback(record)
+        except Exception as e:
+            bundle_logger.error(f"[CB]..Metrics callback failed: {e}")
+    return record
+
+
+def render_dummy_toc_length(toc_entries, temp_dir, bundle_config):
+    '''
+    Render a dummy TOC (placeholder page numbers) and return how many pages it takes.
+    It is only written to disk (TEMP02) in debug mode.
+    '''
+    bundle_logger.debug(f"[CB]Creating dummy TOC PDF to find length of frontmatter")
+    if bundle_config.debug_intermediates:
+        dummy_toc_pdf_path = os.path.join(temp_dir, "TEMP02_dummy_toc.pdf")
+    else:
+        dummy_toc_pdf_path = io.BytesIO()
+    try:
+        create_toc_pdf_reportlab(  # DUMMY TOC)
+            toc_entries,
+            bundle_config.case_details,
+            dummy_toc_pdf_path,
+            bundle_config.confidential_bool,
+            bundle_config.date_setting,
+            bundle_config.index_font,
+            True,  # and also, below, make sure the page num align settings etc which it expects are passed:
+            0,
+            0,
+            bundle_config.page_num_align,
+            bundle_config.footer_font,
+            bundle_config.page_num_style,
+            bundle_config.footer_prefix,
+            999
+        )
+    except Exception as e:
+        bundle_logger.error(f"[CB]Error during first pass TOC creation: {e}")
+        raise e
+    if isinstance(dummy_toc_pdf_path, io.BytesIO):
+        dummy_toc_pdf_path.seek(0)
+    else:
+        bundle_logger.info(f"[CB]dummy TOC PDF created at {dummy_toc_pdf_path}")
+    # find length of dummy TOC:
+    with Pdf.open(dummy_toc_pdf_path) as dummytocpdf:
+        return len(dummytocpdf.pages)
+
+
+def render_final_toc(toc_entries, toc_file_path, expected_length_of_frontmatter, length_of_coversheet, main_page_count,
+                     bundle_config):
+    '''
+    Render the real TOC, with page numbers offset by expected_length_of_frontmatter.
+    Returns the row anchors for hyperlinking.
+    '''
+    bundle_logger.debug(f"[CB]Calling create_toc_pdf_reportlab [CT] - final version -  with arguments:")
+    if bundle_logger.isEnabledFor(logging.DEBUG):
+        bundle_logger.debug(f"[CB]....toc_entries: {toc_entries}")
+    bundle_logger.debug(f"[CB]....casedetails: {bundle_config.case_details}")
+    bundle_logger.debug(f"[CB]....toc_file_path: {toc_file_path}")
+    bundle_logger.debug(f"[CB]....confidential: {bundle_config.confidential_bool}")
+    bundle_logger.debug(f"[CB]....date_setting: {bundle_config.date_setting}")
+    bundle_logger.debug(f"[CB]....index_font: {bundle_config.index_font}")
+    bundle_logger.debug(f"[CB]....dummy: False")
+    bundle_logger.debug(f"[CB]....length_of_frontmatter: {expected_length_of_frontmatter}")
+    return create_toc_pdf_reportlab(  # FINAL TOC)
+        # create_toc_pdf_tex( #old function now replaced
+        toc_entries,
+        bundle_config.case_details,
+        toc_file_path,
+        bundle_config.confidential_bool,
+        bundle_config.date_setting,
+        bundle_config.index_font,
+        False,
+        expected_length_of_frontmatter,
+        length_of_coversheet,
+        bundle_config.page_num_align,
+        bundle_config.footer_font,
+        bundle_config.page_num_style,
+        bundle_config.footer_prefix,
+        main_page_count,
+        bundle_config.roman_for_preface
+    )
+
+
+def create_bundle(input_files, output_file, coversheet, index_file, bundle_config):
     '''
     This is the main function for creating a bundle, called by the frontend.
     It takes the frontend data and faffs about with it for a while
     to output the bundle.
+    Everything about this particular bundle is either in bundle_config or
+    local to this call, and bundle_config isn't modified, so several bundles
+    can be made at once on different threads.
     '''
     # development setting:
     BUNTOOL_VERSION = "2025-01-24"
 
     # various initial file and data handling:
-    load_bundle_config(bundle_config_data)  # make this data globally available
     temp_dir = bundle_config.temp_dir
     if not temp_dir:
         temp_dir = os.path.join("/tmp", "tempfiles", bundle_config.session_id)
     os.makedirs(temp_dir, exist_ok=True)
+    # the finished bundle and zip go straight to output_dir, so they needn't be copied or moved afterwards:
+    output_dir = bundle_config.output_dir if bundle_config.output_dir else temp_dir
+    os.makedirs(output_dir, exist_ok=True)
     output_file = secure_filename(output_file)
-    tmp_output_file = os.path.join(temp_dir, output_file)
+    tmp_output_file = os.path.join(output_dir, output_file)
     coversheet_path = os.path.join(temp_dir, coversheet) if coversheet else None
     list_of_temp_files = []
+    open_pdfs = []  # source PDFs which the in-memory bundle borrows pages from
+    skipped_files = []  # index entries which could not be merged
+    bundle_pdf = None
+    toc_file_path = None
+    docx_output_path = None
+    bundle_metrics = BundleMetrics(bundle_config.session_id)
+    bundle_saved = False
 
     # set up logging using configure_logger function
-    bundle_logger = configure_logger(bundle_config.session_id)
+    session_log = configure_logger(bundle_config.session_id, bundle_config.logs_dir)
     bundle_logger.info(f"[CB]THIS IS BUNTOOL VERSION {BUNTOOL_VERSION}")
     bundle_logger.info(f"[CB]Temp directory created at {temp_dir}.")
     bundle_logger.info(f"*****New session: {bundle_config.session_id} called create_bundle*****")
     bundle_logger.info(f"{bundle_config.session_id} has the USER AGENT: {bundle_config.user_agent}")
     bundle_logger.info(f"Bundle creation called with {len(input_files)} input files and output file {output_file}")
-    bundle_logger.debug(f"[CB]create_bundle received the following arguments:")
-    bundle_logger.debug(f"[CB]....input_files: {input_files}")
-    bundle_logger.debug(f"[CB]....output_file: {output_file}")
-    bundle_logger.debug(f"[CB]....coversheet: {coversheet}")
-    bundle_logger.debug(f"[CB]....index_file: {index_file}")
-    bundle_logger.debug(f"[CB]....bundle_config: {bundle_config.__dict__}")
+    if bundle_logger.isEnabledFor(logging.DEBUG):
+        bundle_logger.debug(f"[CB]create_bundle received the following arguments:")
+        bundle_logger.debug(f"[CB]....input_files: {input_files}")
+        bundle_logger.debug(f"[CB]....output_file: {output_file}")
+        bundle_logger.debug(f"[CB]....coversheet: {coversheet}")
+        bundle_logger.debug(f"[CB]....index_file: {index_file}")
+        bundle_logger.debug(f"[CB]....bundle_config: {bundle_config.__dict__}")
 
     # of those files specified in the arguments, add to temp list:
     list_of_temp_files.append(coversheet_path) if coversheet_path else None
@@ -1706,28 +2761,54 @@ def create_bundle(input_files, output_file, coversheet, index_file, bundle_confi
 
         if index_file:  # this is a file handler. The main way to pass an index.
             bundle_logger.debug(f"[CB]Calling load_index_data [LI] with index_file: {index_file}")
-            index_data = load_index_data(index_file)
+            index_data = load_index_data(index_file, bundle_config.date_setting)
         else:
             index_data = None
             bundle_logger.info(f"[CB]No index data provided.")
 
-        # Merge PDFs using provided unique filenames
-        merged_file = os.path.join(temp_dir, "TEMP01_mainpages.pdf")
-        bundle_logger.debug(f"[CB]Calling merge_pdfs_create_toc_entries [MP] with arguments:")
-        bundle_logger.debug(f"[CB]....input_files: {input_files}")
-        bundle_logger.debug(f"[CB]....merged_file: {merged_file}")
-        bundle_logger.debug(f"[CB]....index_data: {index_data}")
+        # Preflight: open each input once (in parallel) to find its page count, sizes, date etc.
+        # Later steps read from these records rather than opening the files again.
+        report_progress(bundle_config, "preflight", bundle_metrics)
+        bundle_logger.debug(f"[CB]Calling preflight_input_files [PF] with {len(input_files)} input files")
+        preflight_records = preflight_input_files(input_files, bundle_config.preflight_workers,
+                                                  bundle_config.input_file_hashes, bundle_config.pdf_cache)
+
+        # Downsample oversized scans, if asked to. The merge then uses the downsampled copies
+        # (through each record's normalized_path); the originals are what go in the zip.
+        if bundle_config.downsample_images:
+            report_progress(bundle_config, "downsample", bundle_metrics)
+            bundle_logger.debug(f"[CB]Calling downsample_input_files [DS]")
+            downsample_dir = os.path.join(temp_dir, "downsampled")
+            downsample_summary = downsample_input_files(preflight_records, downsample_dir,
+                                                        bundle_config.image_target_dpi,
+                                                        bundle_config.image_jpeg_quality,
+                                                        bundle_config.image_greyscale,
+                                                        bundle_config.size_budget_bytes,
+                                                        bundle_config.preflight_workers)
+            bundle_metrics.count(**downsample_summary)
+            list_of_temp_files.extend(record.normalized_path for record in preflight_records.values()
+                                      if record.normalized_path and record.normalized_path.startswith(downsample_dir))
+
+        # Plan the merge using provided unique filenames. The page counts come from preflight,
+        # so the TOC can be worked out without merging anything yet. The merge itself is
+        # done just before pagination, and only if there's no paginated body to reuse.
+        report_progress(bundle_config, "plan", bundle_metrics)
+        if bundle_logger.isEnabledFor(logging.DEBUG):
+            bundle_logger.debug(f"[CB]Calling plan_merge [MP] with arguments:")
+            bundle_logger.debug(f"[CB]....input_files: {input_files}")
+            bundle_logger.debug(f"[CB]....index_data: {index_data}")
         try:
-            toc_entries = merge_pdfs_create_toc_entries(input_files, merged_file, index_data)
+            toc_entries, merge_sources = plan_merge(input_files, index_data, skipped_files, preflight_records)
         except Exception as e:
-            bundle_logger.error(f"[CB]Error while merging pdf files: {e}")
+            bundle_logger.error(f"[CB]Error while planning the merge: {e}")
             raise e
-        if not os.path.exists(merged_file):
-            bundle_logger.info(f"[CB]Merging file unsuccessful: cannot locate expected ouput {merged_file}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]Merged PDF created at {merged_file}")
-            list_of_temp_files.append(merged_file)
+        # get number of pages in merged pdf:
+        main_page_count = sum(number_of_pages for _, number_of_pages, _, _ in merge_sources)  # main page count for x of y pagination if needed
+        bundle_logger.info(f"[CB]Planned merge of {len(merge_sources)} file(s), {main_page_count} pages")
+        bundle_metrics.count(input_files=len(input_files), merged_files=len(merge_sources),
+                             skipped_files=len(skipped_files), main_pages=main_page_count)
+        if skipped_files:
+            bundle_logger.info(f"[CB]..{len(skipped_files)} file(s) in the index were not merged: {skipped_files}")
 
         # list out settings in a human-readable way for remote user support.
         bundle_logger.info("=============================================================================")
@@ -1741,7 +2822,7 @@ def create_bundle(input_files, output_file, coversheet, index_file, bundle_confi
         for idx, file in enumerate(input_files):
             bundle_logger.info(f"..File {idx + 1}: Filename \"{file}\"")
             bundle_logger.info(f".... had index data: {file in index_data}")
-            bundle_logger.info(f".... had {len(Pdf.open(file).pages)} page(s).")
+            bundle_logger.info(f".... had {preflight_records[file].page_count} page(s).")
         bundle_logger.info("STEP THREE:")
         bundle_logger.info("..Index Options:")
         bundle_logger.info(f"....Index font: {bundle_config.index_font}")
@@ -1763,153 +2844,135 @@ def create_bundle(input_files, output_file, coversheet, index_file, bundle_confi
         bundle_logger.info("END RECORD OF USER SETTINGS")
         bundle_logger.info("=================================================================================")
 
-        # get number of pages in merged pdf:
-        with Pdf.open(merged_file) as mergedfile:
-            main_page_count = len(mergedfile.pages)
-        bundle_config.main_page_count = main_page_count  # main page count for x of y pagination if needed
-
         # Find length of frontmatter to allow for pagination from page 1 (no roman numbering)
         if coversheet and os.path.exists(coversheet_path):
-            with Pdf.open(coversheet_path) as coversheet_pdf:
-                length_of_coversheet = len(coversheet_pdf.pages)
+            coversheet_pdf = Pdf.open(coversheet_path)
+            open_pdfs.append(coversheet_pdf)
+            length_of_coversheet = len(coversheet_pdf.pages)
         else:
+            coversheet_pdf = None
             length_of_coversheet = 0
 
-        bundle_config.expected_length_of_frontmatter = length_of_coversheet  # global. This allows the toc to account for what comes before it.
-
-        # First pass to create a dummy TOC to find the length of the frontmatter:
+        report_progress(bundle_config, "toc_length", bundle_metrics)
+        # Work out how long the TOC will be, so the length of the frontmatter is known
+        # before the main pages are paginated. The layout is predicted from the index
+        # table where possible; otherwise a dummy TOC is rendered to measure it.
         if not bundle_config.roman_for_preface:
-            bundle_logger.debug(f"[CB]Creating dummy TOC PDF to find length of frontmatter")
-            try:
-                dummy_toc_pdf_path = os.path.join(temp_dir, "TEMP02_dummy_toc.pdf")
-                create_toc_pdf_reportlab(  # DUMMY TOC)
-                    # create_toc_pdf_tex( #DUMMY TOC
+            length_of_toc = None
+            if bundle_config.predict_toc_length:
+                length_of_toc = create_toc_pdf_reportlab(  # PREDICTED TOC
                     toc_entries,
                     bundle_config.case_details,
-                    dummy_toc_pdf_path,
+                    None,
                     bundle_config.confidential_bool,
                     bundle_config.date_setting,
                     bundle_config.index_font,
-                    True,  # and also, below, make sure the page num align settings etc which it expects are passed:
+                    True,
                     0,
                     0,
                     bundle_config.page_num_align,
                     bundle_config.footer_font,
                     bundle_config.page_num_style,
                     bundle_config.footer_prefix,
-                    999
+                    999,
+                    predict_only=True
                 )
-            except Exception as e:
-                bundle_logger.error(f"[CB]Error during first pass TOC creation: {e}")
-                raise e
-            if not os.path.exists(dummy_toc_pdf_path):
-                bundle_logger.error(
-                    f"[CB]First pass TOC file unsuccessful: cannot locate expected ouput {dummy_toc_pdf_path}.")
-                return
-            else:
-                bundle_logger.info(f"[CB]dummy TOC PDF created at {dummy_toc_pdf_path}")
-                list_of_temp_files.append(dummy_toc_pdf_path)
-                # also append the various latex outputs: TEMP02_dummy_toc.out, .aux (keep only the .log):
-                list_of_temp_files.append(os.path.join(temp_dir, "TEMP02_dummy_toc.out"))
-                list_of_temp_files.append(os.path.join(temp_dir, "TEMP02_dummy_toc.aux"))
-                # also the dummy toc tex file:
-                list_of_temp_files.append(os.path.join(temp_dir, "dummytoc.tex"))
-                # find length of dummy TOC:
-                with Pdf.open(dummy_toc_pdf_path) as dummytocpdf:
-                    length_of_dummy_toc = len(dummytocpdf.pages)
-                    expected_length_of_frontmatter = length_of_coversheet + length_of_dummy_toc
+                bundle_logger.debug(f"[CB]Predicted length of TOC: {length_of_toc}")
+            if length_of_toc is None:
+                report_progress(bundle_config, "dummy_toc", bundle_metrics)
+                length_of_toc = render_dummy_toc_length(toc_entries, temp_dir, bundle_config)
+            expected_length_of_frontmatter = length_of_coversheet + length_of_toc
         else:
             expected_length_of_frontmatter = length_of_coversheet
 
-        bundle_config.total_number_of_pages = bundle_config.main_page_count + expected_length_of_frontmatter  # using the actual frontmatter length for page x of y situations
+        total_number_of_pages = main_page_count + expected_length_of_frontmatter  # using the actual frontmatter length for page x of y situations
 
-        # Setting the global parameter expected_length_of_frontmatter for pagination here
-        # means that it is added when the main pdf is paginated.
-        # Later, when making the toc, it is reset to just the length of coversheet.
-        bundle_config.expected_length_of_frontmatter = expected_length_of_frontmatter  # global
-        bundle_logger.debug(f"[CB]Expected length of frontmatter: {expected_length_of_frontmatter}")
-
-        # Next step: paginate the merged main files of the PDF (the main content)
-        merged_paginated_no_toc = os.path.join(temp_dir, "TEMP03_paginated_mainpages.pdf")
-        bundle_logger.debug(f"[CB]Calling pdf_paginator_reportlab [PPRL] with arguments:")
-        bundle_logger.debug(f"[CB]....merged_file: {merged_file}")
-        bundle_logger.debug(f"[CB]....merged_paginated_no_toc: {merged_paginated_no_toc}")
-        bundle_logger.debug(f"[CB]....page_num_alignment: {bundle_config.page_num_align}")
-        bundle_logger.debug(f"[CB]....page_num_font: {bundle_config.footer_font}")
-        bundle_logger.debug(f"[CB]....page_numbering_style: {bundle_config.page_num_style}")
-        bundle_logger.debug(f"[CB]....footer_prefix: {bundle_config.footer_prefix}")
-        try:
-            paginaged_page_count = pdf_paginator_reportlab(
-                # main_page_count = pdf_paginator_tex(
-                merged_file,
-                merged_paginated_no_toc,
-                bundle_config.expected_length_of_frontmatter,
-                bundle_config.page_num_align,
-                bundle_config.footer_font,
-                bundle_config.page_num_style,
-                bundle_config.footer_prefix,
-            )
-        except Exception as e:
-            bundle_logger.error(f"[CB]..Error during pdf_paginator_reportlab: {e}")
-        if not os.path.exists(merged_paginated_no_toc):
-            bundle_logger.error(
-                f"[CB]..Paginating file unsuccessful: cannot locate expected ouput {merged_paginated_no_toc}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]..Merged PDF paginated at {merged_paginated_no_toc}")
-            list_of_temp_files.append(merged_paginated_no_toc)
-            # also pageNumbers.aux   pageNumbers.pdf  pageNumbers.tex (keep only the .log):
-            list_of_temp_files.append(os.path.join(temp_dir, "pageNumbers.aux"))
-            list_of_temp_files.append(os.path.join(temp_dir, "pageNumbers.pdf"))
-            list_of_temp_files.append(os.path.join(temp_dir, "pageNumbers.tex"))
-
-        assert paginaged_page_count == bundle_config.main_page_count
-
-        bundle_config.expected_length_of_frontmatter = length_of_coversheet  # janky reset for TOC
-
-        # Now, create TOC PDF For real:
+        # Now, create TOC PDF For real. The TOC's own footers count from the
+        # end of the coversheet (see create_toc_pdf_reportlab).
+        report_progress(bundle_config, "toc", bundle_metrics)
         toc_file_path = os.path.join(temp_dir, "index.pdf")
-        bundle_logger.debug(f"[CB]Calling create_toc_pdf_reportlab [CT] - final version -  with arguments:")
-        bundle_logger.debug(f"[CB]....toc_entries: {toc_entries}")
-        bundle_logger.debug(f"[CB]....casedetails: {bundle_config.case_details}")
-        bundle_logger.debug(f"[CB]....toc_file_path: {toc_file_path}")
-        bundle_logger.debug(f"[CB]....confidential: {bundle_config.confidential_bool}")
-        bundle_logger.debug(f"[CB]....date_setting: {bundle_config.date_setting}")
-        bundle_logger.debug(f"[CB]....index_font: {bundle_config.index_font}")
-        bundle_logger.debug(f"[CB]....dummy: False")
-        bundle_logger.debug(f"[CB]....length_of_frontmatter: {expected_length_of_frontmatter}")
-        create_toc_pdf_reportlab(  # FINAL TOC)
-            # create_toc_pdf_tex( #old function now replaced
-            toc_entries,
-            bundle_config.case_details,
-            toc_file_path,
-            bundle_config.confidential_bool,
-            bundle_config.date_setting,
-            bundle_config.index_font,
-            False,
-            expected_length_of_frontmatter,
-            length_of_coversheet,
-            bundle_config.page_num_align,
-            bundle_config.footer_font,
-            bundle_config.page_num_style,
-            bundle_config.footer_prefix,
-            main_page_count,
-            bundle_config.roman_for_preface
-        )
+        toc_anchors = render_final_toc(toc_entries, toc_file_path, expected_length_of_frontmatter, length_of_coversheet, main_page_count, bundle_config)
         if not os.path.exists(toc_file_path):
             bundle_logger.error(f"[CB]..Creating TOC file unsuccessful: cannot locate expected ouput {toc_file_path}.")
             return
         else:
             bundle_logger.info(f"[CB]..TOC PDF created at {os.path.basename(toc_file_path)}")
             list_of_temp_files.append(toc_file_path)
-            # also append the various latex outputs: TEMP02_dummy_toc.out, .log, .aux:
-            list_of_temp_files.append(os.path.join(temp_dir, "index.out"))
-            list_of_temp_files.append(os.path.join(temp_dir, "index.log"))
-            list_of_temp_files.append(os.path.join(temp_dir, "index.aux"))
-            # also the toc tex file:
-            list_of_temp_files.append(os.path.join(temp_dir, "toc.tex"))
 
+        if not bundle_config.roman_for_preface:
+            with Pdf.open(toc_file_path) as check_toc_pdf:
+                actual_length_of_toc = len(check_toc_pdf.pages)
+            if length_of_coversheet + actual_length_of_toc != expected_length_of_frontmatter:
+                # The prediction was wrong: go back to the two-pass approach.
+                bundle_logger.warning(
+                    f"[CB]..TOC is {actual_length_of_toc} pages, expected {expected_length_of_frontmatter - length_of_coversheet}. Falling back to a dummy TOC pass.")
+                report_progress(bundle_config, "dummy_toc", bundle_metrics)
+                expected_length_of_frontmatter = length_of_coversheet + render_dummy_toc_length(toc_entries, temp_dir, bundle_config)
+                report_progress(bundle_config, "toc", bundle_metrics)
+                total_number_of_pages = main_page_count + expected_length_of_frontmatter
+                toc_anchors = render_final_toc(toc_entries, toc_file_path, expected_length_of_frontmatter, length_of_coversheet, main_page_count, bundle_config)
+
+        # expected_length_of_frontmatter is added to the page numbers when the main pdf is paginated.
+        bundle_logger.debug(f"[CB]Expected length of frontmatter: {expected_length_of_frontmatter}")
+
+        # Next step: merge and paginate the main files of the PDF (the main content).
+        # From here on the bundle is one pikepdf Pdf object, carried through every
+        # stage and saved once at the end. Source files stay open (in open_pdfs) until then,
+        # unless memory_bounded_merge has the pages merged into a body file on disk.
+        # If exactly this paginated body has been made before (see paginated_body_fingerprint),
+        # it's taken from the PDF cache instead.
+        report_progress(bundle_config, "merge", bundle_metrics)
+        body_fingerprint = None
+        cached_body_path = None
+        if bundle_config.pdf_cache and bundle_config.reuse_paginated_body:
+            body_fingerprint = paginated_body_fingerprint(merge_sources, expected_length_of_frontmatter,
+                                                          total_number_of_pages, bundle_config)
+            if body_fingerprint:
+                cached_body_path = bundle_config.pdf_cache.get_body(body_fingerprint)
+        if cached_body_path:
+            try:
+                bundle_pdf = Pdf.open(cached_body_path)
+            except (OSError, PdfError) as e:
+                # evicted (or being evicted) by another bundle since get_body found it: merge afresh
+                bundle_logger.warning(f"[CB]..Could not open cached paginated body {body_fingerprint} ({e}). Merging instead.")
+                cached_body_path = None
+        bundle_metrics.count(paginated_body_reused=bool(cached_body_path))
+        if cached_body_path:
+            bundle_logger.info(f"[CB]..Reusing paginated body {body_fingerprint} from the PDF cache")
+            if len(bundle_pdf.pages) != main_page_count:
+                raise ValueError(f"Cached paginated body has {len(bundle_pdf.pages)} pages, expected {main_page_count}")
+        else:
+            try:
+                if bundle_config.memory_bounded_merge:
+                    bundle_pdf, merged_body_path = merge_planned_sources_bounded(
+                        merge_sources, os.path.join(temp_dir, "merge"), bundle_config.merge_rss_ceiling_mb)
+                    if merged_body_path:
+                        list_of_temp_files.append(merged_body_path)
+                else:
+                    bundle_pdf = Pdf.new()
+                    merge_planned_sources(bundle_pdf, merge_sources, open_pdfs)
+            except Exception as e:
+                bundle_logger.error(f"[CB]Error while merging pdf files: {e}")
+                raise e
+            bundle_logger.info(f"[CB]Merged {len(bundle_pdf.pages)} pages in memory")
+            save_debug_snapshot(bundle_pdf, temp_dir, "TEMP01_mainpages.pdf", bundle_config.debug_intermediates)
+            report_progress(bundle_config, "paginate", bundle_metrics)
+            paginate_main_pages(bundle_pdf, open_pdfs, expected_length_of_frontmatter, total_number_of_pages,
+                                main_page_count, temp_dir, bundle_config)
+            if body_fingerprint:
+                try:
+                    merged_bytes = sum(os.path.getsize(original_path or source_path)
+                                       for source_path, _, _, original_path in merge_sources)
+                    if bundle_config.pdf_cache.put_body(body_fingerprint, bundle_pdf, merged_bytes):
+                        bundle_logger.debug(f"[CB]..Saved paginated body {body_fingerprint} to the PDF cache")
+                    else:
+                        bundle_logger.debug(f"[CB]..Paginated body is too big for the PDF cache")
+                except Exception as e:
+                    bundle_logger.warning(f"[CB]..Could not save paginated body to the PDF cache: {e}")
+
+        report_progress(bundle_config, "docx", bundle_metrics)
         try:
+            from makedocxindex import create_toc_docx
             docx_output_path = os.path.join(temp_dir, "docx_output.docx")
             create_toc_docx(toc_entries,
                             bundle_config.case_details,
@@ -1921,204 +2984,180 @@ def create_bundle(input_files, output_file, coversheet, index_file, bundle_confi
         except Exception as e:
             bundle_logger.error(f"[CB]..Error during create_toc_docx: {e}")
 
-        # Handle frontmatter: merge coversheet, else just use toc
-        frontmatter = os.path.join(temp_dir, "TEMP00-coversheet-plus-toc.pdf")
-        if coversheet:
-            if os.path.exists(coversheet_path):
-                frontmatterfiles = [coversheet_path, toc_file_path]
-                bundle_logger.debug(f"[CB]Coversheet specified. Calling merge_frontmatter [MF] with arguments:")
-                bundle_logger.debug(f"[CB]....frontmatterfiles: {frontmatterfiles}")
-                bundle_logger.debug(f"[CB]....frontmatter: {frontmatter}")
-                frontmatter_path = merge_frontmatter(frontmatterfiles, frontmatter)
-                if not os.path.exists(frontmatter_path):
-                    bundle_logger.error(
-                        f"[CB]..Merging frontmatter unsuccessful: cannot locate expected ouput {frontmatter_path}.")
-                    return
-                else:
-                    bundle_logger.info(f"[CB]..Frontmatter created at {os.path.basename(frontmatter_path)}")
-            else:
-                bundle_logger.error(f"[CB]..Coversheet specified but not found at {coversheet_path}.")
-                return
+        # Handle frontmatter: coversheet (if any) then toc, inserted in front of the main pages
+        report_progress(bundle_config, "frontmatter", bundle_metrics)
+        if coversheet and not coversheet_pdf:
+            bundle_logger.error(f"[CB]..Coversheet specified but not found at {coversheet_path}.")
+            return
+        toc_pdf = Pdf.open(toc_file_path)
+        open_pdfs.append(toc_pdf)
+        frontmatter_pages = list(coversheet_pdf.pages) if coversheet_pdf else []
+        frontmatter_pages.extend(toc_pdf.pages)
+        length_of_frontmatter = len(frontmatter_pages)
+        if coversheet_pdf:
+            bundle_logger.info(f"[CB]..Frontmatter is coversheet plus TOC")
         else:
-            frontmatter_path = toc_file_path
             bundle_logger.info(f"[CB]No coversheet specified. TOC is the only frontmatter.")
 
         # check the frontmatter now generated matches the length that was expected from the dummy:
-
-        with Pdf.open(frontmatter_path) as frontmatter_pdf:
-            length_of_frontmatter = len(frontmatter_pdf.pages)
-            bundle_logger.debug(f"[CB]Frontmatter length is {length_of_frontmatter} pages.")
-            if not bundle_config.roman_for_preface:
-                if length_of_frontmatter != expected_length_of_frontmatter:
-                    bundle_logger.error(
-                        f"[CB]..Frontmatter length mismatch: expected {length_of_dummy_toc} pages, got {length_of_frontmatter}.")
-                    return
-                else:
-                    bundle_logger.info(f"[CB]..Frontmatter length matches expected {length_of_dummy_toc} pages.")
+        bundle_logger.debug(f"[CB]Frontmatter length is {length_of_frontmatter} pages.")
+        if not bundle_config.roman_for_preface:
+            if length_of_frontmatter != expected_length_of_frontmatter:
+                bundle_logger.error(
+                    f"[CB]..Frontmatter length mismatch: expected {expected_length_of_frontmatter} pages, got {length_of_frontmatter}.")
+                return
+            else:
+                bundle_logger.info(f"[CB]..Frontmatter length matches expected {expected_length_of_frontmatter} pages.")
 
         # Merge frontmatter with main docs (previously merged) PDFs
-        merged_file_with_frontmatter = os.path.join(temp_dir, "TEMP04_all_pages.pdf")
-        with Pdf.open(frontmatter_path) as frontmatter_pdf, Pdf.open(merged_paginated_no_toc) as main_pdf:
-            merged_pdf = Pdf.new()
-            merged_pdf.pages.extend(frontmatter_pdf.pages)
-            merged_pdf.pages.extend(main_pdf.pages)
-            merged_pdf.save(merged_file_with_frontmatter)
-        if not os.path.exists(merged_file_with_frontmatter):
-            bundle_logger.error(
-                f"[CB]..Merging frontmatter with main docs unsuccessful: cannot locate expected ouput {merged_file_with_frontmatter}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]..Frontmatter merged with main docs at {merged_file_with_frontmatter}")
-            list_of_temp_files.append(merged_file_with_frontmatter)
+        bundle_pdf.pages[0:0] = frontmatter_pages
+        bundle_logger.info(f"[CB]..Frontmatter merged with main docs")
+        save_debug_snapshot(bundle_pdf, temp_dir, "TEMP04_all_pages.pdf", bundle_config.debug_intermediates)
 
         # add clickable hyperlinks to TOC page
+        report_progress(bundle_config, "hyperlinks", bundle_metrics)
         bundle_logger.debug(f"[[CB]Beginning hyperlinking process")
-
-        # find length of coversheet and frontmatter to pass to hyperlinking function:
-        hyperlinked_file = os.path.join(temp_dir, "TEMP05-hyperlinked.pdf")
-        bundle_logger.debug(f"[CB]..Calling add_hyperlinks [AH] with arguments:")
-        bundle_logger.debug(f"[CB]......merged_file_with_frontmatter: {merged_file_with_frontmatter}")
-        bundle_logger.debug(f"[CB]......hyperlinked_file: {hyperlinked_file}")
+        bundle_logger.debug(f"[CB]..Calling add_hyperlinks_in_memory [AH] with arguments:")
+        bundle_logger.debug(f"[CB]......toc_file_path: {toc_file_path}")
         bundle_logger.debug(f"[CB]......length_of_coversheet: {length_of_coversheet}")
         bundle_logger.debug(f"[CB]......length_of_frontmatter: {length_of_frontmatter}")
-        bundle_logger.debug(f"[CB]......toc_entries: {toc_entries}")
+        if bundle_logger.isEnabledFor(logging.DEBUG):
+            bundle_logger.debug(f"[CB]......toc_entries: {toc_entries}")
         bundle_logger.debug(f"[CB]......date_setting: {bundle_config.date_setting}")
         bundle_logger.debug(f"[CB]......roman_for_preface: {bundle_config.roman_for_preface}")
         try:
-            add_hyperlinks(
-                merged_file_with_frontmatter,
-                hyperlinked_file,
+            add_hyperlinks_in_memory(
+                bundle_pdf,
+                toc_file_path,
                 length_of_coversheet,
                 length_of_frontmatter,
                 toc_entries,
                 bundle_config.date_setting,
-                bundle_config.roman_for_preface
+                bundle_config.roman_for_preface,
+                toc_anchors
             )
         except Exception as e:
             bundle_logger.error(f"[CB]..Error during add_hyperlinks: {e}")
             raise e
-        if not os.path.exists(hyperlinked_file):
-            bundle_logger.error(
-                f"[CB]..Hyperlinking file unsuccessful: cannot locate expected ouput {hyperlinked_file}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]..Hyperlinked PDF created at {hyperlinked_file}")
-            list_of_temp_files.append(hyperlinked_file)
+        bundle_logger.info(f"[CB]..Hyperlinks added")
+        save_debug_snapshot(bundle_pdf, temp_dir, "TEMP05-hyperlinked.pdf", bundle_config.debug_intermediates)
 
         # Add pdf bookmarks (outline items) to the PDF outline:
-        main_bookmarked_file = os.path.join(temp_dir, "TEMP06_main_bookmarks.pdf")
-        bundle_logger.debug(f"[CB]Calling add_bookmarks_to_pdf [AB] with arguments:")
-        bundle_logger.debug(f"[CB]....hyperlinked_file: {hyperlinked_file}")
-        bundle_logger.debug(f"[CB]....main_bookmarked_file: {main_bookmarked_file}")
-        bundle_logger.debug(f"[CB]....toc_entries: {toc_entries}")
+        report_progress(bundle_config, "bookmarks", bundle_metrics)
+        bundle_logger.debug(f"[CB]Calling add_bookmarks_in_memory [AB] with arguments:")
+        if bundle_logger.isEnabledFor(logging.DEBUG):
+            bundle_logger.debug(f"[CB]....toc_entries: {toc_entries}")
         bundle_logger.debug(f"[CB]....length_of_frontmatter: {length_of_frontmatter}")
         try:
-            add_bookmarks_to_pdf(
-                hyperlinked_file,
-                main_bookmarked_file,
-                toc_entries,
-                length_of_frontmatter
-            )
+            add_bookmarks_in_memory(bundle_pdf, toc_entries, length_of_frontmatter, bundle_config.bookmark_setting)
         except Exception as e:
             bundle_logger.error(f"[CB]..Error during add_bookmarks_to_pdf: {e}")
             raise e
-        if not os.path.exists(main_bookmarked_file):
-            bundle_logger.error(
-                f"[CB]..Bookmarking file unsuccessful: cannot locate expected ouput {main_bookmarked_file}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]..Bookmarked PDF created at {main_bookmarked_file}")
-            list_of_temp_files.append(main_bookmarked_file)
+        bundle_logger.info(f"[CB]..Bookmarks added")
+        save_debug_snapshot(bundle_pdf, temp_dir, "TEMP06_main_bookmarks.pdf", bundle_config.debug_intermediates)
 
         # Add pdf bookmark (outline item) for the TOC
-        index_bookmarked_file = os.path.join(temp_dir, "TEMP07_all_bookmarks.pdf")
-        bundle_logger.debug(f"[CB]Calling bookmark_the_index [BI] with arguments:")
-        bundle_logger.debug(f"[CB]....main_bookmarked_file: {main_bookmarked_file}")
-        bundle_logger.debug(f"[CB]....index_bookmarked_file: {index_bookmarked_file}")
-        bundle_logger.debug(f"[CB]....coversheet_path: {coversheet_path}")
+        bundle_logger.debug(f"[CB]Calling bookmark_the_index_in_memory [BI] with length_of_coversheet: {length_of_coversheet}")
         try:
-            bookmark_the_index(
-                main_bookmarked_file,
-                index_bookmarked_file,
-                coversheet_path
-            )
+            bookmark_the_index_in_memory(bundle_pdf, length_of_coversheet)
         except Exception as e:
             bundle_logger.error(f"[CB]..Error during bookmark_the_index: {e}")
             raise e
-        if not os.path.exists(index_bookmarked_file):
-            bundle_logger.error(
-                f"[CB]..Bookmarking index file unsuccessful: cannot locate expected ouput {index_bookmarked_file}.")
-            return
-        else:
-            bundle_logger.info(f"[CB]..Index bookmarked PDF created at {index_bookmarked_file}")
-            list_of_temp_files.append(index_bookmarked_file)
+        bundle_logger.info(f"[CB]..Index bookmarked")
+        save_debug_snapshot(bundle_pdf, temp_dir, "TEMP07_all_bookmarks.pdf", bundle_config.debug_intermediates)
 
         if bundle_config.roman_for_preface:
             # This function changes the page labels so that the frontmatter is
             ##paginated as a roman numbering preface (i, ii etc)
             ##and the main part of the bundle is paginated beginning
             ## at page 1, the first page after the frontmatter.
-            bundle_logger.debug(f"[CB]Calling add_roman_labels [APL] with arguments:")
-            bundle_logger.debug(f"[CB]....index_bookmarked_file: {index_bookmarked_file}")
-            bundle_logger.debug(f"[CB]....frontmatter_path: {frontmatter_path}")
-            bundle_logger.debug(f"[CB]....tmp_output_file: {tmp_output_file}")
+            report_progress(bundle_config, "labels", bundle_metrics)
+            bundle_logger.debug(f"[CB]Calling add_roman_labels_in_memory [APL] with length_of_frontmatter: {length_of_frontmatter}")
             try:
-                add_roman_labels(
-                    index_bookmarked_file,
-                    length_of_frontmatter,
-                    tmp_output_file
-                )
+                add_roman_labels_in_memory(bundle_pdf, length_of_frontmatter)
             except Exception as e:
                 bundle_logger.error(f"[CB]..Error during add_roman_labels: {e}")
                 raise e
-            if not os.path.exists(tmp_output_file):
-                bundle_logger.error(
-                    f"[CB]..Adding page labels unsuccessful: cannot locate expected ouput {tmp_output_file}.")
-                return
-            else:
-                bundle_logger.info(f"[CB]..Page labels added to PDF saved to {tmp_output_file}")
-        else:
-            # if no roman numbering is requested, just copy the file to the final output location:
-            shutil.copyfile(index_bookmarked_file, tmp_output_file)
-
+            bundle_logger.info(f"[CB]..Page labels added to PDF")
+
+        if bundle_config.optimize_output:
+            report_progress(bundle_config, "optimize", bundle_metrics)
+            bundle_logger.debug(f"[CB]Calling optimize_bundle [OPT]")
+            optimize_report = optimize_bundle(bundle_pdf)
+            bundle_metrics.count(**optimize_report)
+
+        # The one and only save of the whole bundle:
+        report_progress(bundle_config, "save", bundle_metrics)
+        # saved under a temporary name and renamed, so the output path never holds half a bundle:
+        partial_output_file = f"{tmp_output_file}.part"
+        if bundle_config.linearize or bundle_config.optimize_output:
+            compress_uncompressed_streams(bundle_pdf)
+        bundle_pdf.save(partial_output_file, **bundle_save_options(bundle_config))
+        os.replace(partial_output_file, tmp_output_file)
+        if not os.path.exists(tmp_output_file):
+            bundle_logger.error(f"[CB]..Saving bundle unsuccessful: cannot locate expected ouput {tmp_output_file}.")
+            return
         bundle_logger.info(f"[CB]Completed bundle creation. output written to: {tmp_output_file}")
+        bundle_saved = True
+        bundle_metrics.count(frontmatter_pages=length_of_frontmatter, total_pages=len(bundle_pdf.pages),
+                             output_bytes=os.path.getsize(tmp_output_file))
 
     except Exception as e:
         bundle_logger.error(f"[CB]Error during create_bundle: {e}")
         raise e
 
     finally:
-        # Create zip file if requested:
+        # Release the source files the in-memory bundle was borrowing pages from:
+        if bundle_pdf is not None:
+            bundle_pdf.close()
+        close_open_pdfs(open_pdfs)
+
+        # Create zip file if requested, then record how the bundle went (see instrumentation.py):
         zip_filepath = None
-        if bundle_config.zip_bool:
-            zip_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            if not bundle_config.case_details[0]:
-                bundletitleforfilename = "Bundle"
-            else:
-                bundletitleforfilename = bundle_config.case_details[0]
-            bundle_logger.debug(f"[CB]Calling create_zip_file:")
-            try:
-                zip_filepath = create_zip_file(
-                    bundletitleforfilename,
-                    bundle_config.case_details[2],
-                    zip_timestamp,
-                    input_files,
-                    index_file,
-                    docx_output_path,
-                    toc_file_path,
-                    coversheet_path,
-                    temp_dir,
-                    tmp_output_file
-                )
-            except Exception as e:
-                bundle_logger.error(f"[CB]..Error during create_zip_file: {e}")
-                raise e
-            if not os.path.exists(zip_filepath):
-                bundle_logger.error(
-                    f"[CB]..Creating zip file unsuccessful: cannot locate expected ouput {zip_filepath}.")
-                return
-            else:
-                bundle_logger.info(f"[CB]..Zip file created at {os.path.basename(zip_filepath)}")
+        try:
+            if bundle_config.zip_bool:
+                report_progress(bundle_config, "zip", bundle_metrics)
+                zip_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+                if not bundle_config.case_details[0]:
+                    bundletitleforfilename = "Bundle"
+                else:
+                    bundletitleforfilename = bundle_config.case_details[0]
+                try:
+                    if bundle_config.zip_mode == "stream":
+                        bundle_logger.debug(f"[CB]Calling create_zip_manifest:")
+                        zip_filepath = create_zip_manifest(input_files, index_file, docx_output_path, toc_file_path,
+                                                           coversheet_path, tmp_output_file)
+                        # the zip is made from these when it's downloaded, so they can't be deleted yet:
+                        zipped_paths = set(path for path, arcname in read_zip_manifest(zip_filepath))
+                        list_of_temp_files = [file for file in list_of_temp_files if file not in zipped_paths]
+                    else:
+                        bundle_logger.debug(f"[CB]Calling create_zip_file:")
+                        zip_filepath = create_zip_file(
+                            bundletitleforfilename,
+                            bundle_config.case_details[2],
+                            zip_timestamp,
+                            input_files,
+                            index_file,
+                            docx_output_path,
+                            toc_file_path,
+                            coversheet_path,
+                            temp_dir,
+                            tmp_output_file
+                        )
+                except Exception as e:
+                    bundle_logger.error(f"[CB]..Error during create_zip_file: {e}")
+                    raise e
+                if not os.path.exists(zip_filepath):
+                    bundle_logger.error(
+                        f"[CB]..Creating zip file unsuccessful: cannot locate expected ouput {zip_filepath}.")
+                    return
+                else:
+                    bundle_logger.info(f"[CB]..Zip file created at {os.path.basename(zip_filepath)}")
+        finally:
+            if zip_filepath and os.path.exists(zip_filepath) and not zip_filepath.endswith(ZIP_MANIFEST_SUFFIX):
+                bundle_metrics.count(zip_bytes=os.path.getsize(zip_filepath))
+            bundle_metrics.finish("ok" if bundle_saved else "failed")
+            emit_bundle_metrics(bundle_metrics, bundle_config)
 
         remaining_files = remove_temporary_files(list_of_temp_files)
         if remaining_files:
@@ -2127,11 +3166,31 @@ def create_bundle(input_files, output_file, coversheet, index_file, bundle_confi
         else:
             bundle_logger.info(f"[CB]..All temporary files deleted successfully.")
         # Remove the handler to prevent duplicate logs
-        remove_session_file_handler()
+        end_session_logging(session_log)
 
     return tmp_output_file, zip_filepath
 
 
+def zip_entries(input_files, csv_path, docx_path, toc_path, coversheet_path, tmp_output_file):
+    '''
+    What goes in the bundle's zip, as (source path, name in the zip) pairs:
+    the input files in an input_files/ subdirectory, and everything else
+    (index, TOCs, coversheet and the bundle itself) at the top level.
+    '''
+    entries = [(file, os.path.join('input_files', os.path.basename(file))) for file in input_files]
+    for path in [csv_path, toc_path, docx_path, coversheet_path, tmp_output_file]:
+        if path:
+            entries.append((path, os.path.basename(path)))
+    return entries
+
+
+def zip_compress_type(path):
+    # PDFs and docx files are compressed already: deflating them again costs time and saves nothing
+    if os.path.splitext(path)[1].lower() in ('.pdf', '.docx'):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
 def create_zip_file(
         bundle_title,
         case_name,
@@ -2155,26 +3214,85 @@ def create_zip_file(
     bundle_logger.debug(f"[CZF]Creating zip file at {int_zip_filepath}")
 
     with zipfile.ZipFile(int_zip_filepath, 'w') as zipf:
-        # Add input files to a subdirectory
-        for file in input_files:
-            zipf.write(file, os.path.join('input_files', os.path.basename(file)))
-        # Add CSV index to the root directory
-        if csv_path:
-            zipf.write(csv_path, os.path.basename(csv_path))
-        # Add TOC to the root directory
-        if toc_path:
-            zipf.write(toc_path, os.path.basename(toc_path))
-        # Add coversheet to the root directory
-        if docx_path:
-            zipf.write(docx_path, os.path.basename(docx_path))
-        if coversheet_path:
-            zipf.write(coversheet_path, os.path.basename(coversheet_path))
-        # Add outputfile (whole bundle) to the root directory
-        if tmp_output_file:
-            zipf.write(tmp_output_file, os.path.basename(tmp_output_file))
+        for source_path, arcname in zip_entries(input_files, csv_path, docx_path, toc_path, coversheet_path,
+                                                tmp_output_file):
+            zipf.write(source_path, arcname, compress_type=zip_compress_type(source_path))
     return int_zip_filepath
 
 
+def create_zip_manifest(input_files, csv_path, docx_path, toc_path, coversheet_path, tmp_output_file):
+    '''
+    For zip_mode "stream": instead of writing the zip, write down what would
+    go in it (see zip_entries), next to where the zip would have been. The zip
+    is made from the manifest by stream_zip when it's downloaded, so the files
+    it lists must be kept until then.
+    Returns the manifest's path.
+    '''
+    zip_filepath = re.sub(r'\.pdf$', '_files.zip', tmp_output_file)
+    manifest_path = zip_filepath + ZIP_MANIFEST_SUFFIX
+    bundle_logger.debug(f"[CZM]Writing zip manifest at {manifest_path}")
+    write_zip_manifest(zip_entries(input_files, csv_path, docx_path, toc_path, coversheet_path, tmp_output_file),
+                       manifest_path)
+    return manifest_path
+
+
+def write_zip_manifest(entries, manifest_path):
+    with open(manifest_path, 'w') as f:
+        json.dump({"entries": [{"path": path, "arcname": arcname} for path, arcname in entries]}, f)
+
+
+def read_zip_manifest(manifest_path):
+    with open(manifest_path) as f:
+        return [(entry["path"], entry["arcname"]) for entry in json.load(f)["entries"]]
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    '''
+    A write-only, unseekable file for zipfile to write into, which stream_zip
+    empties after each chunk. zipfile copes with not being able to seek back by
+    putting each entry's sizes and CRC after its data.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=ZIP_STREAM_CHUNK_SIZE):
+    '''
+    Generate a zip of entries ((source path, name in the zip) pairs, see zip_entries)
+    a chunk at a time, reading each source file as it goes, so the zip is never
+    held in memory or written to disk.
+    '''
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zipf:
+        for source_path, arcname in entries:
+            zip_info = zipfile.ZipInfo.from_file(source_path, arcname)
+            zip_info.compress_type = zip_compress_type(source_path)
+            with open(source_path, 'rb') as source, zipf.open(zip_info, 'w') as destination:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+    yield buffer.drain()  # the rest of the last entry, and the central directory
+
+
 def main():
     '''
     Command line usage. Mainly used for spot-testing during development.
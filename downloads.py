@@ -0,0 +1,128 @@
+'''
+Resumable downloads of finished bundles and zips.
+
+Big bundles are often downloaded over poor connections, and a browser can
+only pick an interrupted download up where it left off if the server
+answers Range requests, and can tell it (with an ETag in If-Range) that
+the file hasn't changed since. send_download serves a file with
+send_file, which handles Range, If-Range and If-None-Match and streams
+the file in chunks (or hands it to the server's file wrapper), never
+holding it in memory. Its ETag is the sha256 of the file's contents.
+
+Hashing a 300 MB bundle isn't free, so each file's ETag is worked out
+once and kept next to it in <file>.etag, with the size and mtime it was
+worked out for (see file_etag). app.py does this as soon as a bundle is
+made, while the file is still in the page cache.
+
+A zip in zip_mode "stream" doesn't exist until it's downloaded (see
+bundle.stream_zip), so it has no bytes to hash up front. Its ETag comes
+from its manifest instead: the name, size and mtime of each file that
+goes into it (see zip_manifest_etag). stream_zip makes the same bytes
+from the same files, so when a streamed download is resumed with a Range
+request, the zip is written out once (materialize_streamed_zip, tagged
+with that same ETag, by one thread however many ask at once) and the
+range is served from the file.
+'''
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from flask import send_file
+
+import bundle as buntool
+from preflight import hash_file
+
+ETAG_SUFFIX = ".etag"
+# zip path -> [lock held while it's written, number of threads waiting on or holding it]
+_materialize_locks = {}
+_materialize_locks_lock = threading.Lock()
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_etag(path, etag):
+    '''
+    Record etag as the ETag of path, as it is now.
+    '''
+    record = dict(_file_signature(path), etag=etag)
+    tmp_path = f"{path}{ETAG_SUFFIX}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path + ETAG_SUFFIX)
+
+
+def file_etag(path):
+    '''
+    The ETag of path: the one recorded in path.etag if the file hasn't changed
+    since, or else the sha256 of its contents (which is then recorded).
+    '''
+    try:
+        with open(path + ETAG_SUFFIX) as f:
+            record = json.load(f)
+        if record.get("etag") and {key: record.get(key) for key in ("size", "mtime_ns")} == _file_signature(path):
+            return record["etag"]
+    except (OSError, ValueError):
+        pass
+    etag = hash_file(path)
+    write_etag(path, etag)
+    return etag
+
+
+def zip_manifest_etag(zip_entries):
+    '''
+    The ETag of the zip stream_zip would make from zip_entries ((source path, name in the zip) pairs):
+    a sha256 of each entry's name, size and mtime, which are what decide the zip's bytes.
+    '''
+    digest = hashlib.sha256()
+    for path, arcname in zip_entries:
+        digest.update(json.dumps([arcname, _file_signature(path)], sort_keys=True).encode())
+    return f"zip-{digest.hexdigest()}"
+
+
+def materialize_streamed_zip(zip_entries, zip_path, etag):
+    '''
+    Write the zip stream_zip makes from zip_entries to zip_path, tagged with etag,
+    so a resumed download can be served from it with ranges. Only one thread writes
+    a given zip: any others asking for it wait, and are given the one it wrote.
+    '''
+    with _materialize_locks_lock:
+        entry = _materialize_locks.setdefault(zip_path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if os.path.exists(zip_path):
+                # written by another request while this one waited
+                return zip_path
+            tmp_path = f"{zip_path}.{uuid.uuid4().hex}.part"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in buntool.stream_zip(zip_entries):
+                        f.write(chunk)
+                # the ETag goes in place first, so the zip is never seen without it
+                # (os.replace keeps the size and mtime it records):
+                write_etag(tmp_path, etag)
+                os.replace(tmp_path + ETAG_SUFFIX, zip_path + ETAG_SUFFIX)
+                os.replace(tmp_path, zip_path)
+            finally:
+                for path in (tmp_path, tmp_path + ETAG_SUFFIX):
+                    if os.path.exists(path):
+                        os.remove(path)
+    finally:
+        with _materialize_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _materialize_locks[zip_path]
+    return zip_path
+
+
+def send_download(path):
+    '''
+    Send path as an attachment, with its ETag and Last-Modified, answering
+    conditional and Range requests (206 for a range, 304 if unchanged).
+    '''
+    return send_file(path, as_attachment=True, conditional=True, etag=file_etag(path))
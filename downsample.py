@@ -0,0 +1,176 @@
+'''
+Image downsampling of input PDFs (BundleConfig.downsample_images).
+
+After preflight, each input's images above a target resolution are resized
+to it and re-encoded as JPEG (greyscale with image_greyscale), and kept only
+if that makes them smaller. An image's resolution is taken as if it filled
+its page (see effective_dpi). Bilevel images (CCITT, JBIG2) and images
+inside form XObjects are left alone.
+
+The downsampled copy goes in the session's temp dir, and the file's
+PreflightRecord.normalized_path points at it, so the merge uses it; the
+original is untouched, and is what goes in the zip. Files are done in a
+pool of processes. With a size budget, nothing is done if the inputs
+already fit; if they don't fit after downsampling to the target, lower
+resolutions (DOWNSAMPLE_DPI_STEPS) are tried in turn.
+'''
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pikepdf import Array, Pdf, PdfImage, Name
+
+bundle_logger = logging.getLogger('bundle_logger')
+
+# resolutions to fall back to, in turn, when a bundle is still over its size budget:
+DOWNSAMPLE_DPI_STEPS = (150, 100, 72)
+# don't bother re-encoding an image for less than this much reduction in scale:
+MIN_DOWNSAMPLE_FACTOR = 0.9
+SKIPPED_IMAGE_FILTERS = ("/CCITTFaxDecode", "/JBIG2Decode")
+
+
+def effective_dpi(image, page):
+    '''
+    The resolution image would have if it filled page, matching the image's long side
+    to the page's long side and short to short (so a landscape scan on a portrait page counts).
+    '''
+    mediabox = page.mediabox
+    page_width_inches = abs(float(mediabox[2]) - float(mediabox[0])) / 72
+    page_height_inches = abs(float(mediabox[3]) - float(mediabox[1])) / 72
+    if not page_width_inches or not page_height_inches:
+        return 0
+    image_sides = sorted((int(image.Width), int(image.Height)))
+    page_sides = sorted((page_width_inches, page_height_inches))
+    return min(image_sides[0] / page_sides[0], image_sides[1] / page_sides[1])
+
+
+def _can_downsample(image):
+    # bilevel and mask images are already compact, and can't be JPEG-encoded without ruining them
+    filters = image.get("/Filter")
+    filters = [str(f) for f in filters] if isinstance(filters, Array) else [str(filters)] if filters else []
+    if any(f in SKIPPED_IMAGE_FILTERS for f in filters):
+        return False
+    if image.get("/ImageMask") or int(image.get("/BitsPerComponent", 8)) == 1 or "/Decode" in image:
+        return False
+    return True
+
+
+def downsample_image(image, scale, jpeg_quality, greyscale):
+    '''
+    Resize the image XObject by scale and re-encode it as JPEG, in place, if that makes it smaller.
+    Returns the bytes saved (0 if it was left as it was).
+    '''
+    from PIL import Image
+
+    original_size = len(image.read_raw_bytes())
+    pil_image = PdfImage(image).as_pil_image()
+    mode = "L" if greyscale or pil_image.mode in ("1", "L", "LA") else "RGB"
+    new_size = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+    resized = pil_image.convert(mode).resize(new_size, Image.LANCZOS)
+    jpeg = io.BytesIO()
+    resized.save(jpeg, "JPEG", quality=jpeg_quality)
+    jpeg_bytes = jpeg.getvalue()
+    if len(jpeg_bytes) >= original_size:
+        return 0
+    image.write(jpeg_bytes, filter=Name.DCTDecode)
+    image.Width, image.Height = new_size
+    image.ColorSpace = Name.DeviceGray if mode == "L" else Name.DeviceRGB
+    image.BitsPerComponent = 8
+    for key in ("/DecodeParms", "/Intent"):
+        if key in image:
+            del image[key]
+    return original_size - len(jpeg_bytes)
+
+
+def downsample_pdf(source_path, output_path, target_dpi, jpeg_quality=75, greyscale=False):
+    '''
+    Write a copy of source_path to output_path with its oversized images downsampled
+    to target_dpi. Runs in a worker process, so it returns a plain dict:
+    images (how many were downsampled), bytes_before and bytes_after (file sizes), and
+    output_path (None if no image was changed, in which case nothing was written).
+    '''
+    result = {"path": source_path, "output_path": None, "images": 0, "error": None,
+              "bytes_before": os.path.getsize(source_path)}
+    result["bytes_after"] = result["bytes_before"]
+    try:
+        with Pdf.open(source_path) as pdf:
+            done = set()  # images used on more than one page are only downsampled once
+            for page in pdf.pages:
+                for name, image in page.images.items():
+                    if image.objgen in done or not _can_downsample(image):
+                        continue
+                    done.add(image.objgen)
+                    dpi = effective_dpi(image, page)
+                    scale = target_dpi / dpi if dpi else 1
+                    if scale > MIN_DOWNSAMPLE_FACTOR:
+                        continue
+                    try:
+                        if downsample_image(image, scale, jpeg_quality, greyscale):
+                            result["images"] += 1
+                    except Exception as e:
+                        # an image PIL can't read (unusual colour spaces etc.) is left as it is
+                        bundle_logger.debug(f"[DS]..{os.path.basename(source_path)}: skipped image {name}: {e}")
+            if result["images"]:
+                pdf.save(output_path)
+                result["output_path"] = output_path
+                result["bytes_after"] = os.path.getsize(output_path)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def _downsample_all(sources, outputs, target_dpi, jpeg_quality, greyscale, max_workers):
+    arguments = [sources, outputs, [target_dpi] * len(sources), [jpeg_quality] * len(sources),
+                 [greyscale] * len(sources)]
+    if max_workers == 1 or len(sources) == 1:
+        return list(map(downsample_pdf, *arguments))
+    try:
+        # spawn rather than fork: bundles are made from inside a threaded web server.
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(sources)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(downsample_pdf, *arguments))
+    except BrokenProcessPool as e:
+        bundle_logger.warning(f"[DS]Downsampling process pool failed ({e}). Downsampling in-process instead.")
+        return list(map(downsample_pdf, *arguments))
+
+
+def downsample_input_files(preflight_records, output_dir, target_dpi=150, jpeg_quality=75, greyscale=False,
+                           size_budget=None, max_workers=None):
+    '''
+    Downsample the images in every input file that preflighted cleanly (see the module docstring),
+    pointing each changed file's PreflightRecord.normalized_path at its downsampled copy in output_dir.
+    size_budget, if given, is the total size in bytes the inputs should fit in.
+    Returns a summary dict for the bundle's metrics.
+    '''
+    records = [record for record in preflight_records.values() if record.usable]
+    sources = [record.normalized_path or record.path for record in records]
+    bytes_before = sum(os.path.getsize(source) for source in sources)
+    summary = {"downsample_bytes_before": bytes_before, "downsample_bytes_after": bytes_before,
+               "downsampled_images": 0, "downsample_dpi": None}
+    if not sources or (size_budget and bytes_before <= size_budget):
+        bundle_logger.debug(f"[DS]Inputs total {bytes_before} bytes, within budget {size_budget}: not downsampling")
+        return summary
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = [os.path.join(output_dir, f"{idx:04}_{os.path.basename(record.path)}") for idx, record in enumerate(records)]
+    max_workers = max_workers or os.cpu_count() or 1
+    dpi_steps = [target_dpi] + [dpi for dpi in DOWNSAMPLE_DPI_STEPS if dpi < target_dpi] if size_budget else [target_dpi]
+    for dpi in dpi_steps:
+        bundle_logger.debug(f"[DS]Downsampling images in {len(sources)} file(s) to {dpi} dpi")
+        results = _downsample_all(sources, outputs, dpi, jpeg_quality, greyscale, max_workers)
+        bytes_after = sum(result["bytes_after"] for result in results)
+        if not size_budget or bytes_after <= size_budget:
+            break
+        bundle_logger.info(f"[DS]..{bytes_after} bytes at {dpi} dpi is still over the budget of {size_budget}")
+    for record, result in zip(records, results):
+        if result["error"]:
+            bundle_logger.error(f"[DS]..{os.path.basename(record.path)}: could not downsample: {result['error']}")
+        elif result["output_path"]:
+            record.normalized_path = result["output_path"]
+    summary.update(downsample_bytes_after=bytes_after, downsample_dpi=dpi,
+                   downsampled_images=sum(result["images"] for result in results))
+    bundle_logger.info(f"[DS]Downsampled {summary['downsampled_images']} image(s) to {dpi} dpi: "
+                       f"inputs {bytes_before} -> {bytes_after} bytes")
+    return summary
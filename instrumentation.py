@@ -0,0 +1,275 @@
+'''
+Timing and memory instrumentation for create_bundle.
+
+A BundleMetrics follows create_bundle's stages (see bundle.report_progress
+and BUNDLE_STAGES) and records, for each: wall time; CPU time of the thread
+making the bundle and of the worker processes it waited for; and resident
+memory at the end of the stage (see current_rss_mb), its growth and its
+peak during it (see reset_stage_peak). to_dict() gives one flat, JSON-able
+record per bundle, which create_bundle logs as "[METRICS]" and passes to
+bundle_config.metrics_callback. app.py feeds those records to a
+MetricsRegistry for its /metrics endpoint.
+
+Memory and worker CPU time belong to the whole process, so bundles made at
+the same time share them (and one bundle's stage starting resets the peak
+for the others). Thread CPU time isn't shared.
+'''
+import resource
+import threading
+import time
+
+# bundles are sorted into sizes by their total page count, for the histograms:
+BUNDLE_SIZE_CLASSES = [(100, "lt100"), (1000, "lt1000"), (10000, "lt10000")]
+LARGEST_BUNDLE_SIZE_CLASS = "ge10000"
+STAGE_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BUNDLE_SECONDS_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+STAGE_RSS_GROWTH_MB_BUCKETS = (0, 1, 5, 10, 50, 100, 250, 500, 1000)
+
+
+# the process's peak resident memory before reset_stage_peak last reset it, in MB:
+_peak_before_reset_mb = 0
+_peak_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    '''
+    The process's peak resident memory since it started.
+    '''
+    # ru_maxrss is in kilobytes on Linux, and goes back down when reset_stage_peak resets the high-water mark
+    return max(_peak_before_reset_mb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def high_water_rss_mb():
+    '''
+    The process's peak resident memory since reset_stage_peak last reset it (VmHWM
+    in /proc/self/status, which unlike current_rss_mb counts file-backed pages too),
+    or None where /proc/self/status doesn't say.
+    '''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_stage_peak():
+    '''
+    Reset the process's resident memory high-water mark, so that high_water_rss_mb
+    gives the peak from now on. Returns False where it can't be reset (i.e. not Linux).
+    '''
+    global _peak_before_reset_mb
+    with _peak_lock:
+        peak = peak_rss_mb()
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            return False
+        _peak_before_reset_mb = peak
+    return True
+
+
+def children_cpu_seconds():
+    # CPU time of worker processes (e.g. preflight's and downsample's pools) once they've been waited for
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def current_rss_mb():
+    '''
+    The process's resident memory now, not counting file-backed pages (which PDFs
+    opened with mmap add to, and which the kernel can drop when it needs the memory).
+    Falls back to peak_rss_mb where /proc/self/status doesn't say (i.e. not Linux).
+    '''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return peak_rss_mb()
+
+
+def bundle_size_class(total_pages):
+    for limit, size_class in BUNDLE_SIZE_CLASSES:
+        if total_pages < limit:
+            return size_class
+    return LARGEST_BUNDLE_SIZE_CLASS
+
+
+class BundleMetrics:
+    '''
+    Measurements for one bundle. Call start_stage() as each stage begins
+    and finish() at the end; to_dict() then gives the record.
+    '''
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.stages = {}
+        self.status = "running"
+        self.counts = {}
+        self._current_stage = None
+        self._started = time.perf_counter()
+        self._started_cpu = time.thread_time()
+        self._started_children_cpu = children_cpu_seconds()
+        self._stage_started = None
+        self._stage_started_cpu = None
+        self._stage_started_children_cpu = None
+        self._stage_started_rss = None
+        self._stage_peak_reset = False
+        self._finished = None
+        self._finished_cpu = None
+
+    def start_stage(self, stage):
+        self._end_stage()
+        self._current_stage = stage
+        self._stage_started = time.perf_counter()
+        self._stage_started_cpu = time.thread_time()
+        self._stage_started_children_cpu = children_cpu_seconds()
+        self._stage_started_rss = current_rss_mb()
+        self._stage_peak_reset = reset_stage_peak()
+
+    def _end_stage(self):
+        if self._current_stage is None:
+            return
+        rss = current_rss_mb()
+        # without a high-water mark to go on, the peak is only known to be at least the start and end:
+        peak = max(rss, self._stage_started_rss)
+        high_water = high_water_rss_mb() if self._stage_peak_reset else None
+        if high_water is not None:
+            peak = max(peak, high_water)
+        # a stage that's entered more than once (e.g. "toc", around "dummy_toc") adds up its times:
+        previous = self.stages.get(self._current_stage, {})
+        self.stages[self._current_stage] = {
+            "wall_seconds": round(previous.get("wall_seconds", 0) + time.perf_counter() - self._stage_started, 4),
+            "cpu_seconds": round(previous.get("cpu_seconds", 0) + time.thread_time() - self._stage_started_cpu, 4),
+            "children_cpu_seconds": round(previous.get("children_cpu_seconds", 0) + children_cpu_seconds()
+                                          - self._stage_started_children_cpu, 4),
+            "rss_mb": round(rss, 1),
+            "rss_growth_mb": round(previous.get("rss_growth_mb", 0) + rss - self._stage_started_rss, 1),
+            "peak_rss_mb": round(max(previous.get("peak_rss_mb", 0), peak), 1),
+        }
+        self._current_stage = None
+
+    def count(self, **counts):
+        '''
+        Record page counts, bytes written and so on, e.g. count(main_pages=120).
+        '''
+        self.counts.update(counts)
+
+    def finish(self, status="ok"):
+        self._end_stage()
+        self.status = status
+        self._finished = time.perf_counter()
+        self._finished_cpu = time.thread_time()
+
+    def to_dict(self):
+        wall_end = self._finished if self._finished is not None else time.perf_counter()
+        cpu_end = self._finished_cpu if self._finished_cpu is not None else time.thread_time()
+        total_pages = self.counts.get("total_pages", 0)
+        return {
+            "session_id": self.session_id,
+            "status": self.status,
+            "wall_seconds": round(wall_end - self._started, 4),
+            "cpu_seconds": round(cpu_end - self._started_cpu, 4),
+            "children_cpu_seconds": round(children_cpu_seconds() - self._started_children_cpu, 4),
+            "rss_mb": round(current_rss_mb(), 1),
+            "process_peak_rss_mb": round(peak_rss_mb(), 1),
+            "size_class": bundle_size_class(total_pages),
+            **self.counts,
+            "stages": dict(self.stages),
+        }
+
+
+class Histogram:
+    '''
+    A Prometheus-style histogram: cumulative bucket counts, a sum and a count, per set of labels.
+    '''
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # label tuple -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for idx, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                series[idx] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.series.items()):
+            labels = ",".join(f'{label}="{value}"' for label, value in key)
+            separator = "," if labels else ""
+            for upper_bound, bucket_count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{upper_bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    Collects bundle records (BundleMetrics.to_dict) and renders them in the
+    Prometheus text format. observe_bundle is safe to call from several threads.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = Histogram("buntool_stage_seconds", "Wall time of each create_bundle stage.",
+                                       STAGE_SECONDS_BUCKETS)
+        self.stage_cpu_seconds = Histogram("buntool_stage_cpu_seconds", "CPU time of each create_bundle stage, including its worker processes'.",
+                                           STAGE_SECONDS_BUCKETS)
+        self.bundle_seconds = Histogram("buntool_bundle_seconds", "Wall time of create_bundle.",
+                                        BUNDLE_SECONDS_BUCKETS)
+        self.stage_rss_growth = Histogram("buntool_stage_rss_growth_megabytes",
+                                          "Growth in resident memory during each create_bundle stage.",
+                                          STAGE_RSS_GROWTH_MB_BUCKETS)
+        self.bundles_total = {}  # (status, size_class) -> count
+        self.pages_total = 0
+        self.bytes_written_total = 0
+
+    def observe_bundle(self, record):
+        with self.lock:
+            size_class = record["size_class"]
+            self.bundle_seconds.observe(record["wall_seconds"], size=size_class, status=record["status"])
+            for stage, stage_record in record["stages"].items():
+                self.stage_seconds.observe(stage_record["wall_seconds"], stage=stage, size=size_class)
+                self.stage_cpu_seconds.observe(stage_record["cpu_seconds"] + stage_record["children_cpu_seconds"],
+                                               stage=stage, size=size_class)
+                self.stage_rss_growth.observe(stage_record["rss_growth_mb"], stage=stage, size=size_class)
+            key = (record["status"], size_class)
+            self.bundles_total[key] = self.bundles_total.get(key, 0) + 1
+            self.pages_total += record.get("total_pages", 0)
+            self.bytes_written_total += record.get("output_bytes", 0) + record.get("zip_bytes", 0)
+
+    def render(self):
+        with self.lock:
+            lines = ["# HELP buntool_bundles_total Bundles made, by outcome and size.",
+                     "# TYPE buntool_bundles_total counter"]
+            for (status, size_class), count in sorted(self.bundles_total.items()):
+                lines.append(f'buntool_bundles_total{{size="{size_class}",status="{status}"}} {count}')
+            lines.extend(["# HELP buntool_pages_total Pages in bundles made.", "# TYPE buntool_pages_total counter",
+                          f"buntool_pages_total {self.pages_total}"])
+            lines.extend(["# HELP buntool_bytes_written_total Bytes of bundle PDFs and zips written.",
+                          "# TYPE buntool_bytes_written_total counter",
+                          f"buntool_bytes_written_total {self.bytes_written_total}"])
+            lines.extend(["# HELP buntool_rss_megabytes Resident memory of this process (see current_rss_mb).",
+                          "# TYPE buntool_rss_megabytes gauge",
+                          f"buntool_rss_megabytes {round(current_rss_mb(), 1)}"])
+            lines.extend(["# HELP buntool_peak_rss_megabytes Peak resident memory of this process.",
+                          "# TYPE buntool_peak_rss_megabytes gauge",
+                          f"buntool_peak_rss_megabytes {round(peak_rss_mb(), 1)}"])
+            for histogram in (self.bundle_seconds, self.stage_seconds, self.stage_cpu_seconds, self.stage_rss_growth):
+                lines.extend(histogram.render())
+            return "\n".join(lines) + "\n"
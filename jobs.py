@@ -0,0 +1,131 @@
+'''
+Background jobs for bundle creation.
+
+Building a big bundle inside the HTTP request ties up one of waitress's
+threads for the whole time, and can run past its channel_timeout. In job
+mode, app.py saves the uploads, hands the rest of the work to a JobQueue and
+returns a job id straight away. The browser then polls /jobs/<id> for
+progress and fetches /jobs/<id>/result at the end.
+
+The queue is bounded twice over: max_workers bundles are built at once,
+and at most max_queue_depth more wait their turn. Beyond that, submit
+raises JobQueueFull so the web tier can turn the request away (503)
+rather than pile up work it can't get to.
+
+Finished jobs are kept for retention_seconds so their status and result
+can still be fetched, then forgotten.
+'''
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class BundleJob:
+    '''
+    The state of one queued bundle, as reported by /jobs/<id>.
+    status goes queued -> running -> done (or failed).
+    stage is the pipeline stage the bundle is in, as reported
+    by create_bundle's progress callback (see bundle.BUNDLE_STAGES).
+    '''
+
+    def __init__(self, job_id, session_id=None):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.status = "queued"
+        self.stage = None
+        self.stages_completed = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update_stage(self, stage):
+        if self.stage and self.stage not in self.stages_completed:
+            self.stages_completed.append(self.stage)
+        self.stage = stage
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "stage": self.stage,
+            "stages_completed": list(self.stages_completed),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    '''
+    A bounded pool of worker threads which run bundle jobs.
+    target is called as target(job, *args) on a worker thread; whatever it
+    returns becomes job.result, and an exception it raises marks the job failed.
+    '''
+
+    def __init__(self, max_workers=1, max_queue_depth=8, retention_seconds=3600, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.retention_seconds = retention_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bundle-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def pending_count(self):
+        with self.lock:
+            return len([job for job in self.jobs.values() if not job.finished])
+
+    def submit(self, target, *args, session_id=None):
+        with self.lock:
+            self._prune_finished_jobs()
+            pending = len([job for job in self.jobs.values() if not job.finished])
+            if pending >= self.max_workers + self.max_queue_depth:
+                raise JobQueueFull(f"{pending} bundles are already queued or running")
+            job = BundleJob(uuid.uuid4().hex, session_id)
+            self.jobs[job.job_id] = job
+        self.logger.debug(f"[JOB]Queued job {job.job_id} (session {session_id}); {pending + 1} pending")
+        self.executor.submit(self._run, job, target, args)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, target, args):
+        job.status = "running"
+        job.started_at = time.time()
+        self.logger.debug(f"[JOB]Starting job {job.job_id}")
+        try:
+            job.result = target(job, *args)
+            job.update_stage(None)
+            job.finished_at = time.time()
+            job.status = "done"
+            self.logger.debug(f"[JOB]Job {job.job_id} done")
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.status = "failed"
+            self.logger.error(f"[JOB]Job {job.job_id} failed: {e}")
+
+    def _prune_finished_jobs(self):
+        # only call with self.lock held
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
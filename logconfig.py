@@ -0,0 +1,230 @@
+'''
+Logging for BunTool.
+
+Every bundle gets a session id, and everything logged while making it
+(by bundle.py's bundle_logger or by the web app) is tagged with that id:
+set_log_session() puts it in a context variable for the current thread,
+and a filter copies it onto each log record as record.session_id.
+
+Records aren't written out on the thread that logs them. The loggers
+have a single QueueHandler, and a QueueListener thread passes the
+records to one SessionLogRouter. The router writes each record to the
+shared handlers (the console, and in production a single log file), and
+to its session's own log file if that session has one. So log I/O stays
+off the request path, and no handlers are added or removed per session.
+
+There are two modes, chosen with BUNTOOL_LOG_MODE:
+- "session" (the default): DEBUG logging, and one log file per session,
+  logs/buntool_<session_id>.log, as BunTool has always written. It's
+  the one to send in with a bug report.
+- "production": INFO logging and up, to the console and one shared file
+  (logs/buntool.log) with the session id on every line. Debug lines
+  aren't formatted at all (hence the isEnabledFor guards around the big
+  debug dumps in bundle.py and app.py).
+'''
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_MODE_SESSION = "session"
+LOG_MODE_PRODUCTION = "production"
+# which component each logger's lines are marked with in session log files:
+LOGGER_TAGS = {'bundle_logger': 'BUN'}
+DEFAULT_LOGGER_TAG = 'APP'
+
+_current_session_id = contextvars.ContextVar('buntool_session_id', default='-')
+_setup_lock = threading.Lock()
+_log_queue = None
+_listener = None
+_router = None
+_log_mode = None
+_open_sessions = {}  # session id -> number of callers which have it open
+
+
+def set_log_session(session_id):
+    '''
+    Tag everything this thread logs from now on with session_id.
+    Returns a token for reset_log_session.
+    '''
+    return _current_session_id.set(session_id or '-')
+
+
+def reset_log_session(token):
+    _current_session_id.reset(token)
+
+
+def current_log_session():
+    return _current_session_id.get()
+
+
+class SessionContextFilter(logging.Filter):
+    '''
+    Copies the current session id (see set_log_session) onto each record,
+    on the thread that logged it, before the record is queued.
+    '''
+
+    def filter(self, record):
+        if not hasattr(record, 'session_id'):
+            record.session_id = _current_session_id.get()
+        return True
+
+
+class SessionFileFormatter(logging.Formatter):
+    '''
+    The format session log files have always had: time-LEVEL-[BUN or APP]: message.
+    '''
+
+    def __init__(self):
+        super().__init__('%(asctime)s-%(levelname)s-[%(logger_tag)s]: %(message)s')
+
+    def format(self, record):
+        record.logger_tag = LOGGER_TAGS.get(record.name, DEFAULT_LOGGER_TAG)
+        return super().format(record)
+
+
+class SessionLogRouter(logging.Handler):
+    '''
+    The one handler behind the log queue. It sends each record to every
+    shared handler, and to the log file of the record's session, if
+    open_session_log has been called for it.
+    Session files are opened and closed by control records which come
+    through the queue (see open_session_log), so they're opened before the
+    session's first line and closed after its last.
+    '''
+
+    def __init__(self, shared_handlers):
+        super().__init__()
+        self.shared_handlers = shared_handlers
+        self.session_handlers = {}
+
+    def handle(self, record):
+        control = getattr(record, 'buntool_control', None)
+        if control:
+            self._control(control, record.session_id, getattr(record, 'log_path', None))
+            return True
+        for handler in self.shared_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        session_handler = self.session_handlers.get(getattr(record, 'session_id', None))
+        if session_handler:
+            session_handler.handle(record)
+        return True
+
+    def _control(self, control, session_id, log_path):
+        if control == 'open' and session_id not in self.session_handlers:
+            session_handler = logging.FileHandler(log_path)
+            session_handler.setFormatter(SessionFileFormatter())
+            self.session_handlers[session_id] = session_handler
+        elif control == 'close':
+            session_handler = self.session_handlers.pop(session_id, None)
+            if session_handler:
+                session_handler.close()
+
+    def emit(self, record):
+        self.handle(record)
+
+    def close(self):
+        for session_handler in self.session_handlers.values():
+            session_handler.close()
+        self.session_handlers = {}
+        for handler in self.shared_handlers:
+            handler.close()
+        super().close()
+
+
+def log_mode():
+    return _log_mode or os.environ.get('BUNTOOL_LOG_MODE', LOG_MODE_SESSION)
+
+
+def setup_logging(logs_dir=None, logger_names=('bundle_logger',), mode=None):
+    '''
+    Route the named loggers through the log queue. Safe to call more than once
+    (e.g. from app.py and again from each create_bundle): the queue and its
+    listener are only set up the first time, and later calls just add any new loggers.
+    '''
+    global _log_queue, _listener, _router, _log_mode
+    with _setup_lock:
+        if _listener is None:
+            _log_mode = mode or os.environ.get('BUNTOOL_LOG_MODE', LOG_MODE_SESSION)
+            console_handler = logging.StreamHandler()
+            shared_handlers = [console_handler]
+            if _log_mode == LOG_MODE_PRODUCTION:
+                shared_formatter = logging.Formatter('%(asctime)s-%(levelname)s-%(name)s-[%(session_id)s]: %(message)s')
+                logs_dir = logs_dir or os.path.join('/tmp', 'logs')
+                os.makedirs(logs_dir, exist_ok=True)
+                shared_handlers.append(logging.FileHandler(os.path.join(logs_dir, 'buntool.log')))
+            else:
+                shared_formatter = SessionFileFormatter()
+            for handler in shared_handlers:
+                handler.setFormatter(shared_formatter)
+            _log_queue = queue.Queue()
+            _router = SessionLogRouter(shared_handlers)
+            _listener = QueueListener(_log_queue, _router)
+            _listener.start()
+            atexit.register(stop_logging)
+        level = logging.INFO if _log_mode == LOG_MODE_PRODUCTION else logging.DEBUG
+        for logger_name in logger_names:
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(level)
+            logger.propagate = False
+            if not any(isinstance(handler, QueueHandler) and handler.queue is _log_queue
+                       for handler in logger.handlers):
+                for handler in list(logger.handlers):
+                    logger.removeHandler(handler)  # e.g. Flask's default stderr handler, or an old queue's
+                queue_handler = QueueHandler(_log_queue)
+                queue_handler.addFilter(SessionContextFilter())
+                logger.addHandler(queue_handler)
+
+
+def _send_control(control, session_id, log_path=None):
+    record = logging.makeLogRecord({'msg': '', 'buntool_control': control, 'session_id': session_id,
+                                    'log_path': log_path})
+    _log_queue.put_nowait(record)
+
+
+def open_session_log(session_id, logs_dir):
+    '''
+    In session mode, start writing session_id's records to logs_dir/buntool_<session_id>.log.
+    Several callers (app.py and create_bundle) may open the same session; each should
+    call close_session_log once it's done, and the file is closed after the last of them.
+    In production mode there are no session files, and this does nothing.
+    '''
+    if _listener is None or log_mode() != LOG_MODE_SESSION:
+        return
+    os.makedirs(logs_dir, exist_ok=True)
+    with _setup_lock:
+        _open_sessions[session_id] = _open_sessions.get(session_id, 0) + 1
+        if _open_sessions[session_id] > 1:
+            return
+        _send_control('open', session_id, os.path.join(logs_dir, f"buntool_{session_id}.log"))
+
+
+def close_session_log(session_id):
+    '''
+    Close session_id's log file, once everything it logged so far has been written.
+    '''
+    with _setup_lock:
+        if _listener is None or session_id not in _open_sessions:
+            return
+        _open_sessions[session_id] -= 1
+        if _open_sessions[session_id] > 0:
+            return
+        del _open_sessions[session_id]
+        _send_control('close', session_id)
+
+
+def stop_logging():
+    '''
+    Write out anything still queued and stop the listener thread.
+    '''
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+        _open_sessions.clear()
+    if listener:
+        listener.stop()
+        _router.close()
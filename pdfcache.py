@@ -0,0 +1,230 @@
+'''
+An on-disk cache of input PDFs, keyed by their sha256 and shared between
+sessions, threads and processes.
+
+Each entry is a directory, cache_dir/<first two hex digits>/<key>/, holding:
+- meta.json: the file's PreflightRecord (see PreflightRecord.to_dict);
+- normalized.pdf, only for files pikepdf had to repair or decrypt: a clean
+  copy, which the merge uses instead of the original.
+With BundleConfig.reuse_paginated_body it also holds paginated bundle bodies,
+keyed by bundle.paginated_body_fingerprint: meta.json ("kind": "body") and body.pdf.
+
+Limits:
+- the cache is kept within max_bytes by evicting the least recently used
+  entries (see evict), but not ones used in the last EVICTION_GRACE_SECONDS,
+  which may be open in a bundle being made;
+- nothing bigger than MAX_ENTRY_FRACTION of max_bytes is stored (see fits).
+Writes are atomic. A bundle that finds its cached copy gone falls back to
+the original file, or merges afresh.
+
+normalized.pdf and body.pdf are copies of users' documents: keep the cache
+directory as private as the session temp dirs.
+'''
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from pikepdf import Pdf
+
+bundle_logger = logging.getLogger('bundle_logger')
+
+# bump this when the shape of meta.json changes, to ignore older entries:
+PDF_CACHE_VERSION = 1
+META_FILENAME = "meta.json"
+NORMALIZED_FILENAME = "normalized.pdf"
+BODY_FILENAME = "body.pdf"
+# an entry with no meta.json this old was abandoned part-written:
+ORPHAN_ENTRY_SECONDS = 3600
+# entries used more recently than this may be open in a bundle being made, so aren't evicted:
+EVICTION_GRACE_SECONDS = 15 * 60
+# the largest file an entry may hold, as a fraction of max_bytes:
+MAX_ENTRY_FRACTION = 0.25
+# while the cache is over max_bytes, evict() looks through it at most this often:
+EVICTION_INTERVAL_SECONDS = 60
+
+
+class PdfCache:
+    '''
+    A content-addressed, size-bounded, on-disk cache of input PDF metadata
+    and normalized copies. See the module docstring.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # the cache's size when evict() last looked through it, plus what's been written since
+        # (by this PdfCache: other processes' writes only show up at the next look), or None:
+        self._known_size = None
+        self._last_scanned = 0.0
+        self._size_lock = threading.Lock()
+
+    def _add_known_size(self, number_of_bytes):
+        with self._size_lock:
+            if self._known_size is not None:
+                self._known_size += number_of_bytes
+
+    def fits(self, number_of_bytes):
+        '''
+        Whether a file of number_of_bytes is small enough to be cached (see MAX_ENTRY_FRACTION).
+        '''
+        return number_of_bytes <= self.max_bytes * MAX_ENTRY_FRACTION
+
+    def entry_dir(self, sha256):
+        return os.path.join(self.cache_dir, sha256[:2], sha256)
+
+    def _write_atomically(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+            self._add_known_size(os.path.getsize(path))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_metadata(self, sha256):
+        '''
+        Return the cached metadata dict for sha256 (see PreflightRecord.to_dict),
+        or None if there isn't one. A hit counts as a use for LRU eviction.
+        '''
+        meta_path = os.path.join(self.entry_dir(sha256), META_FILENAME)
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if metadata.get("cache_version") != PDF_CACHE_VERSION:
+            return None
+        normalized_path = os.path.join(self.entry_dir(sha256), NORMALIZED_FILENAME)
+        if metadata.get("normalized") and not os.path.exists(normalized_path):
+            return None
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        metadata["normalized_path"] = normalized_path if metadata.get("normalized") else None
+        return metadata
+
+    def put_metadata(self, sha256, metadata):
+        '''
+        Store the metadata dict for sha256. If the entry has a normalized copy, say so
+        with metadata['normalized'] = True (put_normalized does this).
+        '''
+        metadata = dict(metadata, cache_version=PDF_CACHE_VERSION)
+        metadata.pop("normalized_path", None)
+        meta_path = os.path.join(self.entry_dir(sha256), META_FILENAME)
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f)
+        self._write_atomically(meta_path, write)
+
+    def put_normalized(self, sha256, source_path):
+        '''
+        Save a clean copy of source_path (repaired and decrypted by pikepdf as it opens it)
+        into the entry for sha256, and return its path, or None if it's too big to cache (see fits).
+        '''
+        if not self.fits(os.path.getsize(source_path)):
+            return None
+        normalized_path = os.path.join(self.entry_dir(sha256), NORMALIZED_FILENAME)
+
+        def write(tmp_path):
+            with Pdf.open(source_path) as pdf:
+                pdf.save(tmp_path)
+        self._write_atomically(normalized_path, write)
+        return normalized_path
+
+    def get_body(self, fingerprint):
+        '''
+        Return the path of the cached paginated body with this fingerprint, or None.
+        '''
+        metadata = self.get_metadata(fingerprint)
+        if not metadata or metadata.get("kind") != "body":
+            return None
+        body_path = os.path.join(self.entry_dir(fingerprint), BODY_FILENAME)
+        return body_path if os.path.exists(body_path) else None
+
+    def put_body(self, fingerprint, pdf, expected_bytes=None):
+        '''
+        Save the pikepdf Pdf `pdf` as the paginated body with this fingerprint, and return its path.
+        expected_bytes is roughly how big it will be (e.g. the size of the files merged into it):
+        if that's too big to cache (see fits), nothing is written, and None is returned.
+        None is returned too if the body turns out too big once it's written.
+        '''
+        if expected_bytes is not None and not self.fits(expected_bytes):
+            return None
+        body_path = os.path.join(self.entry_dir(fingerprint), BODY_FILENAME)
+        self._write_atomically(body_path, pdf.save)
+        if not self.fits(os.path.getsize(body_path)):
+            self._add_known_size(-os.path.getsize(body_path))
+            shutil.rmtree(self.entry_dir(fingerprint), ignore_errors=True)
+            return None
+        self.put_metadata(fingerprint, {"kind": "body", "page_count": len(pdf.pages)})
+        self.evict()
+        return body_path
+
+    def size(self):
+        return sum(entry_size for _, _, entry_size in self._entries())
+
+    def _entries(self):
+        # (last used, entry dir, bytes) for every entry in the cache
+        entries = []
+        for prefix in os.scandir(self.cache_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if not entry.is_dir():
+                    continue
+                try:
+                    entry_size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    meta_path = os.path.join(entry.path, META_FILENAME)
+                    if os.path.exists(meta_path):
+                        last_used = os.stat(meta_path).st_mtime
+                    elif time.time() - entry.stat().st_mtime < ORPHAN_ENTRY_SECONDS:
+                        continue  # probably still being written
+                    else:
+                        last_used = 0  # left behind by a failed write: evict first
+                except OSError:
+                    continue
+                entries.append((last_used, entry.path, entry_size))
+        return entries
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is within max_bytes,
+        except for those used in the last EVICTION_GRACE_SECONDS.
+        Returns the number of entries removed.
+        The cache is only looked through if what's been written since it was last
+        looked through may have taken it over max_bytes, and then no more than once
+        every EVICTION_INTERVAL_SECONDS.
+        '''
+        with self._size_lock:
+            now = time.time()
+            if self._known_size is not None and (self._known_size <= self.max_bytes
+                                                 or now - self._last_scanned < EVICTION_INTERVAL_SECONDS):
+                return 0
+            self._last_scanned = now
+        entries = sorted(self._entries())
+        total_size = sum(entry_size for _, _, entry_size in entries)
+        removed = 0
+        grace_cutoff = time.time() - EVICTION_GRACE_SECONDS
+        for last_used, path, entry_size in entries:
+            if total_size <= self.max_bytes:
+                break
+            if last_used > grace_cutoff:
+                bundle_logger.debug(f"[PC]PDF cache is {total_size} bytes, but the rest of it is in recent use")
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= entry_size
+            removed += 1
+        with self._size_lock:
+            self._known_size = total_size
+        if removed:
+            bundle_logger.debug(f"[PC]Evicted {removed} entries from the PDF cache; {total_size} bytes remain")
+        return removed
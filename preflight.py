@@ -0,0 +1,245 @@
+'''
+Preflight for bundle inputs.
+
+Before anything is merged, each input PDF is opened once to find out
+what's in it: page count, page sizes, creation date, whether it is
+encrypted or damaged, and a hash of its contents. That is collected in
+a PreflightRecord, which the rest of create_bundle reads from instead of
+opening the file again.
+
+Opening a few thousand PDFs one after another is slow, and each one is
+independent of the others, so the work is spread over a pool of processes.
+Small batches are done in-process, where starting the pool would cost
+more than it saves.
+
+This module is deliberately light on imports (just pikepdf) so that the
+worker processes start quickly.
+'''
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from pikepdf import Pdf, PasswordError, PdfError
+
+bundle_logger = logging.getLogger('bundle_logger')
+
+# Below this many files, preflight runs in-process rather than starting a pool.
+PREFLIGHT_INLINE_THRESHOLD = 16
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class PreflightRecord:
+    '''
+    What preflight found out about one input PDF.
+    page_sizes is a list of (width, height) from each page's mediabox, in points.
+    creation_date is already formatted for the index (DD.MM.YYYY), or None.
+    error is None if the file opened cleanly; otherwise it says why not,
+    and encrypted or damaged says which kind of problem it was.
+    repaired is True if pikepdf had to repair the file to open it.
+    normalized_path, if set, is a clean copy of the file (see pdfcache.py)
+    which the merge should use instead of path.
+    '''
+
+    def __init__(self, path, page_count=0, page_sizes=None, creation_date=None, encrypted=False, damaged=False,
+                 sha256=None, error=None, repaired=False, normalized_path=None):
+        self.path = path
+        self.page_count = page_count
+        self.page_sizes = page_sizes if page_sizes else []
+        self.creation_date = creation_date
+        self.encrypted = encrypted
+        self.damaged = damaged
+        self.sha256 = sha256
+        self.error = error
+        self.repaired = repaired
+        self.normalized_path = normalized_path
+
+    @property
+    def usable(self):
+        return self.error is None
+
+    @property
+    def needs_normalizing(self):
+        # worth keeping a clean copy of: saves repairing or decrypting it every time it's opened
+        return self.usable and (self.repaired or self.encrypted)
+
+    def to_dict(self):
+        # the parts of the record which depend only on the file's contents, for the PDF cache
+        return {
+            "page_count": self.page_count,
+            "page_sizes": self.page_sizes,
+            "creation_date": self.creation_date,
+            "encrypted": self.encrypted,
+            "repaired": self.repaired,
+        }
+
+    @classmethod
+    def from_dict(cls, path, sha256, metadata):
+        return cls(
+            path,
+            page_count=metadata["page_count"],
+            page_sizes=[tuple(size) for size in metadata["page_sizes"]],
+            creation_date=metadata["creation_date"],
+            encrypted=metadata["encrypted"],
+            repaired=metadata["repaired"],
+            sha256=sha256,
+            normalized_path=metadata.get("normalized_path"),
+        )
+
+    def __repr__(self):
+        return (f"PreflightRecord({os.path.basename(self.path)!r}, pages={self.page_count}, "
+                f"encrypted={self.encrypted}, damaged={self.damaged}, error={self.error!r})")
+
+
+def parse_pdf_creation_date(creation_date):
+    '''
+    Turn a PDF /CreationDate (D:YYYYMMDDHHmmSS...) into DD.MM.YYYY.
+    Returns None if there's no date or it can't be read.
+    '''
+    if not creation_date:
+        return None
+    try:
+        date_str = str(creation_date)[2:10]
+        date_obj = datetime.strptime(date_str, '%Y%m%d')
+        return date_obj.strftime('%d.%m.%Y')
+    except ValueError:
+        return None
+
+
+def hash_file(path):
+    '''
+    sha256 of the file's bytes, read in chunks so large PDFs aren't held in memory.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def preflight_pdf(path, sha256=None):
+    '''
+    Open one PDF and fill in its PreflightRecord.
+    If the file's sha256 is already known it can be passed in, and the file isn't hashed again.
+    This runs in the worker processes, so it never raises: problems are
+    recorded on the record for the caller to deal with.
+    '''
+    record = PreflightRecord(path, sha256=sha256)
+    if not record.sha256:
+        try:
+            record.sha256 = hash_file(path)
+        except OSError as e:
+            record.error = f"could not read file: {e}"
+            return record
+    try:
+        with Pdf.open(path) as pdf:
+            record.encrypted = pdf.is_encrypted  # opened, so at most an owner password
+            record.page_count = len(pdf.pages)
+            record.page_sizes = [
+                (float(page.mediabox[2]) - float(page.mediabox[0]),
+                 float(page.mediabox[3]) - float(page.mediabox[1]))
+                for page in pdf.pages
+            ]
+            record.creation_date = parse_pdf_creation_date(pdf.docinfo.get('/CreationDate', None))
+            record.repaired = bool(pdf.get_warnings())
+    except PasswordError as e:
+        record.encrypted = True
+        record.error = f"encrypted with a password: {e}"
+    except PdfError as e:
+        record.damaged = True
+        record.error = f"damaged PDF: {e}"
+    except Exception as e:
+        record.error = f"could not open: {e}"
+    return record
+
+
+def preflight_input_files(input_files, max_workers=None, known_hashes=None, pdf_cache=None):
+    '''
+    Preflight every file in input_files and return a dict of path -> PreflightRecord.
+    max_workers defaults to the number of CPUs.
+    known_hashes is an optional dict of path -> sha256 for files which have already been hashed.
+    pdf_cache is an optional PdfCache (see pdfcache.py). Files found in it aren't opened
+    at all; the rest are preflighted as usual and then added to it.
+    '''
+    input_files = list(dict.fromkeys(input_files))  # drop duplicates, keep order
+    known_hashes = dict(known_hashes) if known_hashes else {}
+    preflight_records = {}
+    if pdf_cache:
+        preflight_records = lookup_cached_records(input_files, known_hashes, pdf_cache)
+        input_files = [path for path in input_files if path not in preflight_records]
+    hashes = [known_hashes.get(path) for path in input_files]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(input_files) < PREFLIGHT_INLINE_THRESHOLD:
+        bundle_logger.debug(f"[PF]Preflighting {len(input_files)} file(s) in-process")
+        records = [preflight_pdf(path, sha256) for path, sha256 in zip(input_files, hashes)]
+    else:
+        max_workers = min(max_workers, len(input_files))
+        bundle_logger.debug(f"[PF]Preflighting {len(input_files)} file(s) across {max_workers} processes")
+        try:
+            # spawn rather than fork: bundles are made from inside a threaded web server.
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                chunksize = max(1, len(input_files) // (max_workers * 4))
+                records = list(executor.map(preflight_pdf, input_files, hashes, chunksize=chunksize))
+        except BrokenProcessPool as e:
+            bundle_logger.warning(f"[PF]Preflight process pool failed ({e}). Preflighting in-process instead.")
+            records = [preflight_pdf(path, sha256) for path, sha256 in zip(input_files, hashes)]
+    for record in records:
+        if record.error:
+            bundle_logger.error(f"[PF]..{os.path.basename(record.path)}: {record.error}")
+        else:
+            bundle_logger.debug(f"[PF]..{record}")
+        preflight_records[record.path] = record
+    if pdf_cache and records:
+        store_cached_records(records, pdf_cache)
+    return preflight_records
+
+
+def lookup_cached_records(input_files, known_hashes, pdf_cache):
+    '''
+    Build PreflightRecords for the input files which are already in pdf_cache.
+    Files whose hash isn't in known_hashes are hashed here (and added to it),
+    since the hash is the cache key.
+    '''
+    cached_records = {}
+    for path in input_files:
+        sha256 = known_hashes.get(path)
+        if not sha256:
+            try:
+                sha256 = known_hashes[path] = hash_file(path)
+            except OSError:
+                continue  # preflight_pdf will record the error
+        metadata = pdf_cache.get_metadata(sha256)
+        if metadata:
+            cached_records[path] = PreflightRecord.from_dict(path, sha256, metadata)
+    if cached_records:
+        bundle_logger.debug(f"[PF]{len(cached_records)} of {len(input_files)} file(s) found in the PDF cache")
+    return cached_records
+
+
+def store_cached_records(records, pdf_cache):
+    '''
+    Add freshly preflighted records to pdf_cache. Files which pikepdf had to repair
+    or decrypt get a normalized copy too, which the record then points to.
+    Files which couldn't be read aren't cached, in case the problem was passing.
+    '''
+    for record in records:
+        if not record.usable or not record.sha256:
+            continue
+        metadata = record.to_dict()
+        try:
+            if record.needs_normalizing:
+                normalized_path = pdf_cache.put_normalized(record.sha256, record.path)
+                if normalized_path:
+                    record.normalized_path = normalized_path
+                    metadata["normalized"] = True
+                    bundle_logger.debug(f"[PF]..cached a normalized copy of {os.path.basename(record.path)}")
+            pdf_cache.put_metadata(record.sha256, metadata)
+        except Exception as e:
+            bundle_logger.warning(f"[PF]Could not add {os.path.basename(record.path)} to the PDF cache: {e}")
+    try:
+        pdf_cache.evict()
+    except OSError as e:
+        bundle_logger.warning(f"[PF]Could not evict from the PDF cache: {e}")
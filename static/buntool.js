@@ -284,11 +284,17 @@ bundleForm.addEventListener('submit', function (e) {
         body: formData
     })
         .then(response => {
-            if (!response.ok) {
+            if (!response.ok && response.status !== 503 && response.status !== 413) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             return response.json();
         })
+        .then(data => {
+            if (data.status === 'queued') {
+                return waitForBundleJob(data, submitButton);
+            }
+            return data;
+        })
         .then(data => {
             if (data.status === 'success') {
                 showProcessMessage('Bundle created successfully!', 'success');
@@ -314,6 +320,33 @@ bundleForm.addEventListener('submit', function (e) {
         });
 });
 
+// Poll a queued bundle job until it finishes, showing its stage on the submit button.
+// Resolves with the job's result, which looks just like a (non-job) /create_bundle response.
+function waitForBundleJob(job, submitButton) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(job.status_url)
+                .then(response => response.json())
+                .then(status => {
+                    if (status.status === 'done' || status.status === 'failed') {
+                        return fetch(job.result_url)
+                            .then(response => response.json())
+                            .then(resolve);
+                    }
+                    if (status.status === 'error') {
+                        throw new Error(status.message || 'Unknown error occurred');
+                    }
+                    const stage = status.stage ? ` (${status.stage})` : '';
+                    const label = status.status === 'queued' ? 'Waiting in queue...' : `Creating Bundle${stage}...`;
+                    submitButton.innerHTML = `<i class="mdi mdi-loading mdi-spin"></i> ${label}`;
+                    setTimeout(poll, 1000);
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
 function showDuplicateModal(filename) {
     const modal = document.getElementById('duplicateModal');
     const message = document.getElementById('duplicateMessage');
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+from pikepdf import Pdf
+
+import bundle
+from preflight import PreflightRecord
+
+
+def make_pdf(path, pages):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pdf = Pdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    pdf.save(path)
+    return path
+
+
+def test_resolve_input_file(tmp_path):
+    lookup = bundle.build_input_file_lookup([str(tmp_path / "a" / "one.pdf"), str(tmp_path / "two.pdf")])
+    assert bundle.resolve_input_file("one.pdf", lookup) == str(tmp_path / "a" / "one.pdf")
+    assert bundle.resolve_input_file("missing.pdf", lookup) is None
+
+
+def test_resolve_input_file_refuses_ambiguous_names(tmp_path):
+    lookup = bundle.build_input_file_lookup([str(tmp_path / "a" / "one.pdf"), str(tmp_path / "b" / "one.pdf")])
+    with pytest.raises(ValueError, match="ambiguous"):
+        bundle.resolve_input_file("one.pdf", lookup)
+
+
+def test_plan_merge_counts_pages_and_sections(tmp_path):
+    first = make_pdf(str(tmp_path / "first.pdf"), 2)
+    second = make_pdf(str(tmp_path / "second.pdf"), 3)
+    index_data = {
+        "section": ("Pleadings", "", "1"),
+        "first.pdf": ("First", "01.01.2024", None),
+        "second.pdf": ("Second", "02.01.2024", None),
+    }
+    toc_entries, merge_sources = bundle.plan_merge([first, second], index_data)
+    assert toc_entries == [("SECTION_BREAK_1", "Pleadings"),
+                           ("001.", "First", "01.01.2024", 0),
+                           ("002.", "Second", "02.01.2024", 2)]
+    assert merge_sources == [(first, 2, None, None), (second, 3, None, None)]
+
+
+def test_plan_merge_skips_files_it_cant_merge(tmp_path):
+    present = make_pdf(str(tmp_path / "present.pdf"), 1)
+    unreadable = make_pdf(str(tmp_path / "unreadable.pdf"), 1)
+    index_data = {
+        "absent.pdf": ("Absent", "", None),
+        "unreadable.pdf": ("Unreadable", "", None),
+        "present.pdf": ("Present", "", None),
+    }
+    records = {unreadable: PreflightRecord(unreadable, error="damaged")}
+    skipped_files = []
+    toc_entries, merge_sources = bundle.plan_merge([present, unreadable], index_data, skipped_files, records)
+    assert skipped_files == ["absent.pdf", "unreadable.pdf"]
+    assert [source_path for source_path, _, _, _ in merge_sources] == [present]
+    assert [toc_entry[1:] for toc_entry in toc_entries] == [("Present", "", 0)]
+
+
+def test_plan_merge_uses_preflight_records_and_normalized_copies(tmp_path):
+    original = make_pdf(str(tmp_path / "original.pdf"), 1)
+    normalized = make_pdf(str(tmp_path / "cache" / "normalized.pdf"), 1)
+    records = {original: PreflightRecord(original, page_count=1, sha256="ab" * 32, normalized_path=normalized)}
+    _, merge_sources = bundle.plan_merge([original], {"original.pdf": ("Original", "", None)}, None, records)
+    assert merge_sources == [(normalized, 1, "ab" * 32, original)]
+
+
+def test_plan_merge_refuses_ambiguous_index_entries(tmp_path):
+    first = make_pdf(str(tmp_path / "a" / "same.pdf"), 1)
+    second = make_pdf(str(tmp_path / "b" / "same.pdf"), 1)
+    with pytest.raises(ValueError, match="ambiguous"):
+        bundle.plan_merge([first, second], {"same.pdf": ("Same", "", None)})
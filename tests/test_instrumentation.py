@@ -0,0 +1,72 @@
+import instrumentation
+from instrumentation import BundleMetrics, Histogram, MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "A test histogram.", (0.1, 1, 10))
+    for value in (0.05, 0.5, 5, 50):
+        histogram.observe(value, stage="merge")
+    assert histogram.render() == [
+        "# HELP test_seconds A test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="merge",le="0.1"} 1',
+        'test_seconds_bucket{stage="merge",le="1"} 2',
+        'test_seconds_bucket{stage="merge",le="10"} 3',
+        'test_seconds_bucket{stage="merge",le="+Inf"} 4',
+        'test_seconds_sum{stage="merge"} 55.55',
+        'test_seconds_count{stage="merge"} 4',
+    ]
+
+
+def test_histogram_keeps_a_series_per_label_set():
+    histogram = Histogram("test_seconds", "A test histogram.", (1,))
+    histogram.observe(0.5, stage="b", size="lt100")
+    histogram.observe(2, stage="a", size="lt100")
+    lines = histogram.render()
+    # labels are sorted by name, and series by their labels
+    assert lines[2] == 'test_seconds_bucket{size="lt100",stage="a",le="1"} 0'
+    assert lines[6] == 'test_seconds_bucket{size="lt100",stage="b",le="1"} 1'
+
+
+def test_histogram_without_labels():
+    histogram = Histogram("test_seconds", "A test histogram.", (1,))
+    histogram.observe(0.5)
+    assert histogram.render()[2:] == ['test_seconds_bucket{le="1"} 1', 'test_seconds_bucket{le="+Inf"} 1',
+                                      "test_seconds_sum{} 0.5", "test_seconds_count{} 1"]
+
+
+def test_bundle_size_class():
+    assert instrumentation.bundle_size_class(99) == "lt100"
+    assert instrumentation.bundle_size_class(100) == "lt1000"
+    assert instrumentation.bundle_size_class(10000) == instrumentation.LARGEST_BUNDLE_SIZE_CLASS
+
+
+def test_stage_entered_twice_adds_up():
+    metrics = BundleMetrics("test")
+    metrics.start_stage("toc")
+    metrics.start_stage("dummy_toc")
+    metrics.start_stage("toc")
+    metrics.finish()
+    record = metrics.to_dict()
+    assert list(record["stages"]) == ["toc", "dummy_toc"]
+    for stage_record in record["stages"].values():
+        assert stage_record["peak_rss_mb"] >= stage_record["rss_mb"]
+
+
+def test_reset_stage_peak_keeps_the_process_peak():
+    peak = instrumentation.peak_rss_mb()
+    instrumentation.reset_stage_peak()
+    assert instrumentation.peak_rss_mb() >= peak
+
+
+def test_registry_renders_a_bundle():
+    metrics = BundleMetrics("test")
+    metrics.start_stage("merge")
+    metrics.count(total_pages=10, output_bytes=1000)
+    metrics.finish()
+    registry = MetricsRegistry()
+    registry.observe_bundle(metrics.to_dict())
+    text = registry.render()
+    assert 'buntool_bundles_total{size="lt100",status="ok"} 1' in text
+    assert "buntool_pages_total 10" in text
+    assert 'buntool_stage_seconds_count{size="lt100",stage="merge"} 1' in text
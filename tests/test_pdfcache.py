@@ -0,0 +1,100 @@
+import os
+import time
+
+from pikepdf import Pdf
+
+import pdfcache
+from pdfcache import PdfCache
+
+
+def make_pdf(path, pages=1):
+    pdf = Pdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    pdf.save(path)
+    return path
+
+
+def age_entry(cache, key, seconds):
+    meta_path = os.path.join(cache.entry_dir(key), pdfcache.META_FILENAME)
+    then = time.time() - seconds
+    os.utime(meta_path, (then, then))
+
+
+def test_metadata_round_trip(tmp_path):
+    cache = PdfCache(str(tmp_path / "cache"))
+    cache.put_metadata("ab" * 32, {"page_count": 3})
+    metadata = cache.get_metadata("ab" * 32)
+    assert metadata["page_count"] == 3
+    assert metadata["normalized_path"] is None
+    assert cache.get_metadata("cd" * 32) is None
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache = PdfCache(str(tmp_path / "cache"), max_bytes=100)
+    for key, age in (("aa" * 32, 3), ("bb" * 32, 2), ("cc" * 32, 1)):
+        cache.put_metadata(key, {"padding": "x" * 40})
+        age_entry(cache, key, pdfcache.EVICTION_GRACE_SECONDS + age * 60)
+    assert cache.evict() >= 1
+    assert cache.get_metadata("aa" * 32) is None
+    assert cache.get_metadata("cc" * 32) is not None
+    assert cache.size() <= cache.max_bytes
+
+
+def test_evict_spares_entries_in_their_grace_period(tmp_path):
+    cache = PdfCache(str(tmp_path / "cache"), max_bytes=100)
+    for key in ("aa" * 32, "bb" * 32, "cc" * 32):
+        cache.put_metadata(key, {"padding": "x" * 40})
+    age_entry(cache, "aa" * 32, pdfcache.EVICTION_GRACE_SECONDS + 60)
+    assert cache.evict() == 1
+    # the others were used just now, so the cache is left over max_bytes rather than evict them
+    assert cache.get_metadata("bb" * 32) is not None
+    assert cache.get_metadata("cc" * 32) is not None
+    assert cache.size() > cache.max_bytes
+
+
+def test_evict_looks_at_most_once_per_interval_while_over(tmp_path, monkeypatch):
+    cache = PdfCache(str(tmp_path / "cache"), max_bytes=100)
+    for key in ("aa" * 32, "bb" * 32, "cc" * 32):
+        cache.put_metadata(key, {"padding": "x" * 40})
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+    cache.evict()
+    cache.evict()
+    assert len(scans) == 1
+    monkeypatch.setattr(cache, "_last_scanned", time.time() - pdfcache.EVICTION_INTERVAL_SECONDS - 1)
+    cache.evict()
+    assert len(scans) == 2
+
+
+def test_put_normalized_refuses_oversized_files(tmp_path):
+    source_path = make_pdf(str(tmp_path / "big.pdf"), pages=20)
+    size = os.path.getsize(source_path)
+    small_cache = PdfCache(str(tmp_path / "small"), max_bytes=int(size / pdfcache.MAX_ENTRY_FRACTION) - 1)
+    assert small_cache.put_normalized("ab" * 32, source_path) is None
+    assert not os.path.exists(small_cache.entry_dir("ab" * 32))
+    big_cache = PdfCache(str(tmp_path / "big"), max_bytes=int(size / pdfcache.MAX_ENTRY_FRACTION) + 1)
+    normalized_path = big_cache.put_normalized("ab" * 32, source_path)
+    assert normalized_path and os.path.exists(normalized_path)
+
+
+def test_put_body_refuses_oversized_bodies(tmp_path):
+    with Pdf.open(make_pdf(str(tmp_path / "body.pdf"), pages=20)) as body:
+        cache = PdfCache(str(tmp_path / "cache"), max_bytes=1000)
+        # too big going by the expected size: nothing is written
+        assert cache.put_body("ab" * 32, body, expected_bytes=1000) is None
+        assert not os.path.exists(cache.entry_dir("ab" * 32))
+        # too big once written: the entry is removed again
+        assert cache.put_body("ab" * 32, body) is None
+        assert not os.path.exists(cache.entry_dir("ab" * 32))
+        assert cache.get_body("ab" * 32) is None
+
+
+def test_put_body_then_get_body(tmp_path):
+    with Pdf.open(make_pdf(str(tmp_path / "body.pdf"), pages=2)) as body:
+        cache = PdfCache(str(tmp_path / "cache"))
+        body_path = cache.put_body("ab" * 32, body)
+    assert cache.get_body("ab" * 32) == body_path
+    with Pdf.open(body_path) as cached:
+        assert len(cached.pages) == 2
@@ -0,0 +1,132 @@
+'''
+Streaming upload ingestion.
+
+By default werkzeug parses the whole multipart form before the view
+sees it: small parts are held in memory and big ones spooled to
+anonymous temporary files, which app.py then copied again with
+file.save(). StreamingUploadRequest replaces the stream factory werkzeug
+uses for each file part. Each upload is written, chunk by chunk as it
+arrives, straight to a named file in the upload spool directory, and is
+hashed on the way through. This means:
+- an upload is never held in memory, and only written to disk once:
+  save_uploaded_file() just renames it into the session's temp dir;
+- the per-file and total size limits are checked as the bytes arrive,
+  so an oversized upload is turned away (413) before all of it is read;
+- each file's sha256 is known without reading it back, so preflight
+  (and anything that caches by content) doesn't need to hash it again.
+
+Spooled files which the view never claims (e.g. because the request
+failed part-way) are deleted when the request is closed.
+'''
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from preflight import hash_file
+
+
+class HashingUploadFile:
+    '''
+    A writable, readable file for one uploaded part, which keeps a running
+    sha256 and byte count of everything written to it.
+    request is the StreamingUploadRequest it belongs to, which holds the limits.
+    '''
+
+    def __init__(self, path, request, filename=None):
+        self.path = path
+        self.request = request
+        self.filename = filename
+        self.size = 0
+        self.claimed = False
+        self._digest = hashlib.sha256()
+        self._file = open(path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        self.request.upload_bytes_received += len(data)
+        max_file_size = self.request.max_file_size
+        if max_file_size is not None and self.size > max_file_size:
+            raise RequestEntityTooLarge(
+                f"{self.filename or 'An uploaded file'} is larger than the maximum allowed size of {max_file_size} bytes")
+        max_content_length = self.request.max_content_length
+        if max_content_length is not None and self.request.upload_bytes_received > max_content_length:
+            raise RequestEntityTooLarge(
+                f"Total size of files exceeds maximum allowed size of {max_content_length} bytes")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline etc. go to the underlying file
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    '''
+    A Flask Request which streams file uploads to disk as they are parsed.
+    Uploads are spooled into app.config['UPLOAD_SPOOL_DIR'] (the system temp
+    dir if unset), and each is limited to app.config['MAX_FILE_SIZE'] bytes
+    (no limit if unset) as well as the usual MAX_CONTENT_LENGTH for the lot.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_bytes_received = 0
+        self.upload_files = []
+
+    @property
+    def max_file_size(self):
+        if current_app:
+            return current_app.config.get('MAX_FILE_SIZE')
+        return None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool_dir = None
+        if current_app:
+            spool_dir = current_app.config.get('UPLOAD_SPOOL_DIR')
+        if not spool_dir:
+            spool_dir = tempfile.gettempdir()
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, f".upload_{uuid.uuid4().hex}.part")
+        upload_file = HashingUploadFile(path, self, filename)
+        self.upload_files.append(upload_file)
+        return upload_file
+
+    def close(self):
+        super().close()
+        for upload_file in self.upload_files:
+            upload_file.close()
+            if not upload_file.claimed and os.path.exists(upload_file.path):
+                os.remove(upload_file.path)
+        self.upload_files = []
+
+
+def claim_uploaded_file(file, filepath):
+    '''
+    Move an uploaded FileStorage to filepath and return its sha256.
+    If it was streamed to disk by StreamingUploadRequest, that's a rename (or a
+    move, if the spool dir is on another filesystem) and the hash is already known.
+    Otherwise it falls back to file.save() and hashes the saved copy.
+    '''
+    stream = file.stream
+    if isinstance(stream, HashingUploadFile):
+        stream.close()
+        try:
+            os.replace(stream.path, filepath)
+        except OSError:
+            shutil.move(stream.path, filepath)
+        stream.claimed = True
+        return stream.hexdigest()
+    file.save(filepath)
+    return hash_file(filepath)